@@ -27,6 +27,11 @@ import stat
 import inspect
 import importlib
 import types
+import bisect
+try:
+    from importlib import reload as _reload_module
+except ImportError:
+    _reload_module = reload # Python 2
 import _apache
 try:
     from html import escape
@@ -38,6 +43,17 @@ try:
 except:
     import dummy_threading as threading
 
+try:
+    from threading import get_ident as _get_ident
+except ImportError:
+    from thread import get_ident as _get_ident # Python 2
+
+try:
+    import asyncio
+    import queue
+except ImportError:
+    asyncio = None # Python 2, no coroutine handlers
+
 # Cache for values of PythonPath that have been seen already.
 _path_cache = {}
 _path_cache_lock = threading.Lock()
@@ -81,6 +97,11 @@ class CallBack:
 
             handler = conn.hlist.handler
 
+            if _dispatch_stats:
+                phase = "PythonConnectionHandler"
+                _record_stat(phase, handler, "interpreter", conn.interpreter_wait)
+                t0 = _timer()
+
             # split module::handler
             l = handler.split('::', 1)
             module_name = l[0]
@@ -115,6 +136,10 @@ class CallBack:
             obj = resolve_object(module, obj_str,
                                     arg=conn, silent=0)
 
+            if _dispatch_stats:
+                t1 = _timer()
+                _record_stat(phase, handler, "resolve", t1 - t0)
+
             # Only permit debugging using pdb if Apache has
             # actually been started in single process mode.
 
@@ -145,6 +170,9 @@ class CallBack:
             else:
                 result = obj(conn)
 
+            if _dispatch_stats:
+                _record_stat(phase, handler, "handler", _timer() - t1)
+
             assert (result.__class__ is int), \
                    "ConnectionHandler '%s' returned invalid return code." % handler
 
@@ -163,69 +191,38 @@ class CallBack:
     def FilterDispatch(self, fltr):
         req = fltr.req
 
-        # config
-        config, debug  = req.get_config(), False
-        if "PythonDebug" in config:
-            debug = config["PythonDebug"] == "1"
+        # the handler is resolved on the first call of the filter and
+        # kept for the rest of its life along with the directives it
+        # depends on, later calls (one per brigade) go straight to it
+        dispatch = fltr._dispatch
+        if dispatch is None:
+            # config
+            config, debug  = req.get_config(), False
+            if "PythonDebug" in config:
+                debug = config["PythonDebug"] == "1"
+        else:
+            obj, debug, pdb_debug = dispatch
 
         try:
 
-            # split module::handler
-            l = fltr.handler.split('::', 1)
-            module_name = l[0]
-            if len(l) == 1:
-                # no oject, provide default
+            if _dispatch_stats:
                 if fltr.is_input:
-                    obj_str = "inputfilter"
+                    phase = "PythonInputFilter"
                 else:
-                    obj_str = "outputfilter"
-            else:
-                obj_str = l[1]
-
-            # add the directory to pythonpath if
-            # not there yet, or evaluate pythonpath
-            # and set sys.path to resulting value
-            # if not already done
-
-            if "PythonPath" in config:
-                _path_cache_lock.acquire()
-                try:
-                    pathstring = config["PythonPath"]
-                    if pathstring not in _path_cache:
-                        newpath = eval(pathstring)
-                        _path_cache[pathstring] = None
-                        sys.path[:] = newpath
-                finally:
-                    _path_cache_lock.release()
-            else:
-                if fltr.dir:
-                    _path_cache_lock.acquire()
-                    try:
-                        if fltr.dir not in sys.path:
-                            sys.path[:0] = [fltr.dir]
-                    finally:
-                        _path_cache_lock.release()
-
-            # import module
-            autoreload = True
-            if "PythonAutoReload" in config:
-                autoreload = config["PythonAutoReload"] == "1"
-            module = import_module(module_name,
-                                   autoreload=autoreload,
-                                   log=debug)
-
-            # find the object
-            obj = resolve_object(module, obj_str,
-                                    arg=fltr, silent=0)
+                    phase = "PythonOutputFilter"
+                _record_stat(phase, fltr.handler, "interpreter", fltr.interpreter_wait)
+                t0 = _timer()
 
-            # Only permit debugging using pdb if Apache has
-            # actually been started in single process mode.
+            if dispatch is None:
+                obj, pdb_debug, cacheable = self._resolve_filter(fltr, config, debug)
+                if cacheable:
+                    fltr._dispatch = (obj, debug, pdb_debug)
 
-            pdb_debug = False
-            if "PythonEnablePdb" in config:
-                pdb_debug = config["PythonEnablePdb"] == "1"
+            if _dispatch_stats:
+                t1 = _timer()
+                _record_stat(phase, fltr.handler, "resolve", t1 - t0)
 
-            if pdb_debug and exists_config_define("ONE_PROCESS"):
+            if pdb_debug:
 
                 # Don't use pdb.runcall() as it results in
                 # a bogus 'None' response when pdb session
@@ -248,6 +245,9 @@ class CallBack:
             else:
                 result = obj(fltr)
 
+            if _dispatch_stats:
+                _record_stat(phase, fltr.handler, "handler", _timer() - t1)
+
             # always flush the filter. without a FLUSH or EOS bucket,
             # the content is never written to the network.
             # XXX an alternative is to tell the user to flush() always
@@ -279,6 +279,13 @@ class CallBack:
             # Error (usually parsing)
             try:
                 exc_type, exc_value, exc_traceback = sys.exc_info()
+                if fltr.is_input:
+                    # neither the traceback nor the data as it was
+                    # must end up in the request body, log the error
+                    # and fail the read
+                    return self.ReportError(exc_type, exc_value, exc_traceback, req=req,
+                                            phase=fltr.name, hname=fltr.handler,
+                                            debug=False)
                 fltr.disable()
                 result = self.ReportError(exc_type, exc_value, exc_traceback, req=req, filter=fltr,
                                           phase=fltr.name, hname=fltr.handler,
@@ -288,6 +295,116 @@ class CallBack:
 
         return OK
 
+    def _resolve_filter(self, fltr, config, debug):
+        """
+        Import the module and find the object of filter fltr.
+        Returns the object, whether to run it under pdb and whether
+        it can be kept for later calls of the same filter.
+        """
+
+        # split module::handler
+        l = fltr.handler.split('::', 1)
+        module_name = l[0]
+        if len(l) == 1:
+            # no oject, provide default
+            if fltr.is_input:
+                obj_str = "inputfilter"
+            else:
+                obj_str = "outputfilter"
+        else:
+            obj_str = l[1]
+
+        # add the directory to pythonpath if
+        # not there yet, or evaluate pythonpath
+        # and set sys.path to resulting value
+        # if not already done
+
+        if "PythonPath" in config:
+            _path_cache_lock.acquire()
+            try:
+                pathstring = config["PythonPath"]
+                if pathstring not in _path_cache:
+                    newpath = eval(pathstring)
+                    _path_cache[pathstring] = None
+                    sys.path[:] = newpath
+            finally:
+                _path_cache_lock.release()
+        else:
+            if fltr.dir:
+                _path_cache_lock.acquire()
+                try:
+                    if fltr.dir not in sys.path:
+                        sys.path[:0] = [fltr.dir]
+                finally:
+                    _path_cache_lock.release()
+
+        # import module
+        autoreload = True
+        if "PythonAutoReload" in config:
+            autoreload = config["PythonAutoReload"] == "1"
+        module = import_module(module_name,
+                               autoreload=autoreload,
+                               log=debug)
+
+        # find the object
+        obj = resolve_object(module, obj_str,
+                                arg=fltr, silent=0)
+
+        # Only permit debugging using pdb if Apache has
+        # actually been started in single process mode.
+        pdb_debug = (config.get("PythonEnablePdb", "0") == "1" and
+                     exists_config_define("ONE_PROCESS"))
+
+        # an object reached through a class is bound to an instance
+        # created for this call, resolve it again next time
+        return obj, pdb_debug, _is_static_path(module, obj_str)
+
+    def _resolve_handler(self, req, hlist, default_obj_str,
+                         autoreload, pdb_debug, debug):
+        """
+        Import the module and find the object for the current
+        handler in hlist. Returns a _HandlerCacheEntry.
+        """
+
+        # split module::handler
+        l = hlist.handler.split('::', 1)
+
+        module_name = l[0]
+        if len(l) == 1:
+            # no object, provide default
+            obj_str = default_obj_str
+        else:
+            obj_str = l[1]
+
+        # import module
+        module = import_module(module_name,
+                               autoreload=autoreload,
+                               log=debug)
+
+        # find the object
+        obj = None
+        if '.' not in obj_str: # this is an optimization
+            try:
+                obj = module.__dict__[obj_str]
+            except:
+                if not hlist.silent:
+                    s = "module '%s' contains no '%s'" % (module.__file__, obj_str)
+                    raise AttributeError(s)
+            cacheable = True
+        else:
+            obj = resolve_object(module, obj_str,
+                                 arg=req, silent=hlist.silent)
+            # objects reached through a class are bound to an
+            # instance created for this request, never cache them
+            cacheable = _is_static_path(module, obj_str)
+
+        # Only permit debugging using pdb if Apache has
+        # actually been started in single process mode.
+        pdb_debug = pdb_debug and exists_config_define("ONE_PROCESS")
+
+        return _HandlerCacheEntry(module_name, module, obj,
+                                  pdb_debug, cacheable)
+
     def HandlerDispatch(self, req):
         """
         This is the handler dispatcher.
@@ -310,17 +427,14 @@ class CallBack:
         try:
             hlist = req.hlist
 
-            while hlist.handler is not None:
+            if _dispatch_stats:
+                _record_stat(req.phase, hlist.handler, "interpreter",
+                             req.interpreter_wait)
 
-                # split module::handler
-                l = hlist.handler.split('::', 1)
+            while hlist.handler is not None:
 
-                module_name = l[0]
-                if len(l) == 1:
-                    # no object, provide default
-                    obj_str = default_obj_str
-                else:
-                    obj_str = l[1]
+                if _dispatch_stats:
+                    t0 = _timer()
 
                 # add the directory to pythonpath if
                 # not there yet, or evaluate pythonpath
@@ -348,37 +462,43 @@ class CallBack:
                             finally:
                                 _path_cache_lock.release()
 
-                # import module
-                autoreload = True
-                if "PythonAutoReload" in config:
-                    autoreload = config["PythonAutoReload"] == "1"
-                module = import_module(module_name,
-                                       autoreload=autoreload,
-                                       log=debug)
-
-                # find the object
-                if '.' not in obj_str: # this is an optimization
-                    try:
-                        obj = module.__dict__[obj_str]
-                    except:
-                        if not hlist.silent:
-                            s = "module '%s' contains no '%s'" % (module.__file__, obj_str)
-                            raise AttributeError(s)
+                # the resolved handler is cached per interpreter,
+                # keyed on the handler string, the directory it was
+                # configured in and the directive values that affect
+                # how it is imported and called
+                autoreload = config.get("PythonAutoReload", "1") == "1"
+                pdb_debug = config.get("PythonEnablePdb", "0") == "1"
+                key = (hlist.handler, hlist.directory, default_obj_str,
+                       autoreload, pdb_debug)
+
+                entry = _handler_cache.get(key)
+                if entry is not None and entry.is_current(autoreload):
+                    _handler_cache_stats["hits"] += 1
+                    obj = entry.obj
                 else:
-                    obj = resolve_object(module, obj_str,
-                                         arg=req, silent=hlist.silent)
+                    _handler_cache_stats["misses"] += 1
+                    entry = self._resolve_handler(req, hlist,
+                                                  default_obj_str,
+                                                  autoreload, pdb_debug, debug)
+                    if entry.cacheable:
+                        _handler_cache[key] = entry
+                    obj = entry.obj
+
+                if _dispatch_stats:
+                    t1 = _timer()
+                    _record_stat(req.phase, hlist.handler, "resolve", t1 - t0)
 
                 if not hlist.silent or obj is not None:
 
+                    watched = None
                     try:
+                        if _watchdog_threshold:
+                            watched = _watchdog_enter(req, hlist.handler)
+
                         # Only permit debugging using pdb if Apache has
                         # actually been started in single process mode.
 
-                        pdb_debug = False
-                        if "PythonEnablePdb" in config:
-                            pdb_debug = config["PythonEnablePdb"] == "1"
-
-                        if pdb_debug and exists_config_define("ONE_PROCESS"):
+                        if entry.pdb_debug:
 
                             # Don't use pdb.runcall() as it results in
                             # a bogus 'None' response when pdb session
@@ -398,9 +518,16 @@ class CallBack:
                                 debugger.quitting = 1
                                 sys.settrace(None)
 
+                        elif _profile_sample(req, hlist):
+                            result = _profiled_call(obj, req, hlist.handler,
+                                                    _profile_config[hlist.directory])
+
                         else:
                             result = obj(req)
 
+                        if result.__class__ is not int and _iscoroutine(result):
+                            result = _run_coroutine(req, result)
+
                     except SERVER_RETURN as value:
 
                         # The SERVER_RETURN exception type when raised
@@ -415,6 +542,13 @@ class CallBack:
                         else:
                             result = value.args[0]
 
+                    finally:
+                        if _dispatch_stats:
+                            _record_stat(req.phase, hlist.handler, "handler",
+                                         _timer() - t1)
+                        if watched is not None:
+                            _watchdog_leave(watched)
+
                     assert (result.__class__ is int), \
                             _result_warning % result.__class__
 
@@ -451,20 +585,23 @@ class CallBack:
             if "PythonDebug" in config:
                 debug = config["PythonDebug"] == "1"
 
-            if not hasattr(fltr.req,"ssi_globals"):
-                fltr.req.ssi_globals = {}
+            # one namespace for all the tags of the request
+            ssi_globals = getattr(fltr.req, "ssi_globals", None)
+            if ssi_globals is None:
+                ssi_globals = fltr.req.ssi_globals = {"__file__": fltr.req.filename}
+            elif "__file__" not in ssi_globals:
+                ssi_globals["__file__"] = fltr.req.filename
 
-            fltr.req.ssi_globals["filter"] = fltr
-            fltr.req.ssi_globals["__file__"] = fltr.req.filename
+            ssi_globals["filter"] = fltr
 
-            code = code.replace('\r\n', '\n').rstrip()
+            co = _ssi_compile(fltr.req.filename, tag, code)
 
             if tag == 'eval':
-                result = eval(code, fltr.req.ssi_globals)
+                result = eval(co, ssi_globals)
                 if result is not None:
                     fltr.write(str(result))
             elif tag == 'exec':
-                exec(code, fltr.req.ssi_globals)
+                exec(co, ssi_globals)
 
             fltr.flush()
 
@@ -573,6 +710,483 @@ class CallBack:
             etb = None
             # we do not return anything
 
+# Set from the mod_python.dispatch_stats option by init(). When set,
+# the dispatchers record how long it took to acquire the interpreter,
+# to import and resolve the handler and to run it.
+_dispatch_stats = False
+
+# upper bounds of the histogram buckets in seconds, the last bucket
+# counts everything above STATS_BUCKETS[-1]
+STATS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_timer = getattr(time, "perf_counter", time.time)
+
+class _Histogram(object):
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(STATS_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def as_dict(self):
+        return {"buckets": STATS_BUCKETS,
+                "counts": list(self.counts),
+                "count": self.count,
+                "sum": self.total,
+                "max": self.max}
+
+# (phase, handler) -> {stage: _Histogram}
+_stats = {}
+_stats_lock = threading.Lock()
+
+def _record_stat(phase, handler, stage, seconds):
+    i = bisect.bisect_left(STATS_BUCKETS, seconds)
+    _stats_lock.acquire()
+    try:
+        try:
+            h = _stats[(phase, handler)][stage]
+        except KeyError:
+            h = _stats.setdefault((phase, handler), {}).setdefault(stage, _Histogram())
+        h.counts[i] += 1
+        h.count += 1
+        h.total += seconds
+        if seconds > h.max:
+            h.max = seconds
+    finally:
+        _stats_lock.release()
+
+def stats(reset=False):
+    """
+    Return the latency histograms recorded by the dispatchers of
+    this interpreter when the mod_python.dispatch_stats option is
+    on. The result is a dictionary keyed by (phase, handler) tuples,
+    the values are dictionaries keyed by stage ("interpreter",
+    "resolve" or "handler") of histograms. If reset is true, the
+    histograms are cleared after they have been copied.
+    """
+    _stats_lock.acquire()
+    try:
+        result = {}
+        for key, stages in _stats.items():
+            result[key] = dict([(stage, h.as_dict()) for stage, h in stages.items()])
+        if reset:
+            _stats.clear()
+    finally:
+        _stats_lock.release()
+    return result
+
+# Profiles of sampled requests merged per handler, see the
+# mod_python.profile.* options and _profiled_call().
+_profile_stats = {}      # handler -> pstats.Stats
+_profile_counts = {}     # handler -> number of requests seen
+_profile_dumped = {}     # handler -> time of last dump
+_profile_lock = threading.Lock()
+# directory -> (sample, uri_prefix, dump directory, dump interval)
+# or None, parsed once
+_profile_config = {}
+# held only to count, not while a request is profiled
+_profile_count_lock = threading.Lock()
+
+def _profile_options(req, directory):
+    """
+    The mod_python.profile.* options of the handlers configured in
+    directory, as a tuple (sample, uri_prefix, dump directory, dump
+    interval), or None if profiling is off.
+    """
+    options = req.get_options()
+    sample = options.get("mod_python.profile.sample")
+    prefix = options.get("mod_python.profile.uri_prefix")
+    config = None
+    if sample:
+        try:
+            n = int(sample)
+        except ValueError:
+            n = 0
+            req.log_error("mod_python: invalid mod_python.profile.sample %s, "
+                          "profiling is off" % repr(sample), APLOG_WARNING)
+        if n > 0:
+            config = (n, prefix)
+    elif prefix:
+        config = (1, prefix)
+
+    if config is not None:
+        dump_dir = options.get("mod_python.profile.directory") or None
+        interval = options.get("mod_python.profile.dump_interval", "60")
+        try:
+            dump_interval = float(interval)
+            if dump_interval < 0:
+                raise ValueError
+        except ValueError:
+            dump_interval = 60.0
+            req.log_error("mod_python: invalid mod_python.profile.dump_interval "
+                          "%s, using 60" % repr(interval), APLOG_WARNING)
+        config = config + (dump_dir, dump_interval)
+
+    _profile_config[directory] = config
+    return config
+
+def _profile_sample(req, hlist):
+    """
+    True if the mod_python.profile.sample and
+    mod_python.profile.uri_prefix options select this request
+    for profiling.
+    """
+    config = _profile_config.get(hlist.directory, False)
+    if config is False:
+        config = _profile_options(req, hlist.directory)
+    if config is None:
+        return False
+    sample, prefix = config[:2]
+    if prefix and not req.uri.startswith(prefix):
+        return False
+    if sample == 1:
+        return True
+    _profile_count_lock.acquire()
+    try:
+        n = _profile_counts.get(hlist.handler, 0) + 1
+        _profile_counts[hlist.handler] = n
+    finally:
+        _profile_count_lock.release()
+    return n % sample == 0
+
+def _profiled_call(obj, req, handler, config):
+    """
+    Call obj(req) under cProfile, add the result to the profile of
+    handler and dump the merged profile if it is time to.
+    """
+    import cProfile
+
+    # a thread can only be profiled if no other profiler is active
+    # (in Python 3.12 and later, in the whole interpreter), so
+    # requests arriving while one is profiled are not sampled
+    if not _profile_lock.acquire(False):
+        return obj(req)
+    try:
+        prof = cProfile.Profile()
+        try:
+            return prof.runcall(obj, req)
+        finally:
+            # the profile must not change the result of the handler
+            try:
+                _profile_merge(req, handler, prof, config)
+            except Exception:
+                exc_type, exc_value = sys.exc_info()[:2]
+                req.log_error("mod_python: could not merge the profile of %s: %s"
+                              % (handler, exc_value), APLOG_WARNING)
+    finally:
+        _profile_lock.release()
+
+def _profile_merge(req, handler, prof, config):
+    import pstats
+
+    if handler in _profile_stats:
+        _profile_stats[handler].add(prof)
+    else:
+        _profile_stats[handler] = pstats.Stats(prof)
+
+    directory, interval = config[2:]
+    if not directory:
+        return
+    now = time.time()
+    if now - _profile_dumped.get(handler, 0) < interval:
+        return
+    _profile_dumped[handler] = now
+
+    # one file per interpreter, process and handler, each dump
+    # replaces the previous one with the profile merged so far
+    name = "%s-%d-%s.pstats" % (interpreter, os.getpid(), handler)
+    name = "".join([(c.isalnum() or c in "-_.") and c or "_" for c in name])
+    filename = os.path.join(directory, name)
+    try:
+        _profile_stats[handler].dump_stats(filename + ".tmp")
+        os.rename(filename + ".tmp", filename)
+    except (IOError, OSError):
+        exc_type, exc_value = sys.exc_info()[:2]
+        req.log_error("mod_python: could not write profile %s: %s"
+                      % (filename, exc_value), APLOG_WARNING)
+
+def profile_stats(handler):
+    """
+    Return the pstats.Stats merged from the sampled requests to
+    handler in this interpreter, or None.
+    """
+    _profile_lock.acquire()
+    try:
+        return _profile_stats.get(handler)
+    finally:
+        _profile_lock.release()
+
+# Coroutine handlers (async def handler(req)) run on an event loop
+# owned by the interpreter, in a thread of its own. The thread that
+# dispatched the request waits for the coroutine to finish and in the
+# meantime performs the request I/O the coroutine asks it to do
+# through async_read(), async_readline() and async_write(), so that
+# neither the event loop nor additional threads block on the client.
+_event_loop = None
+_event_loop_lock = threading.Lock()
+_request_calls = {}      # request -> queue of calls for its thread
+
+if asyncio is not None:
+    _iscoroutine = asyncio.iscoroutine
+else:
+    def _iscoroutine(obj):
+        return False
+
+def event_loop():
+    """
+    Return the event loop of this interpreter on which coroutine
+    handlers are run, starting it if necessary.
+    """
+    global _event_loop
+    if _event_loop is None:
+        _event_loop_lock.acquire()
+        try:
+            if _event_loop is None:
+                loop = asyncio.new_event_loop()
+                t = threading.Thread(target=_run_event_loop, args=(loop,),
+                                     name="mod_python event loop")
+                t.daemon = True
+                t.start()
+                _event_loop = loop
+        finally:
+            _event_loop_lock.release()
+    return _event_loop
+
+def _run_event_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+def _set_future(future, result, exc):
+    if not future.cancelled():
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+def _run_coroutine(req, coro):
+    """ Run coro on the event loop, serving its calls until it is done """
+    loop = event_loop()
+    calls = queue.Queue()
+    _request_calls[req] = calls
+    try:
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        future.add_done_callback(lambda f: calls.put(None))
+        while True:
+            call = calls.get()
+            if call is None:
+                break
+            func, args, waiter = call
+            try:
+                result, exc = func(*args), None
+            except Exception as e:
+                result, exc = None, e
+            loop.call_soon_threadsafe(_set_future, waiter, result, exc)
+    finally:
+        del _request_calls[req]
+    return future.result()
+
+def _request_call(req, func, *args):
+    loop = event_loop()
+    calls = _request_calls.get(req)
+    if calls is None:
+        # not within a coroutine handler of this request
+        return loop.run_in_executor(None, func, *args)
+    waiter = loop.create_future()
+    calls.put((func, args, waiter))
+    return waiter
+
+def async_read(req, *args):
+    """
+    Awaitable version of req.read() for use in coroutine handlers.
+    The read is performed by the thread processing the request.
+    """
+    return _request_call(req, req.read, *args)
+
+def async_readline(req, *args):
+    """ Awaitable version of req.readline() """
+    return _request_call(req, req.readline, *args)
+
+def async_write(req, data, *args):
+    """ Awaitable version of req.write() """
+    return _request_call(req, req.write, data, *args)
+
+# Set from the mod_python.watchdog.threshold option by init(). When
+# set, a watchdog thread logs the stack of any handler that has been
+# running for longer than that many seconds.
+_watchdog_threshold = 0
+_watchdog = None
+_watchdog_lock = threading.Lock()
+# thread id -> [[start, uri, phase, handler, reported], ...], more
+# than one for dispatches nested in a handler (internal redirects,
+# subrequests), the innermost last
+_in_flight = {}
+_slow_requests = {}      # handler -> number of slow requests
+
+def _watchdog_enter(req, handler):
+    if _watchdog is None:
+        _start_watchdog()
+    ident = _get_ident()
+    info = [time.time(), req.uri, req.phase, handler, False]
+    stack = _in_flight.get(ident)
+    if stack is None:
+        _in_flight[ident] = [info]
+    else:
+        stack.append(info)
+    return info
+
+def _watchdog_leave(info):
+    ident = _get_ident()
+    stack = _in_flight.get(ident)
+    if not stack:
+        return
+    if stack[-1] is info:
+        stack.pop()
+    else:
+        stack[:] = [i for i in stack if i is not info]
+    if not stack:
+        del _in_flight[ident]
+
+def _start_watchdog():
+    global _watchdog
+    _watchdog_lock.acquire()
+    try:
+        if _watchdog is None:
+            _watchdog = threading.Thread(target=_watchdog_run,
+                                         name="mod_python watchdog")
+            _watchdog.daemon = True
+            _watchdog.start()
+    finally:
+        _watchdog_lock.release()
+
+def _watchdog_run():
+    interval = min(_watchdog_threshold / 2.0, 1.0)
+    while True:
+        time.sleep(interval)
+        now = time.time()
+        slow = []
+        for ident, stack in list(_in_flight.items()):
+            for info in list(stack):
+                # only report a request once
+                if not info[4] and now - info[0] >= _watchdog_threshold:
+                    slow.append((ident, info))
+        if not slow:
+            continue
+        frames = sys._current_frames()
+        for ident, info in slow:
+            start, uri, phase, handler, reported = info
+            if not [i for i in _in_flight.get(ident, ()) if i is info]:
+                # finished in the meantime
+                continue
+            info[4] = True
+            _slow_requests[handler] = _slow_requests.get(handler, 0) + 1
+            s = ["mod_python: slow request: %s %s %s has been running for %.1f seconds"
+                 % (phase, handler, uri, now - start)]
+            frame = frames.get(ident)
+            if frame is not None:
+                s.append("Stack (most recent call last):")
+                for entry in traceback.format_stack(frame):
+                    s.extend(entry.rstrip().split("\n"))
+            for line in s:
+                _apache.log_error(line, APLOG_WARNING)
+
+def slow_requests(reset=False):
+    """
+    Return a dictionary with the number of requests per handler
+    that were reported by the watchdog as running for longer than
+    mod_python.watchdog.threshold seconds.
+    """
+    result = dict(_slow_requests)
+    if reset:
+        _slow_requests.clear()
+    return result
+
+class _HandlerCacheEntry(object):
+    """
+    A resolved handler as stored in _handler_cache.
+    """
+
+    __slots__ = ("module_name", "module", "mtime", "obj",
+                 "pdb_debug", "cacheable")
+
+    def __init__(self, module_name, module, obj, pdb_debug, cacheable):
+        self.module_name = module_name
+        self.module = module
+        self.mtime = module.__dict__.get("__mtime__")
+        self.obj = obj
+        self.pdb_debug = pdb_debug
+        self.cacheable = cacheable
+
+    def is_current(self, autoreload):
+        """
+        True if the module this entry was resolved from has not
+        been replaced or reloaded since. This never imports
+        anything, see _module_changed().
+        """
+        module = sys.modules.get(self.module_name)
+        if (module is not self.module or
+            module.__dict__.get("__mtime__") != self.mtime):
+            return False
+        return not (autoreload and _module_changed(self.module_name, module))
+
+def _is_static_path(module, obj_str):
+    """
+    True if resolve_object() does not need to instantiate any
+    class to find obj_str in module, i.e. the result does not
+    depend on the request.
+    """
+    obj = module
+    for name in obj_str.split('.')[:-1]:
+        obj = getattr(obj, name, None)
+        if obj is None or inspect.isclass(obj):
+            return False
+    return True
+
+# Code of the #python tags of SSI pages compiled by IncludeDispatch,
+# by (filename, tag, code), at most _ssi_code_cache_size of them
+_ssi_code_cache = {}
+_ssi_code_cache_size = 1000
+_ssi_code_cache_lock = threading.Lock()
+
+def _ssi_compile(filename, tag, code):
+    """
+    The code object of an SSI #python tag, compiled once for every
+    page it appears in.
+    """
+    key = (filename, tag, code)
+    co = _ssi_code_cache.get(key)
+    if co is None:
+        source = code.replace('\r\n', '\n').rstrip()
+        if tag == 'eval':
+            co = compile(source, '<string>', 'eval')
+        else:
+            co = compile(source, '<string>', 'exec')
+        _ssi_code_cache_lock.acquire()
+        try:
+            if len(_ssi_code_cache) >= _ssi_code_cache_size:
+                # the oldest (an arbitrary one before Python 3.7)
+                del _ssi_code_cache[next(iter(_ssi_code_cache))]
+            _ssi_code_cache[key] = co
+        finally:
+            _ssi_code_cache_lock.release()
+    return co
+
+# Handlers resolved by HandlerDispatch, see _HandlerCacheEntry
+_handler_cache = {}
+_handler_cache_stats = {"hits": 0, "misses": 0}
+
+def handler_cache_stats():
+    """
+    Return a dictionary with the number of handler cache hits,
+    misses and entries in this interpreter.
+    """
+    stats = dict(_handler_cache_stats)
+    stats["entries"] = len(_handler_cache)
+    return stats
+
 def import_module(module_name, autoreload=1, log=0, path=None):
     """
     Get the module to handle the request. If
@@ -588,6 +1202,7 @@ def import_module(module_name, autoreload=1, log=0, path=None):
         # The module has been imported already
         module = sys.modules[module_name]
         oldmtime, mtime  = 0, 0
+        deps_changed = False
 
         if autoreload:
 
@@ -606,6 +1221,20 @@ def import_module(module_name, autoreload=1, log=0, path=None):
                 # there is a script by this name already imported, but it's in
                 # a different directory, therefore it's a different script
                 mtime, oldmtime = 0, -1 # trigger import
+            elif _autoreload_watch:
+                # a watcher thread tells us which files have changed,
+                # no need to stat() anything unless this one has
+                watcher = _watcher or _start_watcher()
+                if watcher is None:
+                    # could not start one, check the mtime every time
+                    oldmtime = module.__dict__.get("__mtime__", 0)
+                    mtime = module_mtime(module)
+                elif watcher.changed(file):
+                    watcher.clear(file)
+                    oldmtime = module.__dict__.get("__mtime__", 0)
+                    mtime = module_mtime(module)
+                elif _autoreload_background:
+                    deps_changed = _deps_changed(module_name)
             else:
                 try:
                     last_check = module.__dict__["__mtime_check__"]
@@ -615,6 +1244,20 @@ def import_module(module_name, autoreload=1, log=0, path=None):
                 if (time.time() - last_check) > 1:
                     oldmtime = module.__dict__.get("__mtime__", 0)
                     mtime = module_mtime(module)
+                    if _autoreload_background and mtime == oldmtime:
+                        deps_changed = _deps_changed(module_name)
+
+            if (_autoreload_background and oldmtime != -1 and
+                (mtime != oldmtime or deps_changed)):
+                reloader = _reloader or _start_reloader()
+                if reloader is not None:
+                    # the new version is imported by the background
+                    # reloader, keep using this one until it is ready
+                    if log:
+                        s = "mod_python: Scheduling background reload of module '%s'" % module_name
+                        _apache.log_error(s, APLOG_NOTICE)
+                    reloader.schedule(module_name)
+                    return module
         else:
             pass
     else:
@@ -631,15 +1274,160 @@ def import_module(module_name, autoreload=1, log=0, path=None):
             _apache.log_error(s, APLOG_NOTICE)
 
         parent = None
-        module = importlib.import_module(module_name)
+        if oldmtime != -1:
+            # the module has changed on disk, importlib.import_module()
+            # would simply return what is in sys.modules
+            module = _reload_module(sys.modules[module_name])
+        else:
+            module = importlib.import_module(module_name)
 
         if mtime == 0:
             mtime = module_mtime(module)
 
         module.__mtime__ = mtime
 
+        if _autoreload_background:
+            _record_deps(module)
+
     return module
 
+# Set from the mod_python.autoreload.watch option by init(). When
+# set, changes to modules are detected by a watcher thread (see
+# mod_python.autoreload) instead of calling stat() on every request.
+_autoreload_watch = None
+_autoreload_poll_interval = 1.0
+_watcher = None
+_watcher_lock = threading.Lock()
+
+def _start_watcher():
+    """ Start the watcher of this interpreter, on first use """
+    global _watcher, _autoreload_watch
+    _watcher_lock.acquire()
+    try:
+        if _watcher is None and _autoreload_watch:
+            from mod_python import autoreload
+            _watcher = autoreload.new_watcher(_autoreload_watch,
+                                              _autoreload_poll_interval,
+                                              _log_watcher_warning)
+            if _watcher is None:
+                _apache.log_error("mod_python: %s autoreload watcher is not "
+                                  "available, reverting to mtime checks."
+                                  % _autoreload_watch, APLOG_WARNING)
+                _autoreload_watch = None
+    finally:
+        _watcher_lock.release()
+    return _watcher
+
+# Set from the mod_python.autoreload.background option by init().
+# Changed modules and their local dependencies are then reloaded by
+# a background thread (see mod_python.autoreload) and swapped into
+# sys.modules when ready, instead of within the request that
+# noticed the change.
+_autoreload_background = False
+_reloader = None
+
+# module name -> names of its local dependencies, see _record_deps()
+_module_deps = {}
+
+def _start_reloader():
+    """ Start the background reloader of this interpreter, on first use """
+    global _reloader, _autoreload_background
+    _watcher_lock.acquire()
+    try:
+        if _reloader is None and _autoreload_background:
+            from mod_python import autoreload
+            if autoreload.importlib is None:
+                _apache.log_error("mod_python: background reload is not available "
+                                  "in this version of Python.", APLOG_WARNING)
+                _autoreload_background = False
+            else:
+                _reloader = autoreload.BackgroundReloader(_dep_changed, _reload_done,
+                                                          _log_reload_error)
+    finally:
+        _watcher_lock.release()
+    return _reloader
+
+def _log_reload_error(s):
+    _apache.log_error(s, APLOG_ERR)
+
+def _log_watcher_warning(s):
+    _apache.log_error(s, APLOG_WARNING)
+
+def _record_deps(module):
+    """
+    Remember the local dependencies of module, so that a change to
+    any of them is treated as a change to module.
+    """
+    from mod_python import autoreload
+    deps = autoreload.dependencies(module)
+    for name in deps:
+        dep = sys.modules[name]
+        if "__mtime__" not in dep.__dict__:
+            dep.__mtime__ = module_mtime(dep)
+        if _watcher is not None and "__file__" in dep.__dict__:
+            _watcher.changed(dep.__file__)  # start watching
+    _module_deps[module.__name__] = deps
+
+def _dep_changed(module):
+    file = module.__dict__.get("__file__")
+    if not file:
+        return False
+    if _watcher is not None:
+        return _watcher.changed(file)
+    return module_mtime(module) != module.__dict__.get("__mtime__", 0)
+
+def _module_changed(module_name, module):
+    """
+    True if import_module() would reload module or schedule it for
+    a background reload. This is the same check, by the watcher or
+    at most once a second by mtime, without importing anything.
+    """
+    file = module.__dict__.get("__file__")
+    if not file:
+        return True
+
+    if _autoreload_watch:
+        watcher = _watcher or _start_watcher()
+        if watcher is None:
+            return module_mtime(module) != module.__dict__.get("__mtime__", 0)
+        if watcher.changed(file):
+            # import_module() clears it once it has seen it
+            return True
+        return bool(_autoreload_background and _deps_changed(module_name))
+
+    if (time.time() - module.__dict__.get("__mtime_check__", 0)) <= 1:
+        return False
+    if (module_mtime(module) != module.__dict__.get("__mtime__", 0) or
+        (_autoreload_background and _deps_changed(module_name))):
+        # module_mtime() has just reset the one second throttle,
+        # make sure import_module() looks at the file too
+        module.__dict__["__mtime_check__"] = 0
+        return True
+    return False
+
+def _deps_changed(module_name):
+    for name in _module_deps.get(module_name, ()):
+        dep = sys.modules.get(name)
+        if dep is not None and _dep_changed(dep):
+            return True
+    return False
+
+def _reload_done(old, new):
+    """ Called by the background reloader, see BackgroundReloader """
+    for name, module in old.items():
+        if "__file__" in module.__dict__ and _watcher is not None:
+            _watcher.clear(module.__file__)
+        if new is None:
+            # failed, do not retry until the file changes again
+            module.__mtime__ = module_mtime(module)
+        elif name in new:
+            new[name].__mtime__ = module_mtime(new[name])
+            _apache.log_error("mod_python: Reloaded module '%s' in background" % name,
+                              APLOG_NOTICE)
+    if new is not None:
+        for name in new:
+            _record_deps(new[name])
+
 def module_mtime(module):
     """Get modification time of module"""
     mtime = 0
@@ -908,6 +1696,27 @@ _callback = None
 def register_cleanup(callback, data=None):
     _apache.register_cleanup(interpreter, main_server, callback, data)
 
+# the smallest mod_python.autoreload.poll_interval, in seconds
+_MIN_POLL_INTERVAL = 0.1
+
+def _float_option(options, name, default):
+    """
+    The value of option name as a float, default if it is not
+    set or is not a (finite) number.
+    """
+    value = options.get(name)
+    if value is None:
+        return default
+    try:
+        result = float(value)
+        if result != result or result in (float("inf"), float("-inf")):
+            raise ValueError(value)
+    except ValueError:
+        _apache.log_error("mod_python: invalid %s value %s, using %s."
+                          % (name, repr(value), default), APLOG_WARNING)
+        return default
+    return result
+
 def init(name, server):
     """
         This function is called by the server at startup time
@@ -920,6 +1729,41 @@ def init(name, server):
 
     sys.argv = ["mod_python"]
 
+    global _autoreload_watch, _autoreload_poll_interval, _autoreload_background
+    options = server.get_options()
+    watch = options.get("mod_python.autoreload.watch", "off").lower()
+    if watch in ("on", "auto", "inotify", "poll"):
+        if watch == "on":
+            watch = "auto"
+        _autoreload_watch = watch
+        _autoreload_poll_interval = _float_option(
+            options, "mod_python.autoreload.poll_interval", 1.0)
+        if _autoreload_poll_interval < _MIN_POLL_INTERVAL:
+            _apache.log_error("mod_python: mod_python.autoreload.poll_interval "
+                              "%s is too small, using %s." %
+                              (_autoreload_poll_interval, _MIN_POLL_INTERVAL),
+                              APLOG_WARNING)
+            _autoreload_poll_interval = _MIN_POLL_INTERVAL
+    elif watch != "off":
+        _apache.log_error("mod_python: invalid mod_python.autoreload.watch "
+                          "value %s, ignoring." % repr(watch), APLOG_WARNING)
+
+    _autoreload_background = options.get("mod_python.autoreload.background",
+                                         "off").lower() in ("on", "1")
+
+    global _dispatch_stats
+    _dispatch_stats = options.get("mod_python.dispatch_stats",
+                                  "off").lower() in ("on", "1")
+
+    global _watchdog_threshold
+    _watchdog_threshold = _float_option(
+        options, "mod_python.watchdog.threshold", 0)
+    if _watchdog_threshold < 0:
+        _apache.log_error("mod_python: invalid mod_python.watchdog.threshold "
+                          "value %s, the watchdog is off." % _watchdog_threshold,
+                          APLOG_WARNING)
+        _watchdog_threshold = 0
+
     global _callback
     _callback = CallBack()
     return _callback
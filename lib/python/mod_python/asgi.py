@@ -0,0 +1,144 @@
+ #
+ # Copyright (C) 2000, 2001, 2013, 2024 Gregory Trubetskoy
+ # Copyright (C) 2002, 2003, 2004, 2005, 2006, 2007 Apache Software Foundation
+ #
+ # Licensed under the Apache License, Version 2.0 (the "License"); you
+ # may not use this file except in compliance with the License.  You
+ # may obtain a copy of the License at
+ #
+ #      http://www.apache.org/licenses/LICENSE-2.0
+ #
+ # Unless required by applicable law or agreed to in writing, software
+ # distributed under the License is distributed on an "AS IS" BASIS,
+ # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+ # implied.  See the License for the specific language governing
+ # permissions and limitations under the License.
+ #
+ # Originally developed by Gregory Trubetskoy.
+ #
+
+"""
+ASGI (version 3) handler. The application runs on the event loop of
+the interpreter (see apache.event_loop()), while the request body is
+read and the response written by the thread processing the request.
+Only the http scope is supported, there is no lifespan protocol.
+"""
+
+import asyncio
+from mod_python import apache
+from mod_python.wsgi import _find_app
+
+CHUNK_SIZE = 65536
+
+class _Connection(object):
+    """ The receive and send callables of a request """
+
+    def __init__(self, req):
+        self.req = req
+        self.more_body = True
+        self.started = False
+        self.finished = None
+
+    async def receive(self):
+        if self.more_body:
+            data = await apache.async_read(self.req, CHUNK_SIZE)
+            self.more_body = len(data) == CHUNK_SIZE
+            return {'type': 'http.request', 'body': data,
+                    'more_body': self.more_body}
+        # the client is gone once the response is complete
+        await self.finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        req = self.req
+        t = message['type']
+        if t == 'http.response.start':
+            if self.started:
+                raise RuntimeError('http.response.start sent twice')
+            self.started = True
+            req.status = message['status']
+            for name, value in message.get('headers', ()):
+                name, value = name.decode('latin-1'), value.decode('latin-1')
+                if name.lower() == 'content-type':
+                    req.content_type = value
+                else:
+                    req.headers_out.add(name, value)
+        elif t == 'http.response.body':
+            if not self.started:
+                raise RuntimeError('http.response.body sent before http.response.start')
+            if self.finished.is_set():
+                return
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if body:
+                # flush while streaming, the end of the request will
+                # flush the rest
+                await apache.async_write(req, body, more_body and 1 or 0)
+            if not more_body:
+                self.finished.set()
+        else:
+            raise ValueError('unsupported ASGI message type %s' % repr(t))
+
+    async def serve(self, app, scope):
+        self.finished = asyncio.Event()
+        try:
+            await app(scope, self.receive, self.send)
+        finally:
+            self.finished.set()
+        if not self.started:
+            self.req.log_error('ASGI handler: application returned without '
+                               'sending a response.')
+            return apache.HTTP_INTERNAL_SERVER_ERROR
+        return apache.OK
+
+def build_scope(req, env):
+    """ The http connection scope for req, from its WSGI environment """
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0', 'spec_version': '2.3'},
+        'http_version': req.protocol.split('/', 1)[-1],
+        'method': req.method,
+        'scheme': env['wsgi.url_scheme'],
+        'path': env.get('PATH_INFO', ''),
+        'raw_path': req.unparsed_uri.split('?', 1)[0].encode('latin-1'),
+        'query_string': env.get('QUERY_STRING', '').encode('latin-1'),
+        'root_path': env.get('SCRIPT_NAME', ''),
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                    for k, v in req.headers_in.items()],
+        'server': (env.get('SERVER_NAME'), int(env.get('SERVER_PORT') or 0)),
+    }
+    if 'REMOTE_ADDR' in env:
+        scope['client'] = (env['REMOTE_ADDR'], int(env.get('REMOTE_PORT') or 0))
+    return scope
+
+def handler(req):
+
+    options = req.get_options()
+
+    ## Find the application callable
+
+    app = None
+    app_str = options.get('mod_python.asgi.application')
+    if app_str:
+        app = _find_app(req, app_str)
+
+    if not app:
+        req.log_error(
+            'ASGI handler: mod_python.asgi.application (%s) not found, declining.'
+            % repr(app_str), apache.APLOG_WARNING)
+        return apache.DECLINED
+
+    ## Build scope, the path is split as for WSGI
+
+    env = req.build_wsgi_env()
+    if env is None:
+        base_uri = options.get('mod_python.wsgi.base_uri')
+        req.log_error(
+            "ASGI handler: req.uri (%s) does not start with mod_python.wsgi.base_uri (%s), declining."
+            % (repr(req.uri), repr(base_uri)), apache.APLOG_WARNING)
+        return apache.DECLINED
+
+    ## Run the app, HandlerDispatch runs the returned coroutine on
+    ## the event loop
+
+    return _Connection(req).serve(app, build_scope(req, env))
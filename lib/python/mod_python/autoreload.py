@@ -0,0 +1,499 @@
+ #
+ # Copyright (C) 2000, 2001, 2013, 2024 Gregory Trubetskoy
+ # Copyright (C) 2002, 2003, 2004, 2005, 2006, 2007 Apache Software Foundation
+ #
+ # Licensed under the Apache License, Version 2.0 (the "License"); you
+ # may not use this file except in compliance with the License.  You
+ # may obtain a copy of the License at
+ #
+ #      http://www.apache.org/licenses/LICENSE-2.0
+ #
+ # Unless required by applicable law or agreed to in writing, software
+ # distributed under the License is distributed on an "AS IS" BASIS,
+ # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+ # implied.  See the License for the specific language governing
+ # permissions and limitations under the License.
+ #
+ # Originally developed by Gregory Trubetskoy.
+ #
+
+"""
+Module change watchers and the background reloader used by
+apache.import_module() when the mod_python.autoreload.watch and
+mod_python.autoreload.background options are set.
+
+A watcher runs in a daemon thread of its own and adds the files
+that have changed to its dirty set, so that the request thread only
+has to look the module file up in that set instead of calling stat().
+
+The background reloader imports new versions of changed modules in
+its own thread and only then replaces them in sys.modules, so that
+requests keep using the old version until the new one is ready.
+"""
+
+import os
+import sys
+import struct
+import types
+import sysconfig
+import traceback
+
+try:
+    import importlib.util
+    import builtins
+except ImportError:
+    # Python 2, no background reloading
+    importlib = None
+
+try:
+    import threading
+except:
+    import dummy_threading as threading
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+def _source_files(filepath):
+    """ The files that determine whether a module has changed """
+    files = [filepath]
+    if filepath.endswith(".pyc") or filepath.endswith(".pyo"):
+        files.append(filepath[:-1])
+    return files
+
+class Watcher(object):
+    """
+    The base class of watchers. Subclasses start a thread that
+    calls mark_dirty() for every watched file that changes.
+    """
+
+    name = None
+
+    def __init__(self, log=None):
+        self.files = {}      # module file -> list of files watched for it
+        self.dirty = set()
+        self.log = log or (lambda s: None)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def changed(self, filepath):
+        """
+        True if filepath has changed since it was last passed to
+        clear(). A file not seen before is watched from now on.
+        """
+        if filepath in self.dirty:
+            return True
+        if filepath not in self.files:
+            self.watch(filepath)
+        return False
+
+    def clear(self, filepath):
+        """ Called after the module in filepath has been reimported """
+        self.dirty.discard(filepath)
+
+    def watch(self, filepath):
+        self._lock.acquire()
+        try:
+            if filepath not in self.files:
+                sources = _source_files(filepath)
+                self.files[filepath] = sources
+                for f in sources:
+                    self._add(filepath, f)
+        finally:
+            self._lock.release()
+
+    def mark_dirty(self, filepath):
+        self.dirty.add(filepath)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run,
+                                        name="mod_python %s watcher" % self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _add(self, modfile, filepath):
+        raise NotImplementedError
+
+    def run(self):
+        raise NotImplementedError
+
+class PollingWatcher(Watcher):
+    """
+    Stats the watched files every interval seconds. This still
+    costs stat() calls, but they are made by one thread per
+    interpreter rather than by every request.
+    """
+
+    name = "poll"
+
+    def __init__(self, interval=1.0, log=None):
+        Watcher.__init__(self, log)
+        self.interval = interval
+        self.mtimes = {}     # file -> (module file, mtime)
+        self._stop = threading.Event()
+
+    def _add(self, modfile, filepath):
+        self.mtimes[filepath] = (modfile, self._mtime(filepath))
+
+    def add(self, modfile, filepath):
+        """ Poll filepath as one of the files of modfile """
+        self._lock.acquire()
+        try:
+            self._add(modfile, filepath)
+        finally:
+            self._lock.release()
+
+    def _mtime(self, filepath):
+        try:
+            return os.stat(filepath).st_mtime
+        except OSError:
+            return None
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self._lock.acquire()
+            try:
+                items = list(self.mtimes.items())
+            finally:
+                self._lock.release()
+            for filepath, (modfile, mtime) in items:
+                newmtime = self._mtime(filepath)
+                if newmtime != mtime:
+                    self.mtimes[filepath] = (modfile, newmtime)
+                    self.mark_dirty(modfile)
+
+    def stop(self):
+        self._stop.set()
+
+# from <sys/inotify.h>
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_CLOEXEC     = 0x00080000
+
+_IN_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO |
+            IN_CREATE | IN_DELETE)
+
+_event_header = struct.Struct("iIII")  # wd, mask, cookie, len
+
+def _libc():
+    if ctypes is None or not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+class InotifyWatcher(Watcher):
+    """
+    Watches the directories containing the module files with
+    inotify(7), so that a file replaced by an editor or a deployment
+    tool (written to a temporary file and renamed) is noticed too.
+    Files that cannot be watched (e.g. once max_user_watches is
+    reached) are polled every interval seconds instead.
+    """
+
+    name = "inotify"
+
+    def __init__(self, libc, interval=1.0, log=None):
+        Watcher.__init__(self, log)
+        self.libc = libc
+        self.interval = interval
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.wds = {}        # directory -> watch descriptor
+        self.dirs = {}       # watch descriptor -> directory
+        self.names = {}      # file -> module files it belongs to
+        self.poller = None   # PollingWatcher of the files not watched
+        self.stopped = False
+
+    def _poll(self, modfile, filepath):
+        """ Poll filepath, the lock must be held """
+        if self.poller is None:
+            self.poller = PollingWatcher(self.interval, self.log)
+            # changes found by the poller are ours
+            self.poller.mark_dirty = self.mark_dirty
+            self.poller.start()
+        self.poller.add(modfile, filepath)
+
+    def _add(self, modfile, filepath):
+        if self.stopped:
+            self._poll(modfile, filepath)
+            return
+        directory = os.path.dirname(filepath)
+        if directory not in self.wds:
+            if not isinstance(directory, bytes):
+                bdir = directory.encode(sys.getfilesystemencoding())
+            else:
+                bdir = directory
+            wd = self.libc.inotify_add_watch(self.fd, bdir, _IN_MASK)
+            if wd < 0:
+                e = ctypes.get_errno()
+                self.log("mod_python: cannot watch %s with inotify (%s), "
+                         "polling it instead" % (directory, os.strerror(e)))
+                self._poll(modfile, filepath)
+                return
+            self.wds[directory] = wd
+            self.dirs[wd] = directory
+        self.names.setdefault(filepath, set()).add(modfile)
+
+    def _lookup(self, wd, name):
+        """ The module files of file name in the directory of wd """
+        self._lock.acquire()
+        try:
+            directory = self.dirs.get(wd)
+            if directory is None:
+                return ()
+            filepath = os.path.join(directory,
+                                    name.decode(sys.getfilesystemencoding()))
+            return list(self.names.get(filepath, ()))
+        finally:
+            self._lock.release()
+
+    def run(self):
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except OSError:
+                e = sys.exc_info()[1]
+                self.log("mod_python: inotify watcher stopped (%s), "
+                         "polling the watched files instead" % e)
+                self._lock.acquire()
+                try:
+                    self.stopped = True
+                    for filepath, modfiles in self.names.items():
+                        for modfile in modfiles:
+                            self._poll(modfile, filepath)
+                finally:
+                    self._lock.release()
+                return
+            pos = 0
+            while pos < len(buf):
+                wd, mask, cookie, length = _event_header.unpack_from(buf, pos)
+                pos += _event_header.size
+                name = buf[pos:pos+length].rstrip(b"\0")
+                pos += length
+                if not name:
+                    continue
+                for modfile in self._lookup(wd, name):
+                    self.mark_dirty(modfile)
+
+def new_watcher(kind="auto", interval=1.0, log=None):
+    """
+    Create and start a watcher. kind is one of "auto", "inotify"
+    or "poll"; "auto" uses inotify where available. Returns None
+    if the requested kind is not available. log(message) is used to
+    report files that cannot be watched.
+    """
+    watcher = None
+    if kind in ("auto", "inotify"):
+        libc = _libc()
+        if libc is not None:
+            try:
+                watcher = InotifyWatcher(libc, interval, log)
+            except OSError:
+                watcher = None
+        if watcher is None and kind == "inotify":
+            return None
+    if watcher is None:
+        watcher = PollingWatcher(interval, log)
+    watcher.start()
+    return watcher
+
+# modules in these directories are never reloaded along with a handler
+_system_dirs = set()
+for _name in ("stdlib", "platstdlib", "purelib", "platlib"):
+    try:
+        _system_dirs.add(os.path.join(sysconfig.get_paths()[_name], ""))
+    except KeyError:
+        pass
+
+def local_dependencies(module):
+    """
+    Return the names of the modules referred to from the namespace
+    of module (imported modules and the modules of imported objects)
+    that are located in the directory of module or below it. These are
+    considered part of the same application and are reloaded with it.
+    """
+    filepath = module.__dict__.get("__file__")
+    if not filepath:
+        return []
+    root = os.path.join(os.path.dirname(filepath), "")
+    for d in _system_dirs:
+        if root.startswith(d):
+            return []
+
+    deps = []
+    for value in list(module.__dict__.values()):
+        if isinstance(value, types.ModuleType):
+            dep = value
+        else:
+            dep = getattr(value, "__module__", None)
+            if dep.__class__ is not str:
+                continue
+            dep = sys.modules.get(dep)
+        if dep is None or dep is module or dep.__name__ in deps:
+            continue
+        depfile = dep.__dict__.get("__file__")
+        if depfile and depfile.startswith(root):
+            deps.append(dep.__name__)
+    return deps
+
+def dependencies(module):
+    """
+    All local dependencies of module, recursively, each one
+    listed after its own dependencies.
+    """
+    order, seen = [], set([module.__name__])
+    def visit(mod):
+        for name in local_dependencies(mod):
+            if name not in seen:
+                seen.add(name)
+                dep = sys.modules.get(name)
+                if dep is not None:
+                    visit(dep)
+                    order.append(name)
+    visit(module)
+    return order
+
+def load_fresh(module, fresh=None):
+    """
+    Execute the source of module into a new module object, leaving
+    module and sys.modules untouched. The modules in fresh (a dict
+    of name -> module) are what the import statements of module get
+    instead of the ones in sys.modules, while it is being executed.
+    """
+    spec = module.__dict__.get("__spec__")
+    if spec is None or spec.loader is None:
+        spec = importlib.util.spec_from_file_location(module.__name__,
+                                                      module.__file__)
+    new = importlib.util.module_from_spec(spec)
+    if fresh:
+        _install_fresh_import()
+        _fresh.modules = fresh
+    try:
+        spec.loader.exec_module(new)
+    finally:
+        if fresh:
+            _fresh.modules = None
+    return new
+
+# the modules load_fresh() gives to the imports of the thread calling
+# it, other threads, and the modules once loaded, import as usual
+_fresh = threading.local()
+_real_import = None
+_real_import_lock = threading.Lock()
+
+def _install_fresh_import():
+    global _real_import
+    _real_import_lock.acquire()
+    try:
+        if _real_import is None:
+            _real_import = builtins.__import__
+            builtins.__import__ = _fresh_import
+    finally:
+        _real_import_lock.release()
+
+def _fresh_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """ __import__, looking in the fresh modules of this thread first """
+    fresh = getattr(_fresh, "modules", None)
+    if fresh:
+        absname = name
+        if level:
+            package = (globals or {}).get("__package__")
+            absname = package and importlib.util.resolve_name(
+                "." * level + name, package)
+        # "import a.b" is "a", only "from a.b import x" is "a.b"
+        if absname in fresh and (fromlist or "." not in absname):
+            return fresh[absname]
+    return _real_import(name, globals, locals, fromlist, level)
+
+class BackgroundReloader(object):
+    """
+    Reloads modules in a thread of its own. changed(module) tells
+    whether the file of a module has changed, done(old, new) is called
+    with the modules that were replaced and their new versions, or
+    with new set to None if the reload failed. log(message) is used
+    to report errors.
+    """
+
+    def __init__(self, changed, done, log):
+        self.changed = changed
+        self.done = done
+        self.log = log
+        self.pending = []
+        self.cond = threading.Condition()
+        self._thread = threading.Thread(target=self.run,
+                                        name="mod_python background reloader")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def schedule(self, module_name):
+        self.cond.acquire()
+        try:
+            if module_name not in self.pending:
+                self.pending.append(module_name)
+                self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def run(self):
+        while True:
+            self.cond.acquire()
+            try:
+                while not self.pending:
+                    self.cond.wait()
+                module_name = self.pending[0]
+            finally:
+                self.cond.release()
+            try:
+                self.reload(module_name)
+            except:
+                for line in traceback.format_exception(*sys.exc_info()):
+                    self.log("mod_python: background reload of '%s' failed: %s"
+                             % (module_name, line.rstrip()))
+            self.cond.acquire()
+            try:
+                self.pending.remove(module_name)
+            finally:
+                self.cond.release()
+
+    def reload(self, module_name):
+        module = sys.modules.get(module_name)
+        if module is None:
+            return
+
+        # dependencies first, so that a module is executed after the
+        # new versions of the modules it imports are ready; they are
+        # given to it by load_fresh(), sys.modules is left alone
+        old, new = {}, {}
+        try:
+            for name in dependencies(module) + [module_name]:
+                mod = sys.modules.get(name)
+                if mod is None:
+                    continue
+                old[name] = mod
+                if (name == module_name or self.changed(mod) or
+                    [d for d in local_dependencies(mod) if d in new]):
+                    new[name] = load_fresh(mod, new)
+        except:
+            # nothing has been replaced, keep the old versions
+            self.done(old, None)
+            raise
+
+        # this is the switch, all modules at once: from now on
+        # import_module() returns the new versions, requests in
+        # progress keep the old ones
+        sys.modules.update(new)
+        self.done(old, new)
@@ -0,0 +1,203 @@
+ #
+ # Copyright (C) 2000, 2001, 2013, 2024 Gregory Trubetskoy
+ # Copyright (C) 2002, 2003, 2004, 2005, 2006, 2007 Apache Software Foundation
+ #
+ # Licensed under the Apache License, Version 2.0 (the "License"); you
+ # may not use this file except in compliance with the License.  You
+ # may obtain a copy of the License at
+ #
+ #      http://www.apache.org/licenses/LICENSE-2.0
+ #
+ # Unless required by applicable law or agreed to in writing, software
+ # distributed under the License is distributed on an "AS IS" BASIS,
+ # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+ # implied.  See the License for the specific language governing
+ # permissions and limitations under the License.
+ #
+ # Originally developed by Gregory Trubetskoy.
+ #
+
+
+"""
+Streaming gzip/deflate compression of responses.
+
+    PythonOutputFilter mod_python.filters.compress COMPRESS
+    SetOutputFilter COMPRESS
+
+One zlib compressor is used for the whole response, so the result is
+a single stream compressed across the boundaries of the brigades the
+filter is invoked with. FLUSH buckets flush the compressor, so
+streamed responses still reach the client in time.
+
+Options (PythonOption):
+
+  mod_python.compress.types     content types to compress, separated
+                                by spaces (default: DEFAULT_TYPES)
+  mod_python.compress.min_size  bodies known to be smaller are sent
+                                uncompressed (default: 256)
+  mod_python.compress.level     zlib compression level (default: 6)
+"""
+
+import zlib
+from mod_python import apache
+
+DEFAULT_TYPES = ("text/html text/plain text/css text/xml text/javascript "
+                 "application/javascript application/json application/xml "
+                 "image/svg+xml")
+DEFAULT_MIN_SIZE = 256
+DEFAULT_LEVEL = 6
+
+# zlib window bits of each content coding
+_WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+def choose_encoding(accept_encoding):
+    """
+    The content coding to use for an Accept-Encoding header value,
+    gzip preferred over deflate, or None.
+    """
+    qs = {}
+    for item in accept_encoding.split(","):
+        parts = item.split(";")
+        coding = parts[0].strip().lower()
+        q = 1.0
+        for param in parts[1:]:
+            name, sep, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            qs[coding] = q
+    for coding in ("gzip", "deflate"):
+        q = qs.get(coding, qs.get("*", 0.0))
+        if q > 0:
+            return coding
+    return None
+
+def _add_vary(req):
+    vary = req.headers_out.get("Vary")
+    if not vary:
+        req.headers_out["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower() and vary.strip() != "*":
+        req.headers_out["Vary"] = vary + ", Accept-Encoding"
+
+class _Compressor(object):
+
+    def __init__(self, coding, level):
+        self.coding = coding
+        self.zobj = zlib.compressobj(level, zlib.DEFLATED, _WBITS[coding])
+
+    def compress(self, data):
+        return self.zobj.compress(data)
+
+    def flush(self):
+        return self.zobj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.zobj.flush(zlib.Z_FINISH)
+
+def _start(filter, pending):
+    """
+    Decide whether to compress the response, on the first invocation
+    of the filter, before the headers are sent. Returns a _Compressor
+    or None. What had to be read to decide is appended to pending.
+    """
+    req = filter.req
+
+    if req.main or req.header_only or req.status in (204, 206, 304):
+        return None
+    if "Content-Encoding" in req.headers_out or "Content-Range" in req.headers_out:
+        return None
+    if "no-transform" in req.headers_out.get("Cache-Control", "").lower():
+        return None
+
+    options = req.get_options()
+    ctype = (req.content_type or "").split(";", 1)[0].strip().lower()
+    types = options.get("mod_python.compress.types", DEFAULT_TYPES).lower().split()
+    if ctype not in types:
+        return None
+
+    # from here on, the response depends on the request
+    _add_vary(req)
+
+    coding = choose_encoding(req.headers_in.get("Accept-Encoding", ""))
+    if not coding:
+        return None
+
+    min_size = int(options.get("mod_python.compress.min_size", DEFAULT_MIN_SIZE))
+    length = req.headers_out.get("Content-Length")
+    if length is not None and length.isdigit() and int(length) < min_size:
+        return None
+
+    # without a length, look at what we have; if the whole body is
+    # here already and small, it is not worth it
+    size = 0
+    s = filter.read()
+    pending.append(s)
+    while s:
+        size += len(s)
+        s = filter.read()
+        pending.append(s)
+    if s is None and size < min_size:
+        return None
+
+    del req.headers_out["Content-Length"]
+    del req.headers_out["Content-MD5"]
+    etag = req.headers_out.get("ETag")
+    if etag:
+        # a different representation needs a different tag
+        if etag.endswith('"'):
+            req.headers_out["ETag"] = '%s-%s"' % (etag[:-1], coding)
+        else:
+            req.headers_out["ETag"] = "%s-%s" % (etag, coding)
+    req.headers_out["Content-Encoding"] = coding
+
+    level = int(options.get("mod_python.compress.level", DEFAULT_LEVEL))
+    return _Compressor(coding, level)
+
+def _chunks(filter, pending):
+    """
+    What _start() read, then the rest of the brigade up to its end,
+    a FLUSH (both "") or EOS (None)
+    """
+    for s in pending:
+        yield s
+    if pending:
+        return
+    s = filter.read()
+    while s:
+        yield s
+        s = filter.read()
+    yield s
+
+def outputfilter(filter):
+
+    pending = []
+
+    compressor = filter.ctx
+    if compressor is None:
+        compressor = filter.ctx = _start(filter, pending)
+        if compressor is None:
+            # the next brigades go past the filter without calling
+            # it, this one is copied below
+            filter.disable()
+
+    while True:
+        for s in _chunks(filter, pending):
+            if s is None:
+                if compressor:
+                    filter.write(compressor.finish())
+                filter.close()
+                return
+            if s and compressor:
+                s = compressor.compress(s)
+            if s:
+                filter.write(s)
+        if not filter.at_flush:
+            # end of this brigade
+            return
+        if compressor:
+            filter.write(compressor.flush())
+        filter.flush()
+        pending = []
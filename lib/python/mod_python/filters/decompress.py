@@ -0,0 +1,192 @@
+ #
+ # Copyright (C) 2000, 2001, 2013, 2024 Gregory Trubetskoy
+ # Copyright (C) 2002, 2003, 2004, 2005, 2006, 2007 Apache Software Foundation
+ #
+ # Licensed under the Apache License, Version 2.0 (the "License"); you
+ # may not use this file except in compliance with the License.  You
+ # may obtain a copy of the License at
+ #
+ #      http://www.apache.org/licenses/LICENSE-2.0
+ #
+ # Unless required by applicable law or agreed to in writing, software
+ # distributed under the License is distributed on an "AS IS" BASIS,
+ # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+ # implied.  See the License for the specific language governing
+ # permissions and limitations under the License.
+ #
+ # Originally developed by Gregory Trubetskoy.
+ #
+
+
+"""
+Streaming decompression of gzip or deflate request bodies.
+
+    PythonFixupHandler mod_python.filters.decompress
+
+The fixup handler adds the input filter to requests with a body in
+one of these content codings, so that the handler reads the body as
+it was before it was compressed, with req.read(), FieldStorage or
+wsgi.input alike. The body is decompressed as it is read, never more
+than the reader asks for at a time.
+
+The Content-Encoding header is removed from the request, the
+Content-Length (of the compressed body) is left for httpd to read the
+body with, but is no longer set in the WSGI environment.
+
+Options (PythonOption):
+
+  mod_python.decompress.max_ratio  the body may not be more than this
+                                   many times larger than it was
+                                   compressed (default: 100)
+  mod_python.decompress.max_size   nor larger than this many bytes
+                                   (default: 0, no limit)
+
+A body that breaks a limit or is not valid fails to read, which the
+reading handler sees as an IOError.
+"""
+
+import zlib
+from mod_python import apache
+
+DEFAULT_MAX_RATIO = 100
+DEFAULT_MAX_SIZE = 0
+
+# the ratio is not checked for bodies smaller than this
+RATIO_MIN_SIZE = 65536
+
+# the amount to return if the reader does not say
+CHUNK_SIZE = 65536
+
+# zlib window bits of each content coding, deflate is tried with the
+# zlib header (as it should be) first and raw after
+_WBITS = {"gzip": 16 + zlib.MAX_WBITS, "x-gzip": 16 + zlib.MAX_WBITS,
+          "deflate": zlib.MAX_WBITS}
+
+FILTER_NAME = "MP_DECOMPRESS"
+
+def fixuphandler(req):
+    """ Adds the input filter if the request body is compressed """
+
+    if req.main:
+        return apache.DECLINED
+
+    coding = req.headers_in.get("Content-Encoding", "").strip().lower()
+    if coding not in _WBITS:
+        return apache.DECLINED
+
+    del req.headers_in["Content-Encoding"]
+    req.notes["mod_python.decompress"] = coding
+
+    req.register_input_filter(FILTER_NAME, "mod_python.filters.decompress")
+    req.add_input_filter(FILTER_NAME)
+
+    return apache.DECLINED
+
+class _Decompressor(object):
+
+    def __init__(self, coding, max_ratio, max_size):
+        self.coding = coding
+        self.max_ratio = max_ratio
+        self.max_size = max_size
+        self.zobj = zlib.decompressobj(_WBITS[coding])
+        self.tail = b""
+        self.size_in = 0
+        self.size_out = 0
+        self.started = False
+        self.eof = False
+
+    def feed(self, data):
+        """ Compressed data, read from the previous filter """
+        self.size_in += len(data)
+        self.tail += data
+
+    def read(self, size):
+        """ At most size bytes of the decompressed body """
+        if not self.tail or self.eof:
+            return b""
+        try:
+            try:
+                data = self.zobj.decompress(self.tail, size)
+            except zlib.error:
+                if self.started or self.coding != "deflate":
+                    raise
+                # deflate without the zlib header
+                self.zobj = zlib.decompressobj(-zlib.MAX_WBITS)
+                data = self.zobj.decompress(self.tail, size)
+        except zlib.error as e:
+            raise IOError("invalid %s request body: %s" % (self.coding, e))
+        self.started = True
+        self.tail = self.zobj.unconsumed_tail
+        if self.zobj.unused_data:
+            if self.coding == "deflate":
+                raise IOError("data after the end of the deflate stream")
+            # gzip allows for more than one member
+            self.tail = self.zobj.unused_data + self.tail
+            self.zobj = zlib.decompressobj(_WBITS[self.coding])
+        self.size_out += len(data)
+        if self.max_size and self.size_out > self.max_size:
+            raise IOError("decompressed request body is larger than %d bytes"
+                          % self.max_size)
+        if (self.size_out > RATIO_MIN_SIZE and
+            self.size_out > self.max_ratio * self.size_in):
+            raise IOError("request body expands more than %d times"
+                          % self.max_ratio)
+        return data
+
+    def finish(self):
+        """ The compressed body has been read """
+        data = self.zobj.flush()
+        if self.tail or not self.zobj.eof:
+            raise IOError("truncated %s request body" % self.coding)
+        self.eof = True
+        return data
+
+def _start(req):
+    """ The _Decompressor for the request body, or None """
+
+    coding = req.notes.get("mod_python.decompress")
+    if not coding:
+        # the filter was added without the fixup handler
+        coding = req.headers_in.get("Content-Encoding", "").strip().lower()
+        if coding not in _WBITS:
+            return None
+        del req.headers_in["Content-Encoding"]
+
+    options = req.get_options()
+    max_ratio = int(options.get("mod_python.decompress.max_ratio",
+                                DEFAULT_MAX_RATIO))
+    max_size = int(options.get("mod_python.decompress.max_size",
+                               DEFAULT_MAX_SIZE))
+    return _Decompressor(coding, max_ratio, max_size)
+
+def inputfilter(filter):
+
+    d = filter.ctx
+    if d is None:
+        d = filter.ctx = _start(filter.req)
+        if d is None:
+            # the next reads go past the filter without calling it,
+            # this one is passed on as it is
+            filter.disable()
+            filter.pass_on()
+            return
+
+    # httpd readers take no more than they ask for
+    size = filter.readbytes or CHUNK_SIZE
+
+    while True:
+        data = d.read(size)
+        if data:
+            filter.write(data)
+            return
+        if d.eof:
+            filter.close()
+            return
+        s = filter.read()
+        if s is None:
+            data = d.finish()
+            if data:
+                filter.write(data)
+            filter.close()
+            return
+        d.feed(s)
@@ -0,0 +1,332 @@
+ #
+ # Copyright (C) 2000, 2001, 2013, 2024 Gregory Trubetskoy
+ # Copyright (C) 2002, 2003, 2004, 2005, 2006, 2007 Apache Software Foundation
+ #
+ # Licensed under the Apache License, Version 2.0 (the "License"); you
+ # may not use this file except in compliance with the License.  You
+ # may obtain a copy of the License at
+ #
+ #      http://www.apache.org/licenses/LICENSE-2.0
+ #
+ # Unless required by applicable law or agreed to in writing, software
+ # distributed under the License is distributed on an "AS IS" BASIS,
+ # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+ # implied.  See the License for the specific language governing
+ # permissions and limitations under the License.
+ #
+ # Originally developed by Gregory Trubetskoy.
+ #
+
+
+"""
+A short lived cache of whole responses.
+
+    PythonFixupHandler mod_python.filters.microcache
+    PythonOutputFilter mod_python.filters.microcache MICROCACHE
+    SetOutputFilter MICROCACHE
+
+The output filter keeps a copy of the response (status, headers and
+body) of GET requests, the fixup handler sends the copy in reply to
+the same request until it expires, so that the handler does not run
+at all. An expired response is still sent for a while (the stale
+period), during which one request at a time goes through to the
+handler to refresh it.
+
+The responses are kept in memory, by each interpreter of each child
+process, limited to mod_python.microcache.max_bytes. The filter sees
+the response as it is at its place in the chain of filters, it should
+come after the filters that change the content of the response, as
+the cached response is sent as it is.
+
+Options (PythonOption):
+
+  mod_python.microcache.ttl        seconds a response is fresh
+                                   (default: 1)
+  mod_python.microcache.stale      seconds an expired response is still
+                                   sent while it is refreshed (default: 10)
+  mod_python.microcache.vary       request headers the response depends
+                                   on, separated by commas, e.g. "Cookie";
+                                   a response with a Vary header naming
+                                   any other header (or "*") is not cached
+  mod_python.microcache.max_size   larger responses are not cached
+                                   (default: 1048576)
+  mod_python.microcache.max_bytes  the size of the cache, read once by
+                                   each interpreter (default: 67108864)
+"""
+
+import time
+from mod_python import apache
+
+try:
+    from threading import Lock
+except ImportError:
+    from dummy_threading import Lock
+
+DEFAULT_TTL = 1.0
+DEFAULT_STALE = 10.0
+DEFAULT_MAX_SIZE = 1 << 20
+DEFAULT_MAX_BYTES = 64 << 20
+
+# statuses that may be cached without explicit freshness information
+CACHEABLE_STATUS = (200, 203, 300, 301, 404, 410)
+
+# headers that are not stored, they are set for every response
+_SKIP_HEADERS = ("connection", "keep-alive", "transfer-encoding",
+                 "content-length", "date", "age")
+
+class Entry(object):
+    """ A cached response """
+
+    __slots__ = ("status", "content_type", "headers", "body",
+                 "created", "expires", "stale_until", "refreshing", "size")
+
+    def __init__(self, status, content_type, headers, body, now, ttl, stale):
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers
+        self.body = body
+        self.created = now
+        self.expires = now + ttl
+        self.stale_until = self.expires + stale
+        self.refreshing = False
+        self.size = len(body) + sum([len(k) + len(v) for k, v in headers])
+
+class Store(object):
+    """
+    Entries by key, the least recently used ones are dropped once
+    their sizes add up to more than max_bytes.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = {}
+        self._order = {}     # key -> access count
+        self._count = 0
+        self._lock = Lock()
+
+    def get(self, key, now, refresh=True):
+        """
+        The entry to send for key, or None if the request has to go
+        through to the handler. The first request to find the entry
+        stale gets None (and refreshes it), the others get the stale
+        entry until it is replaced or the stale period is over.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if now >= entry.expires:
+                if now >= entry.stale_until:
+                    self._remove(key)
+                    return None
+                if refresh and not entry.refreshing:
+                    entry.refreshing = True
+                    return None
+            self._count += 1
+            self._order[key] = self._count
+            return entry
+        finally:
+            self._lock.release()
+
+    def put(self, key, entry):
+        self._lock.acquire()
+        try:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._count += 1
+            self._order[key] = self._count
+            self.size += entry.size
+            if self.size > self.max_bytes:
+                # oldest first, until a quarter of the space is free
+                target = self.max_bytes * 3 // 4
+                for n, k in sorted([(n, k) for k, n in self._order.items()]):
+                    if self.size <= target:
+                        break
+                    self._remove(k)
+        finally:
+            self._lock.release()
+
+    def release(self, key):
+        """ The refresh of key failed, let the next request try """
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.refreshing = False
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._order.clear()
+            self.size = 0
+        finally:
+            self._lock.release()
+
+    def _remove(self, key):
+        self.size -= self._entries.pop(key).size
+        del self._order[key]
+
+_store = None
+_store_lock = Lock()
+
+def get_store(options):
+    """ The Store of this interpreter, created on first use """
+    global _store
+    if _store is None:
+        _store_lock.acquire()
+        try:
+            if _store is None:
+                max_bytes = int(options.get("mod_python.microcache.max_bytes",
+                                            DEFAULT_MAX_BYTES))
+                _store = Store(max_bytes)
+        finally:
+            _store_lock.release()
+    return _store
+
+def _header_names(value):
+    """ The lower case header names in a comma separated list """
+    return [h.strip().lower() for h in value.split(",") if h.strip()]
+
+def cache_key(req, options):
+    """
+    The key of the response to req, or None if it must not be
+    cached: the method (HEAD shares the entries of GET), host and
+    URI, and the values of the request headers it varies on.
+    """
+    if req.main or req.method not in ("GET", "HEAD"):
+        return None
+    vary = _header_names(options.get("mod_python.microcache.vary", ""))
+    # a response to credentials, such as the cookie of a session, is
+    # only for the user who sent them
+    for name in ("authorization", "cookie"):
+        if name in req.headers_in and name not in vary:
+            return None
+    key = ["GET", req.hostname, req.unparsed_uri]
+    for name in vary:
+        key.append(req.headers_in.get(name))
+    return tuple(key)
+
+def fixuphandler(req):
+    """ Sends the cached response to req, if there is one """
+
+    options = req.get_options()
+    key = cache_key(req, options)
+    if key is None:
+        return apache.DECLINED
+
+    now = time.time()
+    entry = get_store(options).get(key, now, refresh=not req.header_only)
+    if entry is None:
+        return apache.DECLINED
+
+    req.status = entry.status
+    if entry.content_type:
+        req.content_type = entry.content_type
+    for name, value in entry.headers:
+        req.headers_out.add(name, value)
+    req.headers_out["Age"] = str(int(now - entry.created))
+    req.set_content_length(len(entry.body))
+    if not req.header_only:
+        req.write(entry.body, 0)
+
+    return apache.DONE
+
+class _Capture(object):
+    """ The response as it goes through the filter """
+
+    def __init__(self, key, store, max_size, ttl, stale):
+        self.key = key
+        self.store = store
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale = stale
+        self.chunks = []
+        self.size = 0
+
+    def add(self, data):
+        if self.chunks is None:
+            return
+        self.size += len(data)
+        if self.size > self.max_size:
+            # too large, give up on this one
+            self.chunks = None
+        else:
+            self.chunks.append(bytes(data))
+
+    def finish(self, req):
+        if self.chunks is None or req.status not in CACHEABLE_STATUS:
+            self.store.release(self.key)
+            return
+        headers = []
+        for table in (req.headers_out, req.err_headers_out):
+            for name, value in table.items():
+                if name.lower() not in _SKIP_HEADERS:
+                    headers.append((name, value))
+        entry = Entry(req.status, req.content_type, headers,
+                      b"".join(self.chunks), time.time(),
+                      self.ttl, self.stale)
+        self.store.put(self.key, entry)
+
+def _start(req):
+    """
+    Decide whether to keep the response, on the first invocation of
+    the filter. Returns a _Capture or None.
+    """
+    options = req.get_options()
+    key = cache_key(req, options)
+    if key is None or req.header_only:
+        return None
+
+    store = get_store(options)
+    cacheable = req.status in CACHEABLE_STATUS
+    vary = _header_names(options.get("mod_python.microcache.vary", ""))
+    for table in (req.headers_out, req.err_headers_out):
+        cc = table.get("Cache-Control", "").lower()
+        if ("Set-Cookie" in table or
+            "no-store" in cc or "private" in cc or "no-cache" in cc):
+            cacheable = False
+        # the key has to vary on everything the response does
+        # (e.g. Accept-Encoding, added by compressing filters)
+        for name, value in table.items():
+            if name.lower() == "vary":
+                for h in _header_names(value):
+                    if h not in vary:
+                        cacheable = False
+    if not cacheable:
+        # if this request was to refresh the entry, another one will
+        store.release(key)
+        return None
+
+    ttl = float(options.get("mod_python.microcache.ttl", DEFAULT_TTL))
+    stale = float(options.get("mod_python.microcache.stale", DEFAULT_STALE))
+    max_size = int(options.get("mod_python.microcache.max_size", DEFAULT_MAX_SIZE))
+    return _Capture(key, store, max_size, ttl, stale)
+
+def outputfilter(filter):
+
+    capture = filter.ctx
+    if capture is None:
+        capture = filter.ctx = _start(filter.req)
+        if capture is None:
+            # the next brigades go past the filter without calling
+            # it, this one is passed on below
+            filter.disable()
+
+    for b in filter.buckets():
+        if b == "EOS":
+            if capture:
+                capture.finish(filter.req)
+            filter.close()
+            return
+        elif b == "FLUSH":
+            filter.flush()
+        else:
+            if capture:
+                capture.add(b)
+            filter.write(b)
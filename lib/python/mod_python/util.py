@@ -31,6 +31,8 @@ else:
 from io import BytesIO
 import tempfile
 import re
+import os
+import binascii
 
 from types import *
 import collections
@@ -271,7 +273,11 @@ class FieldStorage:
             raise TypeError("ctype must be of type bytes")
 
         if ctype.startswith(b"application/x-www-form-urlencoded"):
-            v = req.read(clen)
+            if "mod_python.decompress" in req.notes:
+                # decompressed, longer than the Content-Length
+                v = req.read()
+            else:
+                v = req.read(clen)
             if not isinstance(v, bytes):
                 raise TypeError("req.read() must return bytes")
             pairs = self.parse_qsl_safely(v, keep_blank_values)
@@ -686,3 +692,143 @@ def redirect(req, location, permanent=0, text=None):
         req.write(text)
 
     raise apache.SERVER_RETURN(apache.DONE)
+
+def parse_range(header, size):
+    """
+    Parse the value of a Range header for an entity of size bytes.
+    Return a list of (offset, length) tuples, an empty list if no
+    range is satisfiable, or None if the header is not a valid byte
+    range set, in which case it must be ignored.
+    """
+
+    unit, sep, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not sep:
+        return None
+
+    ranges = []
+    for r in spec.split(','):
+        r = r.strip()
+        if not r:
+            continue
+        first, sep, last = r.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first.isdigit() or last.isdigit()):
+            return None
+        if (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # suffix range, the last bytes
+            length = min(int(last), size)
+            if length:
+                ranges.append((size - length, length))
+            continue
+        first = int(first)
+        if last:
+            last = int(last)
+            if last < first:
+                return None
+        else:
+            last = size - 1
+        if first < size:
+            ranges.append((first, min(last, size - 1) - first + 1))
+    return ranges
+
+# like the MaxRanges default of httpd, more ranges than this (after
+# coalescing) are answered with the whole file
+MAX_RANGES = 200
+
+def coalesce_ranges(ranges):
+    """
+    Merge the (offset, length) ranges that overlap or are adjacent,
+    and return them in the order of their offsets.
+    """
+
+    merged = []
+    for offset, length in sorted(ranges):
+        if merged and offset <= merged[-1][0] + merged[-1][1]:
+            first, n = merged[-1]
+            merged[-1] = (first, max(n, offset + length - first))
+        else:
+            merged.append((offset, length))
+    return merged
+
+def send_file(req, f, content_type=None):
+    """
+    Send the file f (a path, a file descriptor or an object with a
+    fileno() method) with req.sendfile(), honoring the Range and
+    If-Range request headers. A single range is sent as 206 Partial
+    Content, several as multipart/byteranges. Overlapping and adjacent
+    ranges are merged, and more than MAX_RANGES ranges are answered
+    with the whole file. Validators (ETag,
+    Last-Modified) are expected in req.headers_out already, they are
+    used to evaluate If-Range. Returns the status the handler should
+    return.
+    """
+
+    if isinstance(f, str) or isinstance(f, bytes):
+        size = os.stat(f).st_size
+    elif isinstance(f, int):
+        size = os.fstat(f).st_size
+    else:
+        size = os.fstat(f.fileno()).st_size
+
+    if content_type:
+        req.content_type = content_type
+    req.headers_out['Accept-Ranges'] = 'bytes'
+
+    ranges = None
+    header = req.headers_in.get('Range')
+    if header and req.method in ('GET', 'HEAD'):
+        ranges = parse_range(header, size)
+        if ranges:
+            ranges = coalesce_ranges(ranges)
+            if len(ranges) > MAX_RANGES:
+                ranges = None
+        if_range = req.headers_in.get('If-Range')
+        if if_range and if_range not in (req.headers_out.get('ETag'),
+                                         req.headers_out.get('Last-Modified')):
+            # the representation has changed, send all of it
+            ranges = None
+
+    if ranges is None:
+        req.set_content_length(size)
+        if not req.header_only:
+            req.sendfile(f)
+        return apache.OK
+
+    if not ranges:
+        req.headers_out['Content-Range'] = 'bytes */%d' % size
+        return apache.HTTP_RANGE_NOT_SATISFIABLE
+
+    req.status = apache.HTTP_PARTIAL_CONTENT
+
+    if len(ranges) == 1:
+        offset, length = ranges[0]
+        req.headers_out['Content-Range'] = 'bytes %d-%d/%d' % (
+            offset, offset + length - 1, size)
+        req.set_content_length(length)
+        if not req.header_only:
+            req.sendfile(f, offset, length)
+        return apache.OK
+
+    boundary = binascii.hexlify(os.urandom(12)).decode('latin1')
+    part_type = req.content_type or 'application/octet-stream'
+    parts, total = [], 0
+    for offset, length in ranges:
+        head = ('\r\n--%s\r\nContent-Type: %s\r\n'
+                'Content-Range: bytes %d-%d/%d\r\n\r\n' % (
+                    boundary, part_type, offset, offset + length - 1, size))
+        head = head.encode('latin1')
+        parts.append(head)
+        parts.append((offset, length))
+        total += len(head) + length
+    tail = ('\r\n--%s--\r\n' % boundary).encode('latin1')
+    parts.append(tail)
+    total += len(tail)
+
+    req.content_type = 'multipart/byteranges; boundary=%s' % boundary
+    req.set_content_length(total)
+    if not req.header_only:
+        # one call, so that the file is opened only once
+        req.sendfile(f, parts)
+    return apache.OK
@@ -17,9 +17,234 @@
  # Originally developed by Gregory Trubetskoy.
  #
 
+import os
 import sys
+import stat
+import time
+import traceback
 from mod_python import apache
 
+# (mod_python.wsgi.application, directory) -> (autoreload,
+# apache._HandlerCacheEntry of the application)
+_app_cache = {}
+
+# mod_python.wsgi.buffer_size option value -> size in bytes
+_buffer_sizes = {}
+
+class _OutputBuffer(object):
+    """
+    Coalesces the chunks of a WSGI response into writes of at least
+    size bytes. The connection is flushed only when that much has
+    been buffered. If the whole response fits in the buffer, it is
+    sent with a Content-Length header.
+    """
+
+    def __init__(self, req, size):
+        self.req = req
+        self.size = size
+        self.chunks = []
+        self.length = 0
+        self.flushed = False
+
+    def write(self, data):
+        if data.__class__ is not bytes:
+            if isinstance(data, str):
+                raise TypeError("WSGI response data must be bytes, "
+                                "not str (PEP 3333)")
+            # a bytearray, memoryview or other buffer, copied since
+            # the application may reuse it once this returns
+            data = memoryview(data).tobytes()
+        if data:
+            self.chunks.append(data)
+            self.length += len(data)
+            if self.length >= self.size:
+                self.flush()
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info is None:
+            self.req.wsgi_start_response(status, headers)
+        else:
+            self.req.wsgi_start_response(status, headers, exc_info)
+        return self.write
+
+    def _data(self):
+        if len(self.chunks) == 1:
+            return self.chunks[0]
+        return b"".join(self.chunks)
+
+    def flush(self):
+        if self.chunks:
+            self.req.write(self._data())
+            self.chunks, self.length = [], 0
+        self.flushed = True
+
+    def close(self, more=0):
+        """
+        Write out what is left at the end of the response, which is
+        followed by more bytes sent otherwise (see FileWrapper).
+        """
+        req = self.req
+        length = self.length + more
+        if not self.flushed and length and not req.header_only and \
+                "Content-Length" not in req.headers_out:
+            req.set_content_length(length)
+        if self.chunks:
+            # no need to flush, the end of the request will
+            req.write(self._data(), 0)
+            self.chunks, self.length = [], 0
+
+class FileWrapper(object):
+    """
+    The wsgi.file_wrapper. When an application returns one, the
+    handler sends the file with req.sendfile(), so that Apache can
+    use sendfile(2), provided the file object has a descriptor of a
+    regular file (which may have been unlinked, as temporary files
+    are). Otherwise it is iterated over in blocks of blksize bytes.
+
+    The file is sent from its current position, and at most length
+    bytes of it if length is given.
+    """
+
+    def __init__(self, filelike, blksize=8192, length=None):
+        self.filelike = filelike
+        self.blksize = blksize
+        self.length = length
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        left = self.length
+        while left is None or left > 0:
+            n = self.blksize if left is None else min(self.blksize, left)
+            data = self.filelike.read(n)
+            if not data:
+                break
+            if left is not None:
+                left -= len(data)
+            yield data
+
+    def _file(self):
+        """ The file descriptor, offset and length of the file, or None """
+        try:
+            fd = self.filelike.fileno()
+            st = os.fstat(fd)
+            offset = self.filelike.tell()
+        except (AttributeError, ValueError, IOError, OSError):
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        length = max(st.st_size - offset, 0)
+        if self.length is not None:
+            length = min(length, self.length)
+        return fd, offset, length
+
+    def sendfile(self, req, output=None):
+        """
+        Send the file with req.sendfile(), after what is in output,
+        if any. Returns False if the file cannot be sent that way.
+        """
+        f = self._file()
+        if f is None:
+            return False
+        fd, offset, length = f
+        if output is not None:
+            output.close(more=length)
+        elif req._bytes_queued == 0 and not req.header_only and \
+                "Content-Length" not in req.headers_out:
+            req.set_content_length(length)
+        if length:
+            # the descriptor is duplicated, the application may
+            # close the file as soon as this returns
+            req.sendfile(fd, offset, length)
+        return True
+
+def _split_app_str(app_str):
+    if '::' in app_str:
+        return app_str.split('::', 1)
+    return app_str, 'application'
+
+def _find_app(req, app_str):
+    """
+    Return the application callable named by app_str. It is cached
+    for the directory of the handler, so that the configuration only
+    needs to be looked at the first time. With PythonAutoReload, the
+    module is still checked for changes on every request.
+    """
+    key = (app_str, req.hlist.directory)
+    entry = _app_cache.get(key)
+    if entry is not None:
+        autoreload, cached = entry
+        # a reload keeps the module object, so is_current() looks at
+        # its __mtime__ as well
+        if cached.is_current(autoreload):
+            return cached.obj
+
+    mod_str, callable_str = _split_app_str(app_str)
+    config = req.get_config()
+    autoreload, log = True, False
+    if "PythonAutoReload" in config:
+        autoreload = config["PythonAutoReload"] == "1"
+    if "PythonDebug" in config:
+        log = config["PythonDebug"] == "1"
+    module = apache.import_module(mod_str, autoreload=autoreload, log=log)
+
+    app = module.__dict__.get(callable_str)
+    if app:
+        _app_cache[key] = (autoreload, apache._HandlerCacheEntry(
+            mod_str, module, app, False, True))
+    return app
+
+def _buffer_size(req, value):
+    """
+    The mod_python.wsgi.buffer_size option value as an int, parsed
+    once per value. An invalid value is logged and turns buffering
+    off.
+    """
+    if not value:
+        return 0
+    try:
+        return _buffer_sizes[value]
+    except KeyError:
+        pass
+    try:
+        size = int(value)
+    except ValueError:
+        req.log_error(
+            'WSGI handler: invalid mod_python.wsgi.buffer_size %s, not buffering.'
+            % repr(value), apache.APLOG_WARNING)
+        size = 0
+    _buffer_sizes[value] = size
+    return size
+
+def preload():
+    """
+    Import the applications listed (separated by spaces) in the
+    mod_python.wsgi.preload option of the main server, to be called
+    at child initialization with PythonImport:
+
+      PythonOption mod_python.wsgi.preload mysite.wsgi
+      PythonImport mod_python.wsgi::preload main_interpreter
+    """
+    options = apache.main_server.get_options()
+    for app_str in options.get('mod_python.wsgi.preload', '').split():
+        mod_str, callable_str = _split_app_str(app_str)
+        t = time.time()
+        try:
+            module = apache.import_module(mod_str)
+            if not module.__dict__.get(callable_str):
+                apache.log_error(
+                    'WSGI preload: %s not found in module %s.'
+                    % (repr(callable_str), repr(mod_str)), apache.APLOG_WARNING)
+                continue
+        except:
+            for line in traceback.format_exception(*sys.exc_info()):
+                apache.log_error('WSGI preload: %s' % line.rstrip(),
+                                 apache.APLOG_ERR)
+            continue
+        apache.log_error(
+            'WSGI preload: %s loaded in %.3f seconds (interpreter %s).'
+            % (app_str, time.time() - t, apache.interpreter), apache.APLOG_NOTICE)
+
 def handler(req):
 
     options = req.get_options()
@@ -29,21 +254,7 @@ def handler(req):
     app = None
     app_str = options['mod_python.wsgi.application']
     if app_str:
-        if '::' in app_str:
-            mod_str, callable_str = app_str.split('::', 1)
-        else:
-            mod_str, callable_str = app_str, 'application'
-        config = req.get_config()
-        autoreload, log = True, False
-        if "PythonAutoReload" in config:
-            autoreload = config["PythonAutoReload"] == "1"
-        if "PythonDebug" in config:
-            log = config["PythonDebug"] == "1"
-        module = apache.import_module(mod_str, autoreload=autoreload, log=log)
-
-        try:
-            app = module.__dict__[callable_str]
-        except KeyError: pass
+        app = _find_app(req, app_str)
 
     if not app:
         req.log_error(
@@ -64,12 +275,35 @@ def handler(req):
             % (repr(req.uri), repr(base_uri)), apache.APLOG_WARNING)
         return apache.DECLINED
 
+    if 'mod_python.decompress' in req.notes:
+        # the body is decompressed as it is read, its length is not
+        # known, the application reads wsgi.input to the end
+        env.pop('CONTENT_LENGTH', None)
+        env['wsgi.input_terminated'] = True
+
+    env['wsgi.file_wrapper'] = FileWrapper
+
     ## Run the app
 
-    response = None
+    buffer_size = _buffer_size(req, options.get('mod_python.wsgi.buffer_size'))
+
+    response = output = None
     try:
-        response = app(env, req.wsgi_start_response)
-        [req.write(token) for token in response]
+        if buffer_size > 0:
+            output = _OutputBuffer(req, buffer_size)
+            response = app(env, output.start_response)
+        else:
+            response = app(env, req.wsgi_start_response)
+
+        if isinstance(response, FileWrapper) and \
+                response.sendfile(req, output):
+            pass
+        elif output is not None:
+            for token in response:
+                output.write(token)
+            output.close()
+        else:
+            [req.write(token) for token in response]
     finally:
         # call close() if there is one
         if type(response) not in (list, tuple):
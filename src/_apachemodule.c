@@ -419,6 +419,26 @@ static PyObject *server_root(void)
     return MpBytesOrUnicode_FromString(ap_server_root);
 }
 
+/**
+ ** _table_index_min
+ **
+ *   Sets the size from which mp_tables are indexed (0 disables the
+ *   index), returns the previous one. Meant for benchmarks.
+ */
+
+static PyObject *_table_index_min(PyObject *self, PyObject *args)
+{
+    int n = -1, old = mp_table_index_min;
+
+    if (! PyArg_ParseTuple(args, "|i", &n))
+        return NULL;
+
+    if (n >= 0)
+        mp_table_index_min = n;
+
+    return PyLong_FromLong(old);
+}
+
 /**
  ** _global_lock
  **
@@ -815,6 +835,7 @@ static PyMethodDef _apache_module_methods[] = {
     {"_global_lock",          (PyCFunction)_global_lock,         METH_VARARGS},
     {"_global_trylock",       (PyCFunction)_global_trylock,      METH_VARARGS},
     {"_global_unlock",        (PyCFunction)_global_unlock,       METH_VARARGS},
+    {"_table_index_min",      (PyCFunction)_table_index_min,     METH_VARARGS},
     {NULL, NULL} /* sentinel */
 };
 
@@ -49,6 +49,7 @@ PyObject * MpConn_FromConn(conn_rec *c)
     result->base_server = NULL;
     result->notes = MpTable_FromTable(c->notes);
     result->hlo = NULL;
+    result->interpreter_wait = 0;
 
     return (PyObject *)result;
 }
@@ -389,6 +390,9 @@ static PyObject * conn_getattr(connobject *self, char *name)
         Py_INCREF(self->hlo);
         return (PyObject *)self->hlo;
     }
+    else if (strcmp(name, "interpreter_wait") == 0) {
+        return PyFloat_FromDouble(self->interpreter_wait);
+    }
     else if (strcmp(name, "_conn_rec") == 0) {
 #if PY_MAJOR_VERSION == 2 && PY_MINOR_VERSION < 7
         return PyCObject_FromVoidPtr(self->conn, 0);
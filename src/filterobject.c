@@ -48,8 +48,10 @@
  * filter.read() - copies data from *given* bucket brigade (saved in
  * self->bb_in) into a Python string.
  *
- * filter.write() - copies data from a Python string into a *new*
- * bucket brigade (saved in self->bb_out).
+ * filter.write() - adds data from a Python string (or any object
+ * supporting the buffer protocol) to a *new* bucket brigade (saved in
+ * self->bb_out). Large immutable buffers are not copied but added as
+ * transient buckets, and held until the brigade is passed.
  *
  * filter.close() - appends an EOS and passes the self->bb_out brigade
  * to the next filter via ap_pass_brigade()
@@ -102,12 +104,18 @@ PyObject *MpFilter_FromFilter(ap_filter_t *f, apr_bucket_brigade *bb, int is_inp
     }
 
     result->closed = 0;
+    result->at_flush = 0;
     result->softspace = 0;
 
     result->handler = handler;
     result->dir = dir;
 
     result->request_obj = NULL;
+    result->interpreter_wait = 0;
+    result->held = NULL;
+    result->bb_seen = NULL;
+    result->views = NULL;
+    result->ctx = NULL;
 
     apr_pool_cleanup_register(f->r->pool, (PyObject *)result, python_decref,
                               apr_pool_cleanup_null);
@@ -165,6 +173,8 @@ static PyObject *_filter_read(filterobject *self, PyObject *args, int readline)
         return NULL;
     }
 
+    self->at_flush = 0;
+
     if (self->is_input) {
 
         /* does the output brigade exist? */
@@ -200,6 +210,14 @@ static PyObject *_filter_read(filterobject *self, PyObject *args, int readline)
         return Py_None;
     }
 
+    /* reached a flush? the data before it has been returned by the
+       previous read, let the filter know so it can flush too */
+    if (APR_BUCKET_IS_FLUSH(b)) {
+        apr_bucket_delete(b);
+        self->at_flush = 1;
+        return PyBytes_FromString("");
+    }
+
     bufsize = len < 0 ? HUGE_STRING_LEN : len;
     result = PyBytes_FromStringAndSize(NULL, bufsize);
 
@@ -304,6 +322,259 @@ static PyObject *filter_readline(filterobject *self, PyObject *args)
     return _filter_read(self, args, 1);
 }
 
+/**
+ ** filter.buckets(filter self[, int bytes])
+ **
+ *     Returns the buckets from the previous filter as a list of
+ *     read-only views of their data, without copying it. FLUSH and
+ *     EOS buckets appear as the strings "FLUSH" and "EOS", other
+ *     metadata buckets are passed on as they are. The buckets are
+ *     kept until the filter returns, when the views are released
+ *     (see MpFilter_ReleaseSeen()).
+ */
+
+static PyObject *filter_buckets(filterobject *self, PyObject *args)
+{
+    PyObject *result, *item;
+    apr_bucket *b;
+    long len = -1;
+    long bytes_read = 0;
+    conn_rec *c = self->request_obj->request_rec->connection;
+
+    if (! PyArg_ParseTuple(args, "|l", &len))
+        return NULL;
+
+    if (self->closed) {
+        PyErr_SetString(PyExc_ValueError, "I/O operation on closed filter");
+        return NULL;
+    }
+
+    self->at_flush = 0;
+
+    if (self->is_input) {
+
+        if (!self->bb_in) {
+            self->bb_in = apr_brigade_create(self->f->r->pool,
+                                             c->bucket_alloc);
+        }
+
+        Py_BEGIN_ALLOW_THREADS;
+        self->rc = ap_get_brigade(self->f->next, self->bb_in, self->mode,
+                                  APR_BLOCK_READ, self->readbytes);
+        Py_END_ALLOW_THREADS;
+
+        if (!APR_STATUS_IS_EAGAIN(self->rc) && !(self->rc == APR_SUCCESS)) {
+            PyErr_SetString(PyExc_IOError, "Input filter read error");
+            return NULL;
+        }
+    }
+
+    if (!self->bb_seen)
+        self->bb_seen = apr_brigade_create(self->f->r->pool, c->bucket_alloc);
+
+    result = PyList_New(0);
+    if (!result)
+        return NULL;
+
+    while ((bytes_read < len || len == -1) &&
+           !APR_BRIGADE_EMPTY(self->bb_in)) {
+
+        const char *data;
+        apr_size_t size;
+
+        b = APR_BRIGADE_FIRST(self->bb_in);
+
+        if (APR_BUCKET_IS_METADATA(b)) {
+
+            APR_BUCKET_REMOVE(b);
+
+            if (APR_BUCKET_IS_EOS(b) || APR_BUCKET_IS_FLUSH(b)) {
+                APR_BRIGADE_INSERT_TAIL(self->bb_seen, b);
+                item = MpBytesOrUnicode_FromString(APR_BUCKET_IS_EOS(b) ?
+                                                   "EOS" : "FLUSH");
+                if (!item || PyList_Append(result, item) == -1) {
+                    Py_XDECREF(item);
+                    Py_DECREF(result);
+                    return NULL;
+                }
+                Py_DECREF(item);
+                if (APR_BUCKET_IS_EOS(b))
+                    break;
+                continue;
+            }
+
+            /* e.g. an error bucket, this filter has no use for it */
+            if (!self->bb_out)
+                self->bb_out = apr_brigade_create(self->f->r->pool,
+                                                  c->bucket_alloc);
+            APR_BRIGADE_INSERT_TAIL(self->bb_out, b);
+            continue;
+        }
+
+        /* reading a file bucket turns it into a heap bucket holding
+           the first part of the file followed by the rest */
+        if (apr_bucket_read(b, &data, &size, APR_BLOCK_READ) != APR_SUCCESS) {
+            Py_DECREF(result);
+            PyErr_SetString(PyExc_IOError, "Filter read error");
+            return NULL;
+        }
+
+        if (len != -1 && bytes_read + size > len) {
+            apr_bucket_split(b, len - bytes_read);
+            size = len - bytes_read;
+        }
+
+        APR_BUCKET_REMOVE(b);
+        APR_BRIGADE_INSERT_TAIL(self->bb_seen, b);
+
+        if (size == 0)
+            continue;
+
+#if PY_MAJOR_VERSION < 3
+        item = PyBuffer_FromMemory((void *)data, size);
+#else
+        item = PyMemoryView_FromMemory((char *)data, size, PyBUF_READ);
+        /* remembered, to be released along with the bucket */
+        if (item && !self->views && !(self->views = PyList_New(0))) {
+            Py_DECREF(item);
+            item = NULL;
+        }
+        if (item && PyList_Append(self->views, item) == -1) {
+            Py_DECREF(item);
+            item = NULL;
+        }
+#endif
+        if (!item || PyList_Append(result, item) == -1) {
+            Py_XDECREF(item);
+            Py_DECREF(result);
+            return NULL;
+        }
+        Py_DECREF(item);
+
+        bytes_read += size;
+    }
+
+    return result;
+}
+
+/**
+ ** seen_bucket
+ **
+ *     Returns the bucket returned by filter.buckets() that holds
+ *     the data at buf, and the offset of buf within it, or NULL.
+ */
+
+static apr_bucket *seen_bucket(filterobject *self, const char *buf,
+                               apr_size_t len, apr_size_t *offset)
+{
+    apr_bucket *b;
+    const char *data;
+    apr_size_t size;
+
+    if (!self->bb_seen)
+        return NULL;
+
+    for (b = APR_BRIGADE_FIRST(self->bb_seen);
+         b != APR_BRIGADE_SENTINEL(self->bb_seen);
+         b = APR_BUCKET_NEXT(b)) {
+
+        if (APR_BUCKET_IS_METADATA(b))
+            continue;
+
+        /* already read, this returns the same data again */
+        if (apr_bucket_read(b, &data, &size, APR_NONBLOCK_READ) != APR_SUCCESS)
+            continue;
+
+        if (buf >= data && buf + len <= data + size) {
+            *offset = buf - data;
+            return b;
+        }
+    }
+
+    return NULL;
+}
+
+/* buffers smaller than this are copied by filter.write() */
+#define FILTER_WRITE_COPY_MAX APR_BUCKET_BUFF_SIZE
+
+/**
+ ** release_held
+ **
+ *     Releases the buffers of transient buckets once their brigade
+ *     has been passed on (a filter that needs to keep the data
+ *     longer sets the buckets aside, which copies them).
+ */
+
+static void release_held(filterobject *self)
+{
+    int i;
+
+    if (self->held) {
+        for (i = 0; i < self->held->nelts; i++)
+            PyBuffer_Release(&APR_ARRAY_IDX(self->held, i, Py_buffer));
+        apr_array_clear(self->held);
+    }
+}
+
+/**
+ ** MpFilter_ReleaseHeld
+ **
+ *     Called with the interpreter held when the filter returns:
+ *     buffers still held belong to buckets that were never passed
+ *     (the filter raised an exception before flushing), which are
+ *     discarded along with them.
+ */
+
+void MpFilter_ReleaseHeld(filterobject *self)
+{
+    if (self->held && self->held->nelts) {
+        if (self->bb_out)
+            apr_brigade_cleanup(self->bb_out);
+        release_held(self);
+    }
+}
+
+/**
+ ** MpFilter_ReleaseSeen
+ **
+ *     Called with the interpreter held when the filter returns:
+ *     releases the views handed out by filter.buckets(), so that
+ *     one kept by the filter (in filter.ctx, say) raises ValueError
+ *     rather than refer to freed memory, then the buckets.
+ */
+
+void MpFilter_ReleaseSeen(filterobject *self)
+{
+#if PY_MAJOR_VERSION >= 3
+    Py_ssize_t i;
+
+    if (self->views) {
+        for (i = 0; i < PyList_GET_SIZE(self->views); i++) {
+            PyMemoryViewObject *view =
+                (PyMemoryViewObject *)PyList_GET_ITEM(self->views, i);
+            PyObject *rv;
+
+            /* a slice or cast of the view shares its memory but is
+               not released with it, nor is a buffer exported from it */
+            if (view->mbuf->exports > 1 || view->exports > 0)
+                ap_log_rerror(APLOG_MARK, APLOG_ERR, 0, self->f->r,
+                              "mod_python: a view from filter.buckets() "
+                              "is still in use after the filter returned, "
+                              "its data is no longer valid");
+
+            rv = PyObject_CallMethod((PyObject *)view, "release", NULL);
+            if (rv)
+                Py_DECREF(rv);
+            else
+                PyErr_Clear();
+        }
+        Py_CLEAR(self->views);
+    }
+#endif
+
+    if (self->bb_seen)
+        apr_brigade_cleanup(self->bb_seen);
+}
 
 /**
  ** filter.write(filter self)
@@ -314,33 +585,71 @@ static PyObject *filter_readline(filterobject *self, PyObject *args)
 static PyObject *filter_write(filterobject *self, PyObject *args)
 {
 
-    char *buff;
-    Py_ssize_t len;
+    Py_buffer view;
     apr_bucket *b;
-    PyObject *s;
     conn_rec *c = self->request_obj->request_rec->connection;
 
     if (self->closed) {
         PyErr_SetString(PyExc_ValueError, "I/O operation on closed filter");
         return NULL;
     }
-    if (! PyArg_ParseTuple(args, "s#", &buff, &len))
+    if (! PyArg_ParseTuple(args, "s*", &view))
         return NULL;  /* bad args */
 
-    if (len) {
+    if (view.len) {
+
+        apr_bucket *seen;
+        apr_size_t offset;
 
         /* does the output brigade exist? */
         if (!self->bb_out)
             self->bb_out = apr_brigade_create(self->f->r->pool,
                                               c->bucket_alloc);
 
-        /* it looks like there is no need to memcpy, an immortal
-           bucket is fine, since Python won't free that memory before
-           the write is over */
-        b = apr_bucket_immortal_create(buff, len, c->bucket_alloc);
+        if ((seen = seen_bucket(self, view.buf, view.len, &offset)) &&
+            !(self->is_input && APR_BUCKET_IS_TRANSIENT(seen)) &&
+            apr_bucket_copy(seen, &b) == APR_SUCCESS) {
+
+            /* a view from filter.buckets(): pass (the part of) the
+               bucket it refers to, the copy shares the data */
+            APR_BRIGADE_INSERT_TAIL(self->bb_out, b);
+            if (offset) {
+                apr_bucket_split(b, offset);
+                seen = b;
+                b = APR_BUCKET_NEXT(b);
+                apr_bucket_delete(seen);
+            }
+            if (b->length > view.len) {
+                apr_bucket_split(b, view.len);
+                apr_bucket_delete(APR_BUCKET_NEXT(b));
+            }
+            PyBuffer_Release(&view);
+        }
+        else if (self->is_input || !view.readonly ||
+            view.len < FILTER_WRITE_COPY_MAX) {
+
+            /* copy: the brigade of an input filter is read after the
+               filter returns, a mutable buffer could change before
+               the brigade is passed, and small writes are better
+               coalesced */
+            apr_brigade_write(self->bb_out, NULL, NULL, view.buf, view.len);
+            PyBuffer_Release(&view);
+        }
+        else {
+
+            /* the data stays valid until the buffer is released in
+               filter.flush() or filter.close() after passing the
+               brigade, which is what a transient bucket requires */
+            b = apr_bucket_transient_create(view.buf, view.len, c->bucket_alloc);
+            APR_BRIGADE_INSERT_TAIL(self->bb_out, b);
 
-        APR_BRIGADE_INSERT_TAIL(self->bb_out, b);
+            if (!self->held)
+                self->held = apr_array_make(self->f->r->pool, 4, sizeof(Py_buffer));
+            *(Py_buffer *)apr_array_push(self->held) = view;
+        }
     }
+    else
+        PyBuffer_Release(&view);
 
     Py_INCREF(Py_None);
     return Py_None;
@@ -372,6 +681,7 @@ static PyObject *filter_flush(filterobject *self, PyObject *args)
         self->rc = ap_pass_brigade(self->f->next, self->bb_out);
         apr_brigade_destroy(self->bb_out);
         Py_END_ALLOW_THREADS;
+        release_held(self);
 
         if(self->rc != APR_SUCCESS) {
             PyErr_SetString(PyExc_IOError, "Flush failed.");
@@ -411,6 +721,7 @@ static PyObject *filter_close(filterobject *self, PyObject *args)
             self->rc = ap_pass_brigade(self->f->next, self->bb_out);
             apr_brigade_destroy(self->bb_out);
             Py_END_ALLOW_THREADS;
+            release_held(self);
             self->bb_out = NULL;
         }
 
@@ -447,6 +758,7 @@ static PyMethodDef filterobjectmethods[] = {
     {"pass_on",   (PyCFunction) filter_pass_on,   METH_NOARGS},
     {"read",      (PyCFunction) filter_read,      METH_VARARGS},
     {"readline",  (PyCFunction) filter_readline,  METH_VARARGS},
+    {"buckets",   (PyCFunction) filter_buckets,   METH_VARARGS},
     {"write",     (PyCFunction) filter_write,     METH_VARARGS},
     {"flush",     (PyCFunction) filter_flush,     METH_VARARGS},
     {"close",     (PyCFunction) filter_close,     METH_VARARGS},
@@ -459,11 +771,14 @@ static PyMethodDef filterobjectmethods[] = {
 static PyMemberDef filter_memberlist[] = {
     {"softspace",          T_INT,       OFF(softspace),                  },
     {"closed",             T_INT,       OFF(closed),             READONLY},
+    {"at_flush",           T_INT,       OFF(at_flush),           READONLY},
     {"name",               T_OBJECT,    0,                       READONLY},
     {"req",                T_OBJECT,    OFF(request_obj),                },
     {"is_input",           T_INT,       OFF(is_input),           READONLY},
+    {"readbytes",          T_PYSSIZET,  OFF(readbytes),          READONLY},
     {"handler",            T_STRING,    OFF(handler),            READONLY},
     {"dir",                T_STRING,    OFF(dir),                READONLY},
+    {"interpreter_wait",   T_DOUBLE,    OFF(interpreter_wait),   READONLY},
     {NULL}  /* Sentinel */
 };
 
@@ -475,6 +790,11 @@ static PyMemberDef filter_memberlist[] = {
 
 static void filter_dealloc(filterobject *self)
 {
+    if (self->bb_seen)
+        apr_brigade_cleanup(self->bb_seen);
+    /* the held buffers were released by MpFilter_ReleaseHeld() and
+       the views by MpFilter_ReleaseSeen(), this may run from a pool
+       cleanup, without the interpreter */
     Py_XDECREF(self->request_obj);
     PyObject_Del(self);
 }
@@ -521,6 +841,16 @@ static PyObject * filter_getattr(filterobject *self, char *name)
             return (PyObject *)self->request_obj;
         }
     }
+    else if (self->ctx && strcmp(name, "ctx") == 0) {
+        res = self->ctx->data ? self->ctx->data : Py_None;
+        Py_INCREF(res);
+        return res;
+    }
+    else if (self->ctx && strcmp(name, "_dispatch") == 0) {
+        res = self->ctx->dispatch ? self->ctx->dispatch : Py_None;
+        Py_INCREF(res);
+        return res;
+    }
     else {
         PyMemberDef *md = find_memberdef(filter_memberlist, name);
         if (!md) {
@@ -545,6 +875,19 @@ static int filter_setattr(filterobject *self, char *name, PyObject *v)
                         "can't delete filter attributes");
         return -1;
     }
+    if (self->ctx && strcmp(name, "ctx") == 0) {
+        /* kept for the life of the filter, not just this call */
+        Py_INCREF(v);
+        Py_XDECREF(self->ctx->data);
+        self->ctx->data = v;
+        return 0;
+    }
+    if (self->ctx && strcmp(name, "_dispatch") == 0) {
+        Py_INCREF(v);
+        Py_XDECREF(self->ctx->dispatch);
+        self->ctx->dispatch = v;
+        return 0;
+    }
     PyMemberDef *md = find_memberdef(filter_memberlist, name);
     if (!md) {
         PyErr_SetString(PyExc_AttributeError, name);
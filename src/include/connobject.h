@@ -44,6 +44,7 @@ extern "C" {
         PyObject     *base_server;
         PyObject     *notes;
         hlistobject  *hlo;
+        double        interpreter_wait;
     } connobject;
 
     PyAPI_DATA(PyTypeObject) MpConn_Type;
@@ -44,6 +44,7 @@ extern "C" {
         apr_size_t readbytes;
 
         int closed;
+        int at_flush;
         int softspace;
         int bytes_written;
 
@@ -52,6 +53,24 @@ extern "C" {
 
         requestobject *request_obj;
 
+        double interpreter_wait;
+
+        /* Py_buffers of the transient buckets in bb_out, held until
+           the brigade is passed */
+        apr_array_header_t *held;
+
+        /* buckets returned by filter.buckets(), kept until the
+           filter returns */
+        apr_bucket_brigade *bb_seen;
+
+        /* the views of their data handed out, released when the
+           filter returns */
+        PyObject *views;
+
+        /* the context of a Python filter, kept for the life of the
+           filter, NULL for the filter of an SSI tag */
+        struct python_filter_ctx *ctx;
+
     } filterobject;
 
     PyAPI_DATA(PyTypeObject) MpFilter_Type;
@@ -63,6 +82,9 @@ extern "C" {
                              int is_input, ap_input_mode_t mode,
                              apr_size_t readbytes, char *hadler, char *dir);
 
+    PyAPI_FUNC(void) MpFilter_ReleaseHeld (filterobject *self);
+    PyAPI_FUNC(void) MpFilter_ReleaseSeen (filterobject *self);
+
 #ifdef __cplusplus
 }
 #endif
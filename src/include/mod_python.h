@@ -213,10 +213,13 @@ typedef struct
 } py_req_config;
 
 /* filter context */
-typedef struct
+typedef struct python_filter_ctx
 {
     char *name;
     int transparent;
+    const char *interpreter;
+    PyObject *data;            /* filter.ctx */
+    PyObject *dispatch;        /* kept by FilterDispatch */
 } python_filter_ctx;
 
 /* a structure to hold a handler,
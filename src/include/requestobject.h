@@ -50,6 +50,15 @@ extern "C" {
         int              rbuff_len;   /* read buffer size */
         int              rbuff_pos;   /* position into the buffer */
         PyObject       * session;
+        double           interpreter_wait; /* seconds */
+        apr_bucket_brigade * obuf;    /* output buffer, see set_buffering() */
+        int              obuf_etag;   /* compute an ETag from the buffer */
+        int              flush_policy; /* of req.write(), -1 until known */
+        apr_off_t        flush_bytes;
+        apr_interval_time_t flush_interval;
+        apr_off_t        unflushed;   /* bytes written since last flush */
+        apr_time_t       last_flush;
+        long             flushes;     /* number of flushes */
 
     } requestobject;
 
@@ -58,6 +67,7 @@ extern "C" {
 #define MpRequest_Check(op) (Py_TYPE(op) == &MpRequest_Type)
 
     PyAPI_FUNC(PyObject *) MpRequest_FromRequest (request_rec *r);
+    PyAPI_FUNC(int) MpRequest_FinishBuffering (requestobject *self, int result);
 
 #ifndef ap_is_HTTP_VALID_RESPONSE
 #define ap_is_HTTP_VALID_RESPONSE(x) (((x) >= 100)&&((x) < 600))
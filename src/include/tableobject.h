@@ -37,6 +37,18 @@ extern "C" {
         PyObject_VAR_HEAD
         apr_table_t     *table;
         apr_pool_t      *pool;
+        /* lookup index, see table_index_build() */
+        int             *index_slots;
+        int             *index_next;
+        unsigned int     index_mask;
+        unsigned int    *index_hashes;
+        const void      *index_elts;
+        int              index_nelts;
+        const char      *index_lastkey;
+        /* interned key strings by position */
+        PyObject       **index_keys;
+        const char     **index_keyptrs;
+        int              index_nkeys;
     } tableobject;
 
     PyAPI_DATA(PyTypeObject) MpTable_Type;
@@ -47,6 +59,14 @@ extern "C" {
     PyAPI_FUNC(PyObject *) MpTable_FromTable (apr_table_t *t);
     PyAPI_FUNC(PyObject *) MpTable_New (void);
 
+/* tables with fewer entries than this are scanned, larger ones get
+   a lookup index when first looked up in; 0 disables the index */
+#ifndef MP_TABLE_INDEX_MIN
+#define MP_TABLE_INDEX_MIN 16
+#endif
+
+    extern int mp_table_index_min;
+
 /* #define DEBUG_TABLES 1 */
 #ifdef DEBUG_TABLES
 #define TABLE_DEBUG(str) printf("mp_table: %s\n", str)
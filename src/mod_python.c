@@ -1451,6 +1451,7 @@ static int python_handler(request_rec *req, char *phase)
     hl_entry *hlohle = NULL;
 
     py_req_config *req_conf;
+    apr_interval_time_t t_acquire;
 
 
 
@@ -1529,7 +1530,9 @@ static int python_handler(request_rec *req, char *phase)
     interp_name = select_interp_name(req, NULL, conf, hlohle, NULL);
 
     /* get/create interpreter */
+    t_acquire = apr_time_now();
     idata = get_interpreter(interp_name);
+    t_acquire = apr_time_now() - t_acquire;
 
     if (!idata) {
         ap_log_rerror(APLOG_MARK, APLOG_ERR, 0, req,
@@ -1544,10 +1547,24 @@ static int python_handler(request_rec *req, char *phase)
     if (ext)
         request_obj->extension = apr_pstrdup(req->pool, ext);
 
+    /* for apache.stats() */
+    request_obj->interpreter_wait = (double)t_acquire / APR_USEC_PER_SEC;
+
     /* construct a new handler list object */
     Py_XDECREF(request_obj->hlo);
     request_obj->hlo = (hlistobject *)MpHList_FromHLEntry(hlohle);
 
+    /* PythonOption mod_python.buffering On|ETag, see req.set_buffering() */
+    if (!request_obj->obuf && strcmp(phase, "PythonHandler") == 0) {
+        const char *buffering = apr_table_get(conf->options, "mod_python.buffering");
+        if (buffering && (strcasecmp(buffering, "on") == 0 ||
+                          strcasecmp(buffering, "etag") == 0)) {
+            request_obj->obuf = apr_brigade_create(req->pool,
+                                                   req->connection->bucket_alloc);
+            request_obj->obuf_etag = strcasecmp(buffering, "etag") == 0;
+        }
+    }
+
     /*
      * Here is where we call into Python!
      * This is the C equivalent of
@@ -1567,7 +1584,7 @@ static int python_handler(request_rec *req, char *phase)
     if (! resultobject) {
         ap_log_rerror(APLOG_MARK, APLOG_ERR, 0, req,
                       "python_handler: (%s) HandlerDispatch() returned nothing.", phase);
-        return HTTP_INTERNAL_SERVER_ERROR;
+        return MpRequest_FinishBuffering(request_obj, HTTP_INTERNAL_SERVER_ERROR);
     }
     else {
         /* Attempt to analyze the result as a string indicating which
@@ -1579,7 +1596,7 @@ static int python_handler(request_rec *req, char *phase)
 #endif
             ap_log_rerror(APLOG_MARK, APLOG_ERR, 0, req,
                           "python_handler: (%s) HandlerDispatch() returned non-integer.", phase);
-            return HTTP_INTERNAL_SERVER_ERROR;
+            return MpRequest_FinishBuffering(request_obj, HTTP_INTERNAL_SERVER_ERROR);
         }
         else {
 #if PY_MAJOR_VERSION < 3
@@ -1646,6 +1663,10 @@ static int python_handler(request_rec *req, char *phase)
     /* clean up */
     Py_XDECREF(resultobject);
 
+    /* send the output buffered by req.set_buffering(), this may
+       turn the result into HTTP_NOT_MODIFIED */
+    result = MpRequest_FinishBuffering(request_obj, result);
+
     /* return the translated result (or default result) to the Server. */
     return result;
 
@@ -1706,6 +1727,7 @@ static apr_status_t python_connection(conn_rec *con)
     int result;
     const char *interp_name = NULL;
     hl_entry *hle = NULL;
+    apr_interval_time_t t_acquire;
 
     /* get configuration */
     conf = (py_config *) ap_get_module_config(con->base_server->module_config,
@@ -1724,7 +1746,9 @@ static apr_status_t python_connection(conn_rec *con)
     interp_name = select_interp_name(NULL, con, conf, hle, NULL);
 
     /* get/create interpreter */
+    t_acquire = apr_time_now();
     idata = get_interpreter(interp_name);
+    t_acquire = apr_time_now() - t_acquire;
 
     if (!idata) {
         ap_log_error(APLOG_MARK, APLOG_ERR, 0, con->base_server,
@@ -1738,6 +1762,9 @@ static apr_status_t python_connection(conn_rec *con)
     /* create a handler list object */
     conn_obj->hlo = (hlistobject *)MpHList_FromHLEntry(hle);
 
+    /* for apache.stats() */
+    conn_obj->interpreter_wait = (double)t_acquire / APR_USEC_PER_SEC;
+
     /*
      * Here is where we call into Python!
      * This is the C equivalent of
@@ -1781,6 +1808,33 @@ static apr_status_t python_connection(conn_rec *con)
     return result;
 }
 
+/**
+ ** python_filter_ctx_cleanup
+ **
+ *    Releases filter.ctx and the handler kept by FilterDispatch
+ *    at the end of the request.
+ */
+
+static apr_status_t python_filter_ctx_cleanup(void *data)
+{
+    python_filter_ctx *ctx = (python_filter_ctx *)data;
+    interpreterdata *idata;
+
+    if (!ctx->data && !ctx->dispatch)
+        return APR_SUCCESS;
+
+    idata = get_interpreter(ctx->interpreter);
+    if (!idata)
+        return APR_SUCCESS; /* this return code is ignored by httpd anyway */
+
+    Py_CLEAR(ctx->data);
+    Py_CLEAR(ctx->dispatch);
+
+    release_interpreter(idata);
+
+    return APR_SUCCESS;
+}
+
 /**
  ** python_filter
  **
@@ -1803,6 +1857,7 @@ static apr_status_t python_filter(int is_input, ap_filter_t *f,
     filterobject *filter;
     python_filter_ctx *ctx;
     py_handler *fh;
+    apr_interval_time_t t_acquire;
 
     /* we only allow request level filters so far */
     req = f->r;
@@ -1811,6 +1866,9 @@ static apr_status_t python_filter(int is_input, ap_filter_t *f,
     if (!f->ctx) {
         ctx = (python_filter_ctx *) apr_pcalloc(req->pool, sizeof(python_filter_ctx));
         f->ctx = (void *)ctx;
+        apr_pool_cleanup_register(req->pool, (void *)ctx,
+                                  python_filter_ctx_cleanup,
+                                  apr_pool_cleanup_null);
     }
     else {
         ctx = (python_filter_ctx *) f->ctx;
@@ -1852,9 +1910,12 @@ static apr_status_t python_filter(int is_input, ap_filter_t *f,
 
     /* determine interpreter to use */
     interp_name = select_interp_name(req, NULL, conf, NULL, fh);
+    ctx->interpreter = interp_name;
 
     /* get/create interpreter */
+    t_acquire = apr_time_now();
     idata = get_interpreter(interp_name);
+    t_acquire = apr_time_now() - t_acquire;
 
     if (!idata) {
         ap_log_rerror(APLOG_MARK, APLOG_ERR, 0, req,
@@ -1871,6 +1932,10 @@ static apr_status_t python_filter(int is_input, ap_filter_t *f,
 
     Py_INCREF(request_obj);
     filter->request_obj = request_obj;
+    filter->ctx = ctx;
+
+    /* for apache.stats() */
+    filter->interpreter_wait = (double)t_acquire / APR_USEC_PER_SEC;
 
     /*
      * Here is where we call into Python!
@@ -1880,9 +1945,25 @@ static apr_status_t python_filter(int is_input, ap_filter_t *f,
     resultobject = PyObject_CallMethod(idata->obcallback, "FilterDispatch", "O",
                                        filter);
 
+    /* an input filter that failed fails the read, the data it was
+       to deliver is missing */
+    if (is_input && filter->rc == APR_SUCCESS && resultobject &&
+#if PY_MAJOR_VERSION < 3
+        PyInt_Check(resultobject) && PyInt_AsLong(resultobject) != OK)
+#else
+        PyLong_Check(resultobject) && PyLong_AsLong(resultobject) != OK)
+#endif
+        filter->rc = APR_EGENERAL;
+
     /* clean up */
     Py_XDECREF(resultobject);
 
+    /* the buffers written with filter.write() and the buckets
+       returned by filter.buckets() are done with, release them
+       while the interpreter is still held */
+    MpFilter_ReleaseHeld(filter);
+    MpFilter_ReleaseSeen(filter);
+
     /* release interpreter */
     release_interpreter(idata);
 
@@ -2057,12 +2138,16 @@ static apr_status_t handle_python(include_ctx_t *ctx,
     if (!resultobject)
     {
         SSI_CREATE_ERROR_BUCKET(ctx, f, bb);
+        MpFilter_ReleaseHeld(filter);
+        MpFilter_ReleaseSeen(filter);
         release_interpreter(idata);
         return APR_SUCCESS;
     }
 
     /* clean up */
     Py_XDECREF(resultobject);
+    MpFilter_ReleaseHeld(filter);
+    MpFilter_ReleaseSeen(filter);
 
     /* release interpreter */
     release_interpreter(idata);
@@ -2198,12 +2283,16 @@ static apr_status_t handle_python(include_ctx_t *ctx,
     if (!resultobject)
     {
         CREATE_ERROR_BUCKET(ctx, tmp_buck, head_ptr, *inserted_head);
+        MpFilter_ReleaseHeld(filter);
+        MpFilter_ReleaseSeen(filter);
         release_interpreter(idata);
         return APR_SUCCESS;
     }
 
     /* clean up */
     Py_XDECREF(resultobject);
+    MpFilter_ReleaseHeld(filter);
+    MpFilter_ReleaseSeen(filter);
 
     /* release interpreter */
     release_interpreter(idata);
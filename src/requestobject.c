@@ -23,6 +23,7 @@
  */
 
 #include "mod_python.h"
+#include "apr_md5.h"
 
 /* mod_ssl.h is not safe for inclusion in 2.0, so duplicate the
  * optional function declarations. */
@@ -73,6 +74,15 @@ PyObject * MpRequest_FromRequest(request_rec *req)
     result->rbuff = NULL;
     result->rbuff_pos = 0;
     result->rbuff_len = 0;
+    result->interpreter_wait = 0;
+    result->obuf = NULL;
+    result->obuf_etag = 0;
+    result->flush_policy = -1;
+    result->flush_bytes = 0;
+    result->flush_interval = 0;
+    result->unflushed = 0;
+    result->last_flush = req->request_time;
+    result->flushes = 0;
 
     /* we make sure that the object dictionary is there
      * before registering the object with the GC
@@ -214,14 +224,43 @@ static PyObject *wsgi_version = NULL;
 static PyObject *wsgi_multithread = NULL;
 static PyObject *wsgi_multiprocess = NULL;
 
+/* key k (made from the string key) as compared by apr tables,
+ * i.e. in upper case, which is how CGI variables are spelt */
+static PyObject *wsgi_env_fold(const char *key, PyObject *k)
+{
+    PyObject *fk;
+    char *upper;
+    size_t i, len;
+
+    for (i = 0; key[i]; i++)
+        if (apr_islower(key[i]))
+            break;
+    if (!key[i]) {
+        Py_INCREF(k);
+        return k;
+    }
+
+    len = strlen(key);
+    upper = PyMem_Malloc(len + 1);
+    if (!upper)
+        return PyErr_NoMemory();
+    for (i = 0; i <= len; i++)
+        upper[i] = apr_toupper(key[i]);
+    fk = MpBytesOrUnicode_FromString(upper);
+    PyMem_Free(upper);
+    return fk;
+}
+
 static PyObject *req_build_wsgi_env(requestobject *self)
 {
 
     request_rec *r = self->request_rec;
-    apr_table_t *e = r->subprocess_env;
-    PyObject *env, *v;
+    apr_table_t *e;
+    const apr_array_header_t *ah;
+    apr_table_entry_t *elts;
+    PyObject *env, *seen, *v;
     const char *val;
-    int i, j;
+    int i;
 
     env = PyDict_New();
     if (!env)
@@ -241,13 +280,84 @@ static PyObject *req_build_wsgi_env(requestobject *self)
 
     /* this will create the correct SCRIPT_NAME based on our path_info now */
     req_add_cgi_vars(self);
+    e = r->subprocess_env;
 
-    /* copy r->subprocess_env */
-    if (!self->subprocess_env)
-        self->subprocess_env = MpTable_FromTable(self->request_rec->subprocess_env);
-    else
+    if (self->subprocess_env)
         ((tableobject*)self->subprocess_env)->table = r->subprocess_env;
-    PyDict_Merge(env, (PyObject*)self->subprocess_env, 0);
+
+    /* copy r->subprocess_env, straight from the apr table rather
+     * than through an mp_table, which would look up every key. As
+     * with req.subprocess_env[key], keys that appear more than once,
+     * compared without regard to case, give a list of all their
+     * values, under each spelling of the key. */
+    seen = PyDict_New();
+    if (!seen) {
+        Py_DECREF(env);
+        return NULL;
+    }
+    ah = apr_table_elts(e);
+    elts = (apr_table_entry_t *) ah->elts;
+    for (i = 0; i < ah->nelts; i++) {
+        PyObject *k, *fk, *first, *prev;
+        if (!elts[i].key)
+            continue;
+        k = MpBytesOrUnicode_FromString(elts[i].key);
+        fk = k ? wsgi_env_fold(elts[i].key, k) : NULL;
+        if (elts[i].val)
+            v = MpBytesOrUnicode_FromString(elts[i].val);
+        else {
+            v = Py_None;
+            Py_INCREF(v);
+        }
+        if (!fk || !v)
+            goto env_error;
+        first = PyDict_GetItem(seen, fk);
+        if (!first) {
+            /* the common case */
+            if (PyDict_SetItem(seen, fk, k) < 0 ||
+                PyDict_SetItem(env, k, v) < 0)
+                goto env_error;
+        }
+        else {
+            prev = PyDict_GetItem(env, first);
+            if (PyList_Check(prev)) {
+                if (PyList_Append(prev, v) < 0)
+                    goto env_error;
+                Py_INCREF(prev);
+            }
+            else {
+                prev = PyList_New(2);
+                if (!prev)
+                    goto env_error;
+                Py_INCREF(PyDict_GetItem(env, first));
+                PyList_SET_ITEM(prev, 0, PyDict_GetItem(env, first));
+                Py_INCREF(v);
+                PyList_SET_ITEM(prev, 1, v);
+                if (PyDict_SetItem(env, first, prev) < 0) {
+                    Py_DECREF(prev);
+                    goto env_error;
+                }
+            }
+            if (PyDict_SetItem(env, k, prev) < 0) {
+                Py_DECREF(prev);
+                goto env_error;
+            }
+            Py_DECREF(prev);
+        }
+        Py_DECREF(v);
+        Py_DECREF(fk);
+        Py_DECREF(k);
+        continue;
+
+    env_error:
+        Py_XDECREF(v);
+        Py_XDECREF(fk);
+        Py_XDECREF(k);
+        Py_DECREF(seen);
+        Py_DECREF(env);
+        return NULL;
+    }
+    Py_DECREF(seen);
 
     /* authorization */
     if ((val = apr_table_get(r->headers_in, "authorization"))) {
@@ -1070,26 +1180,16 @@ static PyObject * req_meets_conditions(requestobject *self) {
 
 
 /**
- ** request.read(request self, int bytes)
+ ** start_client_block
  **
- *     Reads stuff like POST requests from the client
- *     (based on the old net_read)
+ *     Sets up reading the request body on the first read. Returns 1
+ *     if there is a body to read, 0 if the client has nothing to
+ *     send, or -1 with an exception set.
  */
 
-static PyObject * req_read(requestobject *self, PyObject *args)
+static int start_client_block(requestobject *self)
 {
-    int rc, bytes_read, chunk_len;
-    char *buffer;
-    PyObject *result;
-    int copied = 0;
-    long len = -1;
-
-    if (! PyArg_ParseTuple(args, "|l", &len))
-        return NULL;
-
-    if (len == 0) {
-        return PyBytes_FromString("");
-    }
+    int rc;
 
     /* is this the first read? */
     if (! self->request_rec->read_length) {
@@ -1099,30 +1199,33 @@ static PyObject * req_read(requestobject *self, PyObject *args)
         if(rc != OK) {
             PyObject *val = PyLong_FromLong(rc);
             if (val == NULL)
-                return NULL;
+                return -1;
             PyErr_SetObject(get_ServerReturn(), val);
             Py_DECREF(val);
-            return NULL;
+            return -1;
         }
 
         if (! ap_should_client_block(self->request_rec)) {
             /* client has nothing to send */
-            return PyBytes_FromString("");
+            return 0;
         }
     }
 
-    if (len < 0)
-        /* XXX ok to use request_rec->remaining? */
-        len = self->request_rec->remaining +
-            (self->rbuff_len - self->rbuff_pos);
-
-    result = PyBytes_FromStringAndSize(NULL, len);
+    return 1;
+}
 
-    /* possibly no more memory */
-    if (result == NULL)
-        return NULL;
+/**
+ ** read_client_block
+ **
+ *     Reads up to len bytes of the request body into buffer, starting
+ *     with what readline() may have buffered, and retrying short
+ *     reads. Returns the number of bytes read, which is less than len
+ *     only at the end of the body, or -1 with an exception set.
+ */
 
-    buffer = PyBytes_AS_STRING((PyBytesObject *) result);
+static long read_client_block(requestobject *self, char *buffer, long len)
+{
+    long copied = 0, chunk_len;
 
     /* if anything left in the readline buffer */
     while ((self->rbuff_pos < self->rbuff_len) && (copied < len))
@@ -1134,27 +1237,85 @@ static PyObject * req_read(requestobject *self, PyObject *args)
         self->rbuff = NULL;
     }
 
-    if (copied == len)
-        return result;  /* we're done! */
-
     /* read it in */
-    Py_BEGIN_ALLOW_THREADS
-    chunk_len = ap_get_client_block(self->request_rec, buffer, len);
-    Py_END_ALLOW_THREADS
-    bytes_read = chunk_len;
-
-    /* if this is a "short read", try reading more */
-    while ((bytes_read < len) && (chunk_len != 0)) {
+    while (copied < len) {
         Py_BEGIN_ALLOW_THREADS
         chunk_len = ap_get_client_block(self->request_rec,
-                                        buffer+bytes_read, len-bytes_read);
+                                        buffer+copied, len-copied);
         Py_END_ALLOW_THREADS
         if (chunk_len == -1) {
             PyErr_SetString(PyExc_IOError, "Client read error (Timeout?)");
+            return -1;
+        }
+        if (chunk_len == 0)
+            break;
+        copied += chunk_len;
+    }
+
+    return copied;
+}
+
+/**
+ ** request.read(request self, int bytes)
+ **
+ *     Reads stuff like POST requests from the client
+ *     (based on the old net_read)
+ */
+
+static PyObject * req_read(requestobject *self, PyObject *args)
+{
+    int rc;
+    long bytes_read, more;
+    PyObject *result;
+    long len = -1;
+    int all = 0;
+
+    if (! PyArg_ParseTuple(args, "|l", &len))
+        return NULL;
+
+    if (len == 0) {
+        return PyBytes_FromString("");
+    }
+
+    rc = start_client_block(self);
+    if (rc == -1)
+        return NULL;
+    if (rc == 0)
+        return PyBytes_FromString("");
+
+    if (len < 0) {
+        /* XXX ok to use request_rec->remaining? */
+        len = self->request_rec->remaining +
+            (self->rbuff_len - self->rbuff_pos);
+        all = 1;
+    }
+
+    result = PyBytes_FromStringAndSize(NULL, len);
+
+    /* possibly no more memory */
+    if (result == NULL)
+        return NULL;
+
+    bytes_read = read_client_block(self, PyBytes_AS_STRING(result), len);
+    if (bytes_read == -1) {
+        Py_DECREF(result);
+        return NULL;
+    }
+
+    /* an input filter (e.g. one that decompresses the body) can make
+       the body longer than its Content-Length, r->remaining is only
+       set to 0 once the end of the body has been seen */
+    while (all && bytes_read == len && self->request_rec->remaining) {
+        more = len < HUGE_STRING_LEN ? HUGE_STRING_LEN : len;
+        if (_PyBytes_Resize(&result, len + more))
+            return NULL;
+        more = read_client_block(self, PyBytes_AS_STRING(result) + len, more);
+        if (more == -1) {
+            Py_DECREF(result);
             return NULL;
         }
-        else
-            bytes_read += chunk_len;
+        bytes_read += more;
+        len = PyBytes_GET_SIZE(result);
     }
 
     /* resize if necessary */
@@ -1165,6 +1326,84 @@ static PyObject * req_read(requestobject *self, PyObject *args)
     return result;
 }
 
+/**
+ ** request.readinto(request self, buffer)
+ **
+ *     Reads the request body into a writable buffer supplied by the
+ *     caller, such as a bytearray, and returns the number of bytes
+ *     read, which is less than the size of the buffer only at the
+ *     end of the body.
+ */
+
+static PyObject * req_readinto(requestobject *self, PyObject *args)
+{
+    int rc;
+    long bytes_read = 0;
+    Py_buffer view;
+
+    if (! PyArg_ParseTuple(args, "w*", &view))
+        return NULL;
+
+    if (view.len > 0) {
+        rc = start_client_block(self);
+        if (rc == 1)
+            bytes_read = read_client_block(self, view.buf, (long)view.len);
+        if (rc == -1 || bytes_read == -1) {
+            PyBuffer_Release(&view);
+            return NULL;
+        }
+    }
+
+    PyBuffer_Release(&view);
+    return PyLong_FromLong(bytes_read);
+}
+
+/**
+ ** request.iter_body(request self, int chunk_size)
+ **
+ *     Returns an iterator over the request body in chunks of
+ *     chunk_size bytes (the last one may be shorter), i.e.
+ *     iter(functools.partial(req.read, chunk_size), b'')
+ */
+
+static PyObject * req_iter_body(requestobject *self, PyObject *args)
+{
+    long chunk_size = 65536;
+    PyObject *functools, *read, *partial, *sentinel, *result;
+
+    if (! PyArg_ParseTuple(args, "|l", &chunk_size))
+        return NULL;
+
+    if (chunk_size <= 0) {
+        PyErr_SetString(PyExc_ValueError, "chunk_size must be positive");
+        return NULL;
+    }
+
+    functools = PyImport_ImportModule("functools");
+    if (!functools)
+        return NULL;
+    read = PyObject_GetAttrString((PyObject *)self, "read");
+    if (!read) {
+        Py_DECREF(functools);
+        return NULL;
+    }
+    partial = PyObject_CallMethod(functools, "partial", "Ol", read, chunk_size);
+    Py_DECREF(read);
+    Py_DECREF(functools);
+    if (!partial)
+        return NULL;
+
+    sentinel = PyBytes_FromString("");
+    if (!sentinel) {
+        Py_DECREF(partial);
+        return NULL;
+    }
+    result = PyCallIter_New(partial, sentinel);
+    Py_DECREF(partial);
+    Py_DECREF(sentinel);
+    return result;
+}
+
 /**
  ** request.readline(request self, int maxbytes)
  **
@@ -1574,29 +1813,134 @@ static PyObject * req_update_mtime(requestobject *self, PyObject *args)
  *      write output to the client
  */
 
+/* the flush policy of req.write(), set by mod_python.write.flush */
+#define FLUSH_ALWAYS   0
+#define FLUSH_NEVER    1
+#define FLUSH_BYTES    2
+#define FLUSH_INTERVAL 3
+
+/**
+ ** get_flush_policy
+ **
+ *     Reads the mod_python.write.flush option, which is one of
+ *     "always" (the default), "never", a number of bytes (with an
+ *     optional "k" suffix) written between flushes, or a minimum time
+ *     between flushes in seconds or milliseconds ("s" or "ms" suffix).
+ */
+
+static void get_flush_policy(requestobject *self)
+{
+    request_rec *r = self->request_rec;
+    py_config *conf =
+        (py_config *) ap_get_module_config(r->per_dir_config, &python_module);
+    const char *val = apr_table_get(conf->options, "mod_python.write.flush");
+    char *end;
+    double d;
+
+    self->flush_policy = FLUSH_ALWAYS;
+
+    if (!val || strcasecmp(val, "always") == 0)
+        return;
+
+    if (strcasecmp(val, "never") == 0) {
+        self->flush_policy = FLUSH_NEVER;
+        return;
+    }
+
+    d = strtod(val, &end);
+    if (end != val && d > 0) {
+        if (!*end) {
+            self->flush_policy = FLUSH_BYTES;
+            self->flush_bytes = (apr_off_t)d;
+            return;
+        }
+        if (strcasecmp(end, "k") == 0) {
+            self->flush_policy = FLUSH_BYTES;
+            self->flush_bytes = (apr_off_t)(d * 1024);
+            return;
+        }
+        if (strcasecmp(end, "s") == 0) {
+            self->flush_policy = FLUSH_INTERVAL;
+            self->flush_interval = (apr_interval_time_t)(d * APR_USEC_PER_SEC);
+            return;
+        }
+        if (strcasecmp(end, "ms") == 0) {
+            self->flush_policy = FLUSH_INTERVAL;
+            self->flush_interval = (apr_interval_time_t)(d * 1000);
+            return;
+        }
+    }
+
+    ap_log_rerror(APLOG_MARK, APLOG_WARNING, 0, r,
+                  "mod_python: invalid mod_python.write.flush value '%s', "
+                  "flushing always.", val);
+}
+
 static PyObject * req_write(requestobject *self, PyObject *args)
 {
     Py_ssize_t len;
     int rc;
-    char *buff;
-    int flush=1;
-
-    if (! PyArg_ParseTuple(args, "s#|i", &buff, &len, &flush))
+    Py_buffer view;
+    int flush=-1;
+
+    /* any object supporting the buffer protocol is accepted, and
+     * not copied here. ap_rwrite() passes data larger than its
+     * buffer down the filter chain as a transient bucket, which is
+     * only copied if a filter needs to set it aside, so the buffer
+     * is held until it returns. */
+    if (! PyArg_ParseTuple(args, "s*|i", &view, &flush))
         return NULL;  /* bad args */
 
-    if (len > 0 ) {
+    len = view.len;
+
+    /* unless told otherwise, flush as configured */
+    if (flush == -1) {
+        if (self->flush_policy == -1)
+            get_flush_policy(self);
+        switch (self->flush_policy) {
+        case FLUSH_NEVER:
+            flush = 0;
+            break;
+        case FLUSH_BYTES:
+            flush = self->unflushed + len >= self->flush_bytes;
+            break;
+        case FLUSH_INTERVAL:
+            flush = apr_time_now() - self->last_flush >= self->flush_interval;
+            break;
+        default:
+            flush = 1;
+        }
+    }
+
+    if (self->obuf) {
+        /* buffering, see request.set_buffering() */
+        if (len > 0)
+            apr_brigade_write(self->obuf, NULL, NULL, view.buf, len);
+    }
+    else if (len > 0 ) {
 
         Py_BEGIN_ALLOW_THREADS
-        rc = ap_rwrite(buff, len, self->request_rec);
+        rc = ap_rwrite(view.buf, len, self->request_rec);
         if (flush && (rc != -1))
             rc = ap_rflush(self->request_rec);
         Py_END_ALLOW_THREADS
             if (rc == -1) {
+                PyBuffer_Release(&view);
                 PyErr_SetString(PyExc_IOError, "Write failed, client closed connection.");
                 return NULL;
             }
+
+        if (flush) {
+            self->unflushed = 0;
+            self->last_flush = apr_time_now();
+            self->flushes++;
+        }
+        else
+            self->unflushed += len;
     }
 
+    PyBuffer_Release(&view);
+
     self->bytes_queued += len;
 
     Py_INCREF(Py_None);
@@ -1604,6 +1948,172 @@ static PyObject * req_write(requestobject *self, PyObject *args)
 
 }
 
+/**
+ ** pass_buffer
+ **
+ *      Sends the output collected while buffering and stops
+ *      buffering.
+ */
+
+static apr_status_t pass_buffer(requestobject *self)
+{
+    apr_status_t rc;
+    apr_bucket_brigade *bb = self->obuf;
+
+    self->obuf = NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    rc = ap_pass_brigade(self->request_rec->output_filters, bb);
+    apr_brigade_destroy(bb);
+    Py_END_ALLOW_THREADS
+
+    return rc;
+}
+
+/**
+ ** request.set_buffering(request self, int on[, int etag])
+ **
+ *      Start or stop collecting the output of req.write() in a
+ *      buffer, which is sent at the end of the handler with a
+ *      Content-Length (see MpRequest_FinishBuffering()). Stopping
+ *      sends what has been buffered so far. Buffering can only be
+ *      started in the PythonHandler phase.
+ */
+
+static PyObject * req_set_buffering(requestobject *self, PyObject *args)
+{
+    int on, etag = 0;
+
+    if (! PyArg_ParseTuple(args, "i|i", &on, &etag))
+        return NULL;  /* bad args */
+
+    if (on) {
+        /* the buffer is only sent at the end of the content phase,
+           see python_handler() */
+        PyObject *o_phase = self->phase;
+        char *phase = NULL;
+        int content;
+
+        if (!o_phase) {
+            PyErr_SetString(PyExc_ValueError,
+                            "set_buffering() can only be used in the PythonHandler phase");
+            return NULL;
+        }
+        MP_ANYSTR_AS_STR(phase, o_phase, 1);
+        if (!phase) {
+            Py_DECREF(o_phase);
+            return NULL;
+        }
+        content = strcmp(phase, "PythonHandler") == 0;
+        Py_DECREF(o_phase);
+        if (!content) {
+            PyErr_SetString(PyExc_ValueError,
+                            "set_buffering() can only be used in the PythonHandler phase");
+            return NULL;
+        }
+
+        if (!self->obuf)
+            self->obuf = apr_brigade_create(self->request_rec->pool,
+                                            self->request_rec->connection->bucket_alloc);
+        self->obuf_etag = etag;
+    }
+    else if (self->obuf) {
+        if (pass_buffer(self) != APR_SUCCESS) {
+            PyErr_SetString(PyExc_IOError, "Write failed, client closed connection.");
+            return NULL;
+        }
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+/**
+ ** MpRequest_FinishBuffering
+ **
+ *      Called without the GIL after the handlers of a phase have
+ *      returned result. If the output was buffered and result is OK,
+ *      sets Content-Length and (if requested) a strong ETag computed
+ *      from the buffered output, then sends it, unless the request
+ *      is conditional and the conditions are not met, in which case
+ *      the buffer is discarded and the status to respond with (such
+ *      as HTTP_NOT_MODIFIED) is returned. If result is DONE, the
+ *      buffer is sent with a Content-Length only. For any other
+ *      result the buffer is discarded. Returns result.
+ */
+
+int MpRequest_FinishBuffering(requestobject *self, int result)
+{
+    request_rec *r = self->request_rec;
+    apr_bucket_brigade *bb = self->obuf;
+    apr_off_t len = 0;
+    apr_bucket *b;
+    int rc;
+
+    if (!bb)
+        return result;
+
+    self->obuf = NULL;
+
+    if (result != OK && result != DONE) {
+        /* let Apache respond with the error */
+        apr_brigade_destroy(bb);
+        return result;
+    }
+
+    apr_brigade_length(bb, 1, &len);
+    if (!apr_table_get(r->headers_out, "Content-Length"))
+        ap_set_content_length(r, len);
+
+    if (result == DONE) {
+        /* the handler responded by itself (e.g. with a redirect or
+           the traceback of PythonDebug), send it as it is */
+        goto send;
+    }
+
+    if (self->obuf_etag && !apr_table_get(r->headers_out, "ETag")) {
+        apr_md5_ctx_t md5;
+        unsigned char digest[APR_MD5_DIGESTSIZE];
+        char *etag, *p;
+        int i;
+
+        apr_md5_init(&md5);
+        for (b = APR_BRIGADE_FIRST(bb); b != APR_BRIGADE_SENTINEL(bb);
+             b = APR_BUCKET_NEXT(b)) {
+            const char *data;
+            apr_size_t n;
+            /* these are heap buckets, reading them does not block */
+            if (apr_bucket_read(b, &data, &n, APR_BLOCK_READ) == APR_SUCCESS)
+                apr_md5_update(&md5, data, n);
+        }
+        apr_md5_final(digest, &md5);
+
+        p = etag = apr_palloc(r->pool, 2 * APR_MD5_DIGESTSIZE + 3);
+        *p++ = '"';
+        for (i = 0; i < APR_MD5_DIGESTSIZE; i++)
+            p += apr_snprintf(p, 3, "%02x", digest[i]);
+        *p++ = '"';
+        *p = '\0';
+        apr_table_setn(r->headers_out, "ETag", etag);
+    }
+
+    rc = ap_meets_conditions(r);
+    if (rc != OK) {
+        /* e.g. HTTP_NOT_MODIFIED, no body */
+        apr_table_unset(r->headers_out, "Content-Length");
+        apr_brigade_destroy(bb);
+        return rc;
+    }
+
+send:
+    if (ap_pass_brigade(r->output_filters, bb) != APR_SUCCESS)
+        ap_log_rerror(APLOG_MARK, APLOG_DEBUG, 0, r,
+                      "python_handler: sending the buffered output failed.");
+    apr_brigade_destroy(bb);
+
+    return result;
+}
+
 /**
  ** request.flush(request self)
  **
@@ -1614,6 +2124,12 @@ static PyObject * req_flush(requestobject *self)
 {
     int rc;
 
+    if (self->obuf) {
+        /* buffering, flushing would defeat it */
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+
     Py_BEGIN_ALLOW_THREADS
     rc = ap_rflush(self->request_rec);
     Py_END_ALLOW_THREADS
@@ -1622,64 +2138,163 @@ static PyObject * req_flush(requestobject *self)
         return NULL;
     }
 
+    self->unflushed = 0;
+    self->last_flush = apr_time_now();
+    self->flushes++;
+
     Py_INCREF(Py_None);
     return Py_None;
 }
 
 /**
- ** request.sendfile
+ ** request.sendfile(request self, file[, offset[, len]])
+ ** request.sendfile(request self, file, ranges)
  **
+ *     Sends a file, given by path, file descriptor or object with a
+ *     fileno() method, or the (offset, length) ranges of it, as file
+ *     buckets, which Apache can send with sendfile(2). ranges may
+ *     also contain bytes, which are sent between the ranges.
  */
 
 static PyObject * req_sendfile(requestobject *self, PyObject *args)
 {
-    char *fname;
+    PyObject *file, *where = NULL, *ranges = NULL;
+    char *fname = NULL;
     apr_file_t *fd;
-    apr_size_t offset=0, len=-1, nbytes;
+    PY_LONG_LONG offset = 0, len = -1, total = 0;
     apr_status_t status;
-    PyObject * py_result = NULL;
     apr_finfo_t finfo;
+    apr_bucket_brigade *bb;
+    request_rec *r = self->request_rec;
+    Py_ssize_t i, n = 1;
 
-    if (! PyArg_ParseTuple(args, "s|ll", &fname, &offset, &len))
+    if (! PyArg_ParseTuple(args, "O|OL", &file, &where, &len))
         return NULL;  /* bad args */
 
+    if (where) {
+        if (PyList_Check(where) || PyTuple_Check(where)) {
+            ranges = where;
+            n = PySequence_Size(ranges);
+        }
+        else {
+            offset = PyLong_AsLongLong(where);
+            if (offset == -1 && PyErr_Occurred())
+                return NULL;
+        }
+    }
+
+    if (PyBytes_Check(file))
+        fname = PyBytes_AS_STRING(file);
+    else if (PyUnicode_Check(file) && ! PyArg_Parse(file, "s", &fname))
+        return NULL;
+
+    if (fname) {
+        Py_BEGIN_ALLOW_THREADS
+        status=apr_file_open(&fd, fname,
+                             APR_READ, APR_OS_DEFAULT,
+                             r->pool);
+        Py_END_ALLOW_THREADS
+        if (status != APR_SUCCESS) {
+            PyErr_SetString(PyExc_IOError, "Could not open file for reading");
+            return NULL;
+        }
+    }
+    else {
+        /* a descriptor of the caller, which it may close as soon as
+           we return, so send a duplicate, closed with the request */
+        apr_file_t *theirs;
+        apr_os_file_t osfd;
+        int fileno = PyObject_AsFileDescriptor(file);
+        if (fileno == -1)
+            return NULL;
+#ifdef WIN32
+        osfd = (apr_os_file_t)_get_osfhandle(fileno);
+#else
+        osfd = fileno;
+#endif
+        apr_os_file_put(&theirs, &osfd, APR_READ, r->pool);
+        status = apr_file_dup(&fd, theirs, r->pool);
+        if (status != APR_SUCCESS) {
+            PyErr_SetString(PyExc_IOError, "Could not duplicate file descriptor");
+            return NULL;
+        }
+    }
+
     Py_BEGIN_ALLOW_THREADS
-    status=apr_stat(&finfo, fname,
-                    APR_FINFO_SIZE, self->request_rec->pool);
+    status=apr_file_info_get(&finfo, APR_FINFO_SIZE, fd);
     Py_END_ALLOW_THREADS
     if (status != APR_SUCCESS) {
         PyErr_SetString(PyExc_IOError, "Could not stat file for reading");
         return NULL;
     }
 
-    Py_BEGIN_ALLOW_THREADS
-    status=apr_file_open(&fd, fname,
-                         APR_READ, APR_OS_DEFAULT,
-                         self->request_rec->pool);
-    Py_END_ALLOW_THREADS
-    if (status != APR_SUCCESS) {
-        PyErr_SetString(PyExc_IOError, "Could not open file for reading");
+    /* the file follows what has been buffered, which can not be
+       buffered any longer */
+    if (self->obuf && pass_buffer(self) != APR_SUCCESS) {
+        PyErr_SetString(PyExc_IOError, "Write failed, client closed connection.");
         return NULL;
     }
 
-    if (len==-1) len=finfo.size;
+    bb = apr_brigade_create(r->pool, r->connection->bucket_alloc);
+
+    for (i = 0; i < n; i++) {
+        if (ranges) {
+            PyObject *range = PySequence_GetItem(ranges, i);
+            if (!range) {
+                apr_brigade_destroy(bb);
+                return NULL;
+            }
+            if (PyObject_CheckBuffer(range) && !PyUnicode_Check(range)) {
+                /* data sent as it is between the ranges, such as
+                   the headers of multipart/byteranges parts */
+                Py_buffer view;
+                apr_bucket *b;
+                if (PyObject_GetBuffer(range, &view, PyBUF_SIMPLE) == -1) {
+                    Py_DECREF(range);
+                    apr_brigade_destroy(bb);
+                    return NULL;
+                }
+                b = apr_bucket_heap_create(view.buf, view.len, NULL,
+                                           r->connection->bucket_alloc);
+                APR_BRIGADE_INSERT_TAIL(bb, b);
+                total += view.len;
+                PyBuffer_Release(&view);
+                Py_DECREF(range);
+                continue;
+            }
+            if (! PyArg_ParseTuple(range, "LL;ranges must be (offset, length) tuples",
+                                   &offset, &len)) {
+                Py_DECREF(range);
+                apr_brigade_destroy(bb);
+                return NULL;
+            }
+            Py_DECREF(range);
+        }
+        if (offset < 0 || offset > finfo.size) {
+            apr_brigade_destroy(bb);
+            PyErr_SetString(PyExc_ValueError, "offset outside of the file");
+            return NULL;
+        }
+        if (len < 0 || offset + len > finfo.size)
+            len = finfo.size - offset;
+        if (len > 0)
+            apr_brigade_insert_file(bb, fd, offset, len, r->pool);
+        total += len;
+    }
 
     Py_BEGIN_ALLOW_THREADS
-        status = ap_send_fd(fd, self->request_rec, offset,
-                            len, &nbytes);
+    status = ap_pass_brigade(r->output_filters, bb);
+    apr_brigade_cleanup(bb);
     Py_END_ALLOW_THREADS
-    apr_file_close(fd);
 
     if (status != APR_SUCCESS) {
         PyErr_SetString(PyExc_IOError, "Write failed, client closed connection.");
         return NULL;
     }
 
-    self->bytes_queued += len;
+    self->bytes_queued += total;
 
-    py_result = PyLong_FromLong (nbytes);
-    Py_INCREF(py_result);
-    return py_result;
+    return PyLong_FromLongLong(total);
 }
 
 static PyMethodDef request_methods[] = {
@@ -1705,9 +2320,11 @@ static PyMethodDef request_methods[] = {
     {"get_options",           (PyCFunction) req_get_options,           METH_NOARGS},
     {"internal_redirect",     (PyCFunction) req_internal_redirect,     METH_VARARGS},
     {"is_https",              (PyCFunction) req_is_https,              METH_NOARGS},
+    {"iter_body",             (PyCFunction) req_iter_body,             METH_VARARGS},
     {"log_error",             (PyCFunction) req_log_error,             METH_VARARGS},
     {"meets_conditions",      (PyCFunction) req_meets_conditions,      METH_NOARGS},
     {"read",                  (PyCFunction) req_read,                  METH_VARARGS},
+    {"readinto",              (PyCFunction) req_readinto,              METH_VARARGS},
     {"readline",              (PyCFunction) req_readline,              METH_VARARGS},
     {"readlines",             (PyCFunction) req_readlines,             METH_VARARGS},
     {"register_cleanup",      (PyCFunction) req_register_cleanup,      METH_VARARGS},
@@ -1718,6 +2335,7 @@ static PyMethodDef request_methods[] = {
 #endif
     {"send_http_header",      (PyCFunction) req_send_http_header,      METH_NOARGS},
     {"sendfile",              (PyCFunction) req_sendfile,              METH_VARARGS},
+    {"set_buffering",         (PyCFunction) req_set_buffering,         METH_VARARGS},
     {"set_content_length",    (PyCFunction) req_set_content_length,    METH_VARARGS},
     {"set_etag",              (PyCFunction) req_set_etag,              METH_NOARGS},
     {"set_last_modified",     (PyCFunction) req_set_last_modified,     METH_NOARGS},
@@ -2285,6 +2903,8 @@ static PyMemberDef request_members[] = {
     {"phase",              T_OBJECT,    OFF(phase),             READONLY},
     {"extension",          T_STRING,    OFF(extension),         READONLY},
     {"hlist",              T_OBJECT,    OFF(hlo),               READONLY},
+    {"interpreter_wait",   T_DOUBLE,    OFF(interpreter_wait),  READONLY},
+    {"flushes",            T_LONG,      OFF(flushes),           READONLY},
     {NULL}  /* Sentinel */
 };
 
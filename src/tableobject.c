@@ -57,6 +57,16 @@ PyObject * MpTable_FromTable(apr_table_t *t)
 
     result->table = t;
     result->pool = NULL;
+    result->index_slots = NULL;
+    result->index_next = NULL;
+    result->index_hashes = NULL;
+    result->index_mask = 0;
+    result->index_elts = NULL;
+    result->index_nelts = 0;
+    result->index_lastkey = NULL;
+    result->index_keys = NULL;
+    result->index_keyptrs = NULL;
+    result->index_nkeys = 0;
 
     return (PyObject *)result;
 }
@@ -95,6 +105,243 @@ PyObject * MpTable_New()
 
 }
 
+/* see MP_TABLE_INDEX_MIN, changed by _apache._table_index_min() */
+int mp_table_index_min = MP_TABLE_INDEX_MIN;
+
+/**
+ ** table_hash
+ **
+ *      Case insensitive FNV-1a hash of a key
+ */
+
+static unsigned int table_hash(const char *k)
+{
+    unsigned int h = 2166136261U;
+
+    while (*k)
+        h = (h ^ (unsigned char)apr_tolower(*k++)) * 16777619U;
+
+    return h;
+}
+
+/**
+ ** table_index_drop
+ **
+ *      Frees the lookup index
+ */
+
+static void table_index_drop(tableobject *self)
+{
+    if (self->index_slots) {
+        PyMem_Free(self->index_slots);
+        PyMem_Free(self->index_next);
+        PyMem_Free(self->index_hashes);
+        self->index_slots = NULL;
+        self->index_next = NULL;
+        self->index_hashes = NULL;
+    }
+    self->index_elts = NULL;
+    self->index_nelts = 0;
+}
+
+/**
+ ** table_index_clear
+ **
+ *      Frees the lookup index and the key strings
+ */
+
+static void table_index_clear(tableobject *self)
+{
+    int i;
+
+    table_index_drop(self);
+
+    if (self->index_keys) {
+        for (i = 0; i < self->index_nkeys; i++)
+            Py_XDECREF(self->index_keys[i]);
+        PyMem_Free(self->index_keys);
+        PyMem_Free(self->index_keyptrs);
+        self->index_keys = NULL;
+        self->index_keyptrs = NULL;
+        self->index_nkeys = 0;
+    }
+}
+
+/**
+ ** table_index_build
+ **
+ *      Builds an open addressing hash of the positions of the
+ *      entries. A slot holds the position of the first entry of
+ *      a key, index_next chains the entries with the same key.
+ *      Returns 0 if out of memory, in which case the table is
+ *      scanned instead.
+ */
+
+static int table_index_build(tableobject *self, const apr_array_header_t *ah)
+{
+    apr_table_entry_t *elts = (apr_table_entry_t *) ah->elts;
+    unsigned int size = 8, h;
+    int i, j;
+
+    TABLE_DEBUG("table_index_build");
+
+    table_index_drop(self);
+
+    while (size < (unsigned int)ah->nelts * 2)
+        size <<= 1;
+
+    self->index_slots = PyMem_New(int, size);
+    self->index_next = PyMem_New(int, ah->nelts);
+    self->index_hashes = PyMem_New(unsigned int, ah->nelts);
+    if (!self->index_slots || !self->index_next || !self->index_hashes) {
+        PyMem_Free(self->index_slots);
+        PyMem_Free(self->index_next);
+        PyMem_Free(self->index_hashes);
+        self->index_slots = NULL;
+        self->index_next = NULL;
+        self->index_hashes = NULL;
+        return 0;
+    }
+    self->index_mask = size - 1;
+    for (h = 0; h < size; h++)
+        self->index_slots[h] = -1;
+
+    /* backwards, so that a slot ends up with the first entry of its
+       key, and the duplicates are chained in table order */
+    for (i = ah->nelts; i--; ) {
+        self->index_next[i] = -1;
+        self->index_hashes[i] = 0;
+        if (!elts[i].key)
+            continue;
+        self->index_hashes[i] = table_hash(elts[i].key);
+        h = self->index_hashes[i] & self->index_mask;
+        while ((j = self->index_slots[h]) != -1 &&
+               (self->index_hashes[j] != self->index_hashes[i] ||
+                strcasecmp(elts[j].key, elts[i].key) != 0))
+            h = (h + 1) & self->index_mask;
+        self->index_next[i] = j;
+        self->index_slots[h] = i;
+    }
+
+    self->index_elts = ah->elts;
+    self->index_nelts = ah->nelts;
+    self->index_lastkey = elts[ah->nelts - 1].key;
+    return 1;
+}
+
+/**
+ ** table_index_find
+ **
+ *      Position of the first entry of key k, -1 if there is none,
+ *      or -2 if the table is not indexed and must be scanned.
+ *
+ *      The index is not invalidated by the methods of the table,
+ *      because the apr table may as well be changed by Apache or
+ *      other modules behind our back. Instead, adding or removing
+ *      entries changes nelts, elts or the last entry (new entries are
+ *      appended), and entries that were moved (apr_table_compress()
+ *      sorts them) are noticed because the hash recorded for their
+ *      position no longer matches. Setting the value of an existing
+ *      key keeps the index.
+ */
+
+static int table_index_find(tableobject *self, const char *k)
+{
+    const apr_array_header_t *ah = apr_table_elts(self->table);
+    apr_table_entry_t *elts = (apr_table_entry_t *) ah->elts;
+    unsigned int hk, h;
+    int i, tries;
+
+    if (mp_table_index_min <= 0 || ah->nelts < mp_table_index_min)
+        return -2;
+
+    hk = table_hash(k);
+
+    for (tries = 0; tries < 2; tries++) {
+
+        if (!self->index_slots || self->index_elts != ah->elts ||
+            self->index_nelts != ah->nelts ||
+            self->index_lastkey != elts[ah->nelts - 1].key) {
+            if (!table_index_build(self, ah))
+                return -2;
+        }
+
+        h = hk & self->index_mask;
+        while ((i = self->index_slots[h]) != -1) {
+            if (!elts[i].key || table_hash(elts[i].key) != self->index_hashes[i])
+                break;  /* stale */
+            if (self->index_hashes[i] == hk && strcasecmp(elts[i].key, k) == 0)
+                return i;
+            h = (h + 1) & self->index_mask;
+        }
+        if (i == -1)
+            return -1;
+
+        table_index_drop(self);
+    }
+
+    return -2;
+}
+
+/**
+ ** table_key
+ **
+ *      The key of entry i as a Python string. For the tables that are
+ *      indexed the strings are interned and kept, so that iterating
+ *      over the keys or looking them up in dicts does not create a
+ *      new string every time.
+ */
+
+static PyObject *table_key(tableobject *self, apr_table_entry_t *elts, int i)
+{
+    PyObject *key;
+    int nelts = apr_table_elts(self->table)->nelts;
+
+    if (mp_table_index_min <= 0 || nelts < mp_table_index_min)
+        return MpBytesOrUnicode_FromString(elts[i].key);
+
+    if (i >= self->index_nkeys) {
+        PyObject **keys;
+        const char **ptrs;
+        keys = PyMem_Realloc(self->index_keys, nelts * sizeof(PyObject *));
+        if (!keys)
+            return MpBytesOrUnicode_FromString(elts[i].key);
+        self->index_keys = keys;
+        ptrs = PyMem_Realloc(self->index_keyptrs, nelts * sizeof(const char *));
+        if (!ptrs)
+            return MpBytesOrUnicode_FromString(elts[i].key);
+        self->index_keyptrs = ptrs;
+        while (self->index_nkeys < nelts) {
+            self->index_keys[self->index_nkeys] = NULL;
+            self->index_keyptrs[self->index_nkeys++] = NULL;
+        }
+    }
+
+    /* the keys are allocated from the pool of the table, a pointer
+       can not refer to a different string while the table exists */
+    key = self->index_keys[i];
+    if (key && self->index_keyptrs[i] == elts[i].key) {
+        Py_INCREF(key);
+        return key;
+    }
+
+    key = MpBytesOrUnicode_FromString(elts[i].key);
+    if (!key)
+        return NULL;
+#if PY_MAJOR_VERSION < 3
+    PyString_InternInPlace(&key);
+#else
+    PyUnicode_InternInPlace(&key);
+#endif
+
+    Py_XDECREF(self->index_keys[i]);
+    Py_INCREF(key);
+    self->index_keys[i] = key;
+    self->index_keyptrs[i] = elts[i].key;
+
+    return key;
+}
+
 /**
  ** table_dealloc
  **
@@ -107,6 +354,8 @@ static void table_dealloc(register void *o)
 
     TABLE_DEBUG("table_dealloc");
 
+    table_index_clear(self);
+
     if (MpTable_Check(self)) {
         if (self->pool)
             apr_pool_destroy(self->pool);
@@ -254,6 +503,20 @@ static PyObject * table_subscript(PyObject *self, register PyObject *key)
         return NULL;
     }
 
+    ah = apr_table_elts (((tableobject *)self)->table);
+    elts = (apr_table_entry_t *) ah->elts;
+
+    i = table_index_find((tableobject *)self, k);
+
+    /* a single match, the common case */
+    if (i >= 0 && ((tableobject *)self)->index_next[i] == -1) {
+        Py_DECREF(key); /* becasue of MP_ANYSTR_AS_STR */
+        if (elts[i].val != NULL)
+            return MpBytesOrUnicode_FromString(elts[i].val);
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+
     /* it's possible that we have duplicate keys, so
        we can't simply use apr_table_get since that just
        returns the first match.
@@ -263,25 +526,48 @@ static PyObject * table_subscript(PyObject *self, register PyObject *key)
     if (!list)
         return NULL;
 
-    ah = apr_table_elts (((tableobject *)self)->table);
-    elts = (apr_table_entry_t *) ah->elts;
-
-    i = ah->nelts;
+    if (i >= 0) {
+        /* follow the chain of duplicates */
+        tableobject *t = (tableobject *)self;
+        for (; i != -1; i = t->index_next[i]) {
+            PyObject *v = NULL;
+            if (table_hash(elts[i].key) != t->index_hashes[i]) {
+                /* stale, start over */
+                table_index_drop(t);
+                PyList_SetSlice(list, 0, PyList_GET_SIZE(list), NULL);
+                i = -2;
+                break;
+            }
+            if (elts[i].val != NULL)
+                v = MpBytesOrUnicode_FromString(elts[i].val);
+            else {
+                v = Py_None;
+                Py_INCREF(v);
+            }
+            PyList_Append(list, v);
+            Py_DECREF(v);
+        }
+    }
 
-    while (i--)
-        if (elts[i].key) {
-            if (apr_strnatcasecmp(elts[i].key, k) == 0) {
-                PyObject *v = NULL;
-                if (elts[i].val != NULL)
-                    v = MpBytesOrUnicode_FromString(elts[i].val);
-                else {
-                    v = Py_None;
-                    Py_INCREF(v);
+    if (i == -2) {
+
+        i = ah->nelts;
+
+        while (i--)
+            if (elts[i].key) {
+                if (strcasecmp(elts[i].key, k) == 0) {
+                    PyObject *v = NULL;
+                    if (elts[i].val != NULL)
+                        v = MpBytesOrUnicode_FromString(elts[i].val);
+                    else {
+                        v = Py_None;
+                        Py_INCREF(v);
+                    }
+                    PyList_Insert(list, 0, v);
+                    Py_DECREF(v);
                 }
-                PyList_Insert(list, 0, v);
-                Py_DECREF(v);
             }
-        }
+    }
 
     Py_DECREF(key); /* becasue of MP_ANYSTR_AS_STR */
 
@@ -376,7 +662,7 @@ static PyObject * table_keys(register tableobject *self)
     {
         if (elts[i].key)
         {
-            PyObject *key = MpBytesOrUnicode_FromString(elts[i].key);
+            PyObject *key = table_key(self, elts, i);
             PyList_SetItem(v, j, key);
             j++;
         }
@@ -448,7 +734,8 @@ static PyObject * table_items(register tableobject *self)
     {
         if (elts[i].key)
         {
-            PyObject *keyval = Py_BuildValue("(s,s)", elts[i].key, elts[i].val);
+            PyObject *keyval = Py_BuildValue("(N,s)", table_key(self, elts, i),
+                                             elts[i].val);
             PyList_SetItem(v, j, keyval);
             j++;
         }
@@ -745,6 +1032,7 @@ static PyObject * table_has_key(tableobject *self, PyObject *key)
 {
 
     const char *k;
+    int i;
 
     TABLE_DEBUG("table_has_key");
 
@@ -754,10 +1042,12 @@ static PyObject * table_has_key(tableobject *self, PyObject *key)
         return NULL;
     }
 
-    if (apr_table_get(self->table, k))
-        return PyLong_FromLong(1);
-    else
-        return PyLong_FromLong(0);
+    i = table_index_find(self, k);
+    if (i == -2)
+        i = apr_table_get(self->table, k) ? 0 : -1;
+
+    Py_DECREF(key); /* MP_ANYSTR_AS_STR */
+    return PyLong_FromLong(i != -1);
 }
 
 /**
@@ -773,6 +1063,7 @@ static PyObject *table_get(register tableobject *self, PyObject *args)
     PyObject *failobj = Py_None;
     PyObject *val = NULL;
     const char *k, *v;
+    int i;
 
     TABLE_DEBUG("table_get");
 
@@ -785,7 +1076,13 @@ static PyObject *table_get(register tableobject *self, PyObject *args)
         return NULL;
     }
 
-    v = apr_table_get(self->table, k);
+    i = table_index_find(self, k);
+    if (i >= 0)
+        v = ((apr_table_entry_t *) apr_table_elts(self->table)->elts)[i].val;
+    else if (i == -2)
+        v = apr_table_get(self->table, k);
+    else
+        v = NULL;
     if (!v) {
         val = failobj;
         Py_INCREF(val);
@@ -858,6 +1155,7 @@ static PyObject *table_clear(register tableobject *self)
 {
     TABLE_DEBUG("table_clear");
 
+    table_index_clear(self);
     apr_table_clear(self->table);
 
     Py_INCREF(Py_None);
@@ -979,23 +1277,304 @@ static PyObject * mp_table_add(tableobject *self, PyObject *args)
     return Py_None;
 }
 
-typedef PyObject * (*tableselectfunc)(apr_table_entry_t *);
+/**
+ ** table_put
+ **
+ *     Sets (or, if add is true, adds) key to val, both converted to
+ *     strings with str() unless they are strings already.
+ */
+
+static int table_put(tableobject *self, PyObject *key, PyObject *val, int add)
+{
+    const char *k, *v;
+
+    if (PyUnicode_CheckExact(key) || PyBytes_CheckExact(key))
+        Py_INCREF(key);
+    else if (!(key = PyObject_Str(key)))
+        return -1;
+    if (PyUnicode_CheckExact(val) || PyBytes_CheckExact(val))
+        Py_INCREF(val);
+    else if (!(val = PyObject_Str(val))) {
+        Py_DECREF(key);
+        return -1;
+    }
+
+    MP_ANYSTR_AS_STR(k, key, 0);
+    MP_ANYSTR_AS_STR(v, val, 0);
+    if ((!k) || (!v)) {
+        Py_DECREF(key); /* MP_ANYSTR_AS_STR */
+        Py_DECREF(val); /* MP_ANYSTR_AS_STR */
+        return -1;
+    }
+
+    if (add)
+        apr_table_add(self->table, k, v);
+    else
+        apr_table_set(self->table, k, v);
+
+    Py_DECREF(key); /* MP_ANYSTR_AS_STR */
+    Py_DECREF(val); /* MP_ANYSTR_AS_STR */
+    return 0;
+}
+
+/**
+ ** table_entry_value
+ **
+ *     The value of entry i, None if it has none
+ */
+
+static PyObject *table_entry_value(apr_table_entry_t *elts, int i)
+{
+    if (elts[i].val != NULL)
+        return MpBytesOrUnicode_FromString(elts[i].val);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+/**
+ ** table_as_dict
+ **
+ *     Returns the table as a dict. The values of keys that occur more
+ *     than once (compared case-insensitively, the first spelling is
+ *     used) are lists, or all values are lists if multi is true.
+ */
+
+static PyObject *table_as_dict(tableobject *self, PyObject *args)
+{
+    PyObject *dict, *key, *val;
+    const apr_array_header_t *ah;
+    apr_table_entry_t *elts;
+    int *next = NULL;
+    char *dup = NULL;
+    int multi = 0;
+    int i, j;
+
+    TABLE_DEBUG("table_as_dict");
+
+    if (! PyArg_ParseTuple(args, "|i:as_dict", &multi))
+        return NULL;
+
+    dict = PyDict_New();
+    if (!dict)
+        return NULL;
+
+    ah = apr_table_elts(self->table);
+    elts = (apr_table_entry_t *) ah->elts;
+
+    /* with the index, the duplicates of an entry are chained, and
+       an entry that some other entry is chained to is a duplicate */
+    if (ah->nelts && elts[0].key &&
+        table_index_find(self, elts[0].key) != -2) {
+        next = self->index_next;
+        for (i = 0; i < ah->nelts; i++)
+            if (elts[i].key && table_hash(elts[i].key) != self->index_hashes[i]) {
+                /* moved entries, see table_index_find() */
+                table_index_drop(self);
+                next = NULL;
+                break;
+            }
+    }
+    if (next) {
+        dup = PyMem_Malloc(ah->nelts);
+        if (!dup) {
+            Py_DECREF(dict);
+            return PyErr_NoMemory();
+        }
+        memset(dup, 0, ah->nelts);
+        for (i = 0; i < ah->nelts; i++)
+            if (next[i] != -1)
+                dup[next[i]] = 1;
+    }
+
+    for (i = 0; i < ah->nelts; i++) {
+
+        if (!elts[i].key)
+            continue;
+
+        if (next) {
+            if (dup[i])
+                continue;
+            j = next[i];
+        }
+        else {
+            /* small table, scan it */
+            for (j = 0; j < i; j++)
+                if (elts[j].key && strcasecmp(elts[j].key, elts[i].key) == 0)
+                    break;
+            if (j < i)
+                continue;
+            for (j = i + 1; j < ah->nelts; j++)
+                if (elts[j].key && strcasecmp(elts[j].key, elts[i].key) == 0)
+                    break;
+            if (j == ah->nelts)
+                j = -1;
+        }
+
+        if (j == -1 && !multi)
+            val = table_entry_value(elts, i);
+        else {
+            val = PyList_New(0);
+            for (j = i; val && j != -1; ) {
+                PyObject *v = table_entry_value(elts, j);
+                if (!v || PyList_Append(val, v) < 0) {
+                    Py_XDECREF(v);
+                    Py_CLEAR(val);
+                    break;
+                }
+                Py_DECREF(v);
+                if (next)
+                    j = next[j];
+                else {
+                    for (j++; j < ah->nelts; j++)
+                        if (elts[j].key && strcasecmp(elts[j].key, elts[i].key) == 0)
+                            break;
+                    if (j == ah->nelts)
+                        j = -1;
+                }
+            }
+        }
+        if (!val)
+            goto error;
+
+        key = table_key(self, elts, i);
+        if (!key || PyDict_SetItem(dict, key, val) < 0) {
+            Py_XDECREF(key);
+            Py_DECREF(val);
+            goto error;
+        }
+        Py_DECREF(key);
+        Py_DECREF(val);
+    }
+
+    PyMem_Free(dup);
+    return dict;
+
+error:
+    PyMem_Free(dup);
+    Py_DECREF(dict);
+    return NULL;
+}
+
+/**
+ ** table_update_from_dict
+ **
+ *     Sets the keys of a dict (or any mapping) in the table, a list
+ *     or tuple value replaces the key with one entry per item.
+ */
+
+static PyObject *table_update_from_dict(tableobject *self, PyObject *dict)
+{
+    PyObject *items = NULL, *key, *val;
+    Py_ssize_t pos = 0;
+
+    TABLE_DEBUG("table_update_from_dict");
+
+    if (!PyDict_Check(dict)) {
+        items = PyMapping_Items(dict);
+        if (!items)
+            return NULL;
+    }
+
+    while (1) {
+        if (items) {
+            if (pos >= PyList_GET_SIZE(items))
+                break;
+            if (! PyArg_ParseTuple(PyList_GET_ITEM(items, pos++),
+                                   "OO;items() must return (key, value) pairs",
+                                   &key, &val))
+                goto error;
+        }
+        else if (!PyDict_Next(dict, &pos, &key, &val))
+            break;
+
+        if (PyList_Check(val) || PyTuple_Check(val)) {
+            Py_ssize_t i, len = PySequence_Fast_GET_SIZE(val);
+            PyObject **vals = PySequence_Fast_ITEMS(val);
+            for (i = 0; i < len; i++)
+                if (table_put(self, key, vals[i], i > 0) < 0)
+                    goto error;
+            if (len == 0 && PyObject_DelItem((PyObject *)self, key) < 0)
+                goto error;
+        }
+        else if (table_put(self, key, val, 0) < 0)
+            goto error;
+    }
+
+    Py_XDECREF(items);
+    Py_INCREF(Py_None);
+    return Py_None;
+
+error:
+    Py_XDECREF(items);
+    return NULL;
+}
+
+/**
+ ** table_extend
+ **
+ *     Adds the (key, value) pairs of an iterable, like add() for
+ *     each of them.
+ */
+
+static PyObject *table_extend(tableobject *self, PyObject *pairs)
+{
+    PyObject *seq, *key, *val;
+    Py_ssize_t i, len;
+
+    TABLE_DEBUG("table_extend");
+
+    seq = PySequence_Fast(pairs, "extend() argument must be iterable");
+    if (!seq)
+        return NULL;
+
+    len = PySequence_Fast_GET_SIZE(seq);
+    for (i = 0; i < len; i++) {
+        PyObject *item = PySequence_Fast_GET_ITEM(seq, i);
+        int rc;
+        item = PySequence_Fast(item, "extend() items must be (key, value) pairs");
+        if (!item) {
+            Py_DECREF(seq);
+            return NULL;
+        }
+        if (PySequence_Fast_GET_SIZE(item) != 2) {
+            PyErr_SetString(PyExc_ValueError,
+                            "extend() items must be (key, value) pairs");
+            Py_DECREF(item);
+            Py_DECREF(seq);
+            return NULL;
+        }
+        key = PySequence_Fast_GET_ITEM(item, 0);
+        val = PySequence_Fast_GET_ITEM(item, 1);
+        rc = table_put(self, key, val, 1);
+        Py_DECREF(item);
+        if (rc < 0) {
+            Py_DECREF(seq);
+            return NULL;
+        }
+    }
+
+    Py_DECREF(seq);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+typedef PyObject * (*tableselectfunc)(tableobject *, apr_table_entry_t *, int);
 
 static PyObject *tableiter_new(tableobject *, tableselectfunc);
 
-static PyObject *select_key(apr_table_entry_t *elts)
+static PyObject *select_key(tableobject *table, apr_table_entry_t *elts, int i)
 {
-    return MpBytesOrUnicode_FromString(elts->key);
+    return table_key(table, elts, i);
 }
 
-static PyObject *select_value(apr_table_entry_t *elts)
+static PyObject *select_value(tableobject *table, apr_table_entry_t *elts, int i)
 {
     PyObject *val = NULL;
 
     TABLE_DEBUG("select_value");
 
-    if (elts->val != NULL)
-        val = MpBytesOrUnicode_FromString(elts->val);
+    if (elts[i].val != NULL)
+        val = MpBytesOrUnicode_FromString(elts[i].val);
     else {
         val = Py_None;
         Py_INCREF(val);
@@ -1004,11 +1583,11 @@ static PyObject *select_value(apr_table_entry_t *elts)
     return val;
 }
 
-static PyObject *select_item(apr_table_entry_t *elts)
+static PyObject *select_item(tableobject *table, apr_table_entry_t *elts, int i)
 {
     TABLE_DEBUG("select_item");
 
-    return Py_BuildValue("(s,s)", elts->key, elts->val);
+    return Py_BuildValue("(N,s)", table_key(table, elts, i), elts[i].val);
 }
 
 static PyObject *table_iterkeys(tableobject *self)
@@ -1074,6 +1653,14 @@ static char iteritems__doc__[] =
 
 static char add__doc__[] =
 "T.add(k, v) -> add (as oppsed to replace) a key k and value v";
+static char as_dict__doc__[] =
+"T.as_dict([multi]) -> dict of T, values of duplicate keys (or all values\n"
+"if multi is true) are lists";
+static char update_from_dict__doc__[] =
+"T.update_from_dict(D) -> set the keys of D in T, list values are added\n"
+"as several entries";
+static char extend__doc__[] =
+"T.extend(seq) -> add (as oppsed to replace) each (key, value) pair of seq";
 
 /* table method definitions */
 static PyMethodDef mp_table_methods[] = {
@@ -1091,13 +1678,15 @@ static PyMethodDef mp_table_methods[] = {
     {"itervalues",  (PyCFunction)table_itervalues,   METH_NOARGS,  itervalues__doc__},
     {"iteritems",   (PyCFunction)table_iteritems,    METH_NOARGS,  iteritems__doc__},
     {"add",         (PyCFunction)mp_table_add,       METH_VARARGS, add__doc__},
+    {"as_dict",     (PyCFunction)table_as_dict,      METH_VARARGS, as_dict__doc__},
+    {"update_from_dict", (PyCFunction)table_update_from_dict, METH_O, update_from_dict__doc__},
+    {"extend",      (PyCFunction)table_extend,       METH_O,       extend__doc__},
     {NULL,          NULL}       /* sentinel */
 };
 
 static int table_contains(tableobject *self, PyObject *key)
 {
     char *k;
-    const char *v;
     int rc;
 
     TABLE_DEBUG("table_contains");
@@ -1107,9 +1696,11 @@ static int table_contains(tableobject *self, PyObject *key)
         Py_DECREF(key);
         return -1;
     }
-    v = apr_table_get(self->table, k);
+    rc = table_index_find(self, k);
+    if (rc == -2)
+        rc = apr_table_get(self->table, k) ? 0 : -1;
     Py_DECREF(key);
-    return (v != NULL);
+    return (rc != -1);
 }
 
 static PySequenceMethods table_as_sequence = {
@@ -1282,7 +1873,7 @@ static PyObject *tableiter_next(tableiterobject *ti, PyObject *args)
     /* return the next key/val */
 
     if (ti->ti_pos < ti->table->table->a.nelts) {
-        return (*ti->ti_select)(&elts[ti->ti_pos++]);
+        return (*ti->ti_select)(ti->table, elts, ti->ti_pos++);
     }
 
     /* the end has been reached */
@@ -1322,7 +1913,7 @@ static PyObject *tableiter_iternext(tableiterobject *ti)
     /* return the next key/val */
 
     if (ti->ti_pos < ti->table->table->a.nelts) {
-        return (*ti->ti_select)(&elts[ti->ti_pos++]);
+        return (*ti->ti_select)(ti->table, elts, ti->ti_pos++);
     }
 
     /* the end has been reached */
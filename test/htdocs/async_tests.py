@@ -0,0 +1,29 @@
+import asyncio
+from mod_python import apache
+
+async def backend(i):
+    await asyncio.sleep(0.5)
+    return i
+
+async def handler(req):
+
+    # these run concurrently, so this takes 0.5 rather than 2.5 seconds
+    results = await asyncio.gather(*[backend(i) for i in range(5)])
+
+    await apache.async_write(req, "test ok %s" % sum(results))
+
+    return apache.OK
+
+async def asgi_app(scope, receive, send):
+
+    body = b''
+    while True:
+        message = await receive()
+        body += message['body']
+        if not message['more_body']:
+            break
+
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': b'test ', 'more_body': True})
+    await send({'type': 'http.response.body', 'body': body})
@@ -106,6 +106,44 @@ class SimpleTestCase(unittest.TestCase):
         if a['a'] != ['b', 'c']:
             self.fail('table.add() broken: a["a"] is %s' % repr(a["a"]))
 
+        # bulk operations
+        log("  table.as_dict(), table.update_from_dict(), table.extend()")
+        a = apache.table()
+        a.extend([('a', 'b'), ('A', 'c'), ('d', 1)])
+        if a.as_dict() != {'a': ['b', 'c'], 'd': '1'}:
+            self.fail('table.as_dict() broken: %s' % repr(a.as_dict()))
+        if a.as_dict(True) != {'a': ['b', 'c'], 'd': ['1']}:
+            self.fail('table.as_dict(multi) broken: %s' % repr(a.as_dict(True)))
+        a.update_from_dict({'A': 'x', 'e': ['f', 'g'], 'd': []})
+        if a.as_dict() != {'a': 'x', 'e': ['f', 'g']}:
+            self.fail('table.update_from_dict() broken: %s' % repr(a.as_dict()))
+
+        # lookups in tables large enough to be indexed
+        log("  indexed lookups")
+        a = apache.table()
+        for i in range(100):
+            a['X-Header-%d' % i] = str(i)
+        if a['x-header-42'] != '42' or a.get('X-HEADER-99') != '99':
+            self.fail('indexed lookup broken')
+        if 'x-header-100' in a or a.get('x-header-100', 'no') != 'no':
+            self.fail('indexed lookup finds missing key')
+        a.add('X-Header-7', 'again')
+        if a['x-header-7'] != ['7', 'again']:
+            self.fail('indexed lookup of duplicates broken: %s' % repr(a['x-header-7']))
+        del a['X-Header-0']
+        a['X-Header-0'] = 'new'
+        if a['X-Header-0'] != 'new' or a['X-Header-1'] != '1':
+            self.fail('index not invalidated')
+        keys = list(a.keys())
+        if keys != list(a) or keys[-1] != 'X-Header-0':
+            self.fail('keys of indexed table broken')
+        d = a.as_dict()
+        if len(d) != 100 or d['X-Header-7'] != ['7', 'again']:
+            self.fail('table.as_dict() of indexed table broken')
+        a.clear()
+        if 'X-Header-1' in a:
+            self.fail('index not cleared')
+
         log("Table test DONE.")
 
     def test_req_add_common_vars(self):
@@ -582,6 +620,259 @@ class SimpleTestCase(unittest.TestCase):
         if repr(conn.notes) != '{}':
             self.fail("conn.notes should be {}")
 
+    def test_microcache_store(self):
+
+        from mod_python.filters import microcache
+
+        store = microcache.Store(1000)
+        entry = microcache.Entry(200, "text/plain", [], b"x" * 100, 0, 1, 10)
+        store.put("k", entry)
+
+        if store.get("k", 0.5) is not entry:
+            self.fail("a fresh entry should be found")
+
+        # once expired, only the first request goes through to refresh
+        if store.get("k", 2) is not None:
+            self.fail("the first request should refresh the entry")
+        if store.get("k", 2) is not entry or store.get("k", 3) is not entry:
+            self.fail("the stale entry should be sent during the refresh")
+        if store.get("k", 3, refresh=False) is not entry:
+            self.fail("HEAD requests should get the stale entry")
+
+        # a failed refresh lets the next request try
+        store.release("k")
+        if store.get("k", 3) is not None:
+            self.fail("the refresh should be retried after release()")
+
+        # after the stale period, the entry is gone
+        if store.get("k", 12) is not None or store.size != 0:
+            self.fail("the entry should be dropped after the stale period")
+
+        # the least recently used entries are dropped first
+        for i in range(12):
+            store.put(i, microcache.Entry(200, None, [], b"x" * 100, 0, 1, 10))
+            store.get(0, 0)
+        if store.size > 1000 or store.get(0, 0) is None or store.get(1, 0) is not None:
+            self.fail("the least recently used entries should be dropped")
+
+    def test_background_reload(self):
+
+        import tempfile, shutil, threading
+        from mod_python import autoreload
+
+        if autoreload.importlib is None:
+            return
+
+        d = tempfile.mkdtemp()
+        def write(name, source):
+            f = open(os.path.join(d, name + ".py"), "w")
+            f.write(source)
+            f.close()
+        write("mp_reload_a", "import mp_reload_b\nfrom mp_reload_b import V\n"
+              "def get_b():\n    import mp_reload_b\n    return mp_reload_b\n")
+        write("mp_reload_b", "V = 1\n")
+
+        sys.path.insert(0, d)
+        try:
+            import mp_reload_a, mp_reload_b
+            old_b = mp_reload_b
+
+            # the new b is loaded while requests still see the old one
+            write("mp_reload_b", "import sys\n"
+                  "assert sys.modules['mp_reload_b'].V == 1\nV = 2\n")
+            done, errors = [], []
+            finished = threading.Event()
+            def changed(module):
+                return module.__name__ == "mp_reload_b"
+            def reloaded(old, new):
+                done.append(new)
+                finished.set()
+            reloader = autoreload.BackgroundReloader(changed, reloaded, errors.append)
+            reloader.schedule("mp_reload_a")
+            finished.wait(10)
+
+            a, b = sys.modules["mp_reload_a"], sys.modules["mp_reload_b"]
+            if not done or done[0] is None or errors:
+                self.fail("reload failed: %s" % errors)
+            if b is old_b or a.mp_reload_b is not b or a.V != 2:
+                self.fail("the new a should use the new b")
+
+            # once loaded, the imports of its functions are the usual
+            sys.modules["mp_reload_b"] = old_b
+            if a.get_b() is not old_b:
+                self.fail("get_b() should import from sys.modules")
+            sys.modules["mp_reload_b"] = b
+
+            # a failed reload leaves everything as it was
+            write("mp_reload_b", "V = 3\nraise RuntimeError('broken')\n")
+            finished.clear()
+            reloader.schedule("mp_reload_a")
+            finished.wait(10)
+            if done[-1] is not None:
+                self.fail("the reload should have failed")
+            if sys.modules["mp_reload_a"] is not a or sys.modules["mp_reload_b"] is not b:
+                self.fail("a failed reload should not replace any module")
+        finally:
+            sys.path.remove(d)
+            sys.modules.pop("mp_reload_a", None)
+            sys.modules.pop("mp_reload_b", None)
+            shutil.rmtree(d)
+
+    def test_handler_cache_current(self):
+
+        import tempfile, shutil
+
+        if apache._autoreload_watch:
+            return
+
+        d = tempfile.mkdtemp()
+        filename = os.path.join(d, "mp_cached.py")
+        f = open(filename, "w")
+        f.write("def handler(req): pass\n")
+        f.close()
+
+        sys.path.insert(0, d)
+        import_module = apache.import_module
+        try:
+            module = import_module("mp_cached", log=1)
+            entry = apache._HandlerCacheEntry("mp_cached", module,
+                                              module.handler, False, True)
+
+            # a hit must not go through import_module()
+            def no_import(*args, **kw):
+                self.fail("is_current() called import_module()")
+            apache.import_module = no_import
+
+            module.__mtime_check__ = 0
+            if not entry.is_current(True):
+                self.fail("an unchanged module should be current")
+
+            t = os.path.getmtime(filename) + 10
+            os.utime(filename, (t, t))
+            if not entry.is_current(True):
+                self.fail("the mtime should be checked at most once a second")
+            module.__mtime_check__ = 0
+            if entry.is_current(True):
+                self.fail("a changed module should not be current")
+
+            # and import_module() sees the change as well
+            apache.import_module = import_module
+            if import_module("mp_cached", log=1).__mtime__ != t:
+                self.fail("the changed module was not reloaded")
+        finally:
+            apache.import_module = import_module
+            sys.path.remove(d)
+            sys.modules.pop("mp_cached", None)
+            shutil.rmtree(d)
+
+    def test_wsgi_find_app(self):
+
+        import tempfile, shutil
+        from mod_python import wsgi
+
+        d = tempfile.mkdtemp()
+        filename = os.path.join(d, "mp_wsgiapp.py")
+        def write(source):
+            f = open(filename, "w")
+            f.write(source)
+            f.close()
+        write("def application(env, start_response): return [b'1']\n"
+              "def other(env, start_response): return [b'2']\n")
+
+        sys.path.insert(0, d)
+        try:
+            req = self.req
+            app = wsgi._find_app(req, "mp_wsgiapp")
+            if app is None or app(None, None) != [b'1']:
+                self.fail("the application should have been found")
+            other = wsgi._find_app(req, "mp_wsgiapp::other")
+            if other is None or other(None, None) != [b'2']:
+                self.fail("mp_wsgiapp::other should have been found")
+            if wsgi._find_app(req, "mp_wsgiapp::missing") is not None:
+                self.fail("a missing callable should give None")
+
+            # the second lookup comes from the cache, not the module
+            module = sys.modules["mp_wsgiapp"]
+            module.application = None
+            if wsgi._find_app(req, "mp_wsgiapp") is not app:
+                self.fail("the application should have been cached")
+
+            # unless the module has been reloaded since
+            write("def application(env, start_response): return [b'3']\n")
+            t = os.path.getmtime(filename) + 10
+            os.utime(filename, (t, t))
+            module.__mtime_check__ = 0
+            app = wsgi._find_app(req, "mp_wsgiapp")
+            if app is None or app(None, None) != [b'3']:
+                self.fail("the reloaded application should have been found")
+        finally:
+            sys.path.remove(d)
+            sys.modules.pop("mp_wsgiapp", None)
+            for key in list(wsgi._app_cache):
+                if key[0].startswith("mp_wsgiapp"):
+                    del wsgi._app_cache[key]
+            shutil.rmtree(d)
+
+    def test_inotify_watcher(self):
+
+        import tempfile, shutil
+        from mod_python import autoreload
+
+        libc = autoreload._libc()
+        if libc is None:
+            return
+
+        class FullLibc(object):
+            # as if max_user_watches had been reached
+            def __init__(self, libc):
+                self.inotify_init1 = libc.inotify_init1
+            def inotify_add_watch(self, fd, path, mask):
+                return -1
+
+        def wait_dirty(watcher, filepath):
+            for i in range(50):
+                if watcher.changed(filepath):
+                    return True
+                time.sleep(0.1)
+            return False
+
+        d = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(d, "mp_watched.py")
+            open(filepath, "w").write("V = 1\n")
+
+            # a file that cannot be watched is polled
+            log = []
+            watcher = autoreload.InotifyWatcher(FullLibc(libc), 0.1, log.append)
+            watcher.start()
+            watcher.changed(filepath)
+            if not log or watcher.poller is None:
+                self.fail("the failed watch should be logged and polled")
+            time.sleep(1.1)
+            open(filepath, "w").write("V = 2\n")
+            if not wait_dirty(watcher, filepath):
+                self.fail("the change of a polled file was not noticed")
+
+            # when the inotify thread stops, the files are polled
+            log = []
+            watcher = autoreload.InotifyWatcher(libc, 0.1, log.append)
+            watcher.changed(filepath)
+            # the read of the thread fails
+            os.close(watcher.fd)
+            watcher.start()
+            for i in range(50):
+                if watcher.stopped:
+                    break
+                time.sleep(0.1)
+            if not watcher.stopped or not log:
+                self.fail("the stop of the inotify thread should be logged")
+            time.sleep(1.1)
+            open(filepath, "w").write("V = 3\n")
+            if not wait_dirty(watcher, filepath):
+                self.fail("the change was not noticed after the thread stopped")
+        finally:
+            shutil.rmtree(d)
+
 def make_suite(req):
 
     mpTestSuite = unittest.TestSuite()
@@ -595,6 +886,11 @@ def make_suite(req):
     mpTestSuite.addTest(SimpleTestCase("test_req_get_remote_host", req))
     mpTestSuite.addTest(SimpleTestCase("test_server_members", req))
     mpTestSuite.addTest(SimpleTestCase("test_connection_members", req))
+    mpTestSuite.addTest(SimpleTestCase("test_microcache_store", req))
+    mpTestSuite.addTest(SimpleTestCase("test_background_reload", req))
+    mpTestSuite.addTest(SimpleTestCase("test_handler_cache_current", req))
+    mpTestSuite.addTest(SimpleTestCase("test_wsgi_find_app", req))
+    mpTestSuite.addTest(SimpleTestCase("test_inotify_watcher", req))
     return mpTestSuite
 
 
@@ -916,6 +1212,34 @@ def req_sendfile3(req):
     os.remove(fname)
     return apache.OK
 
+def req_sendfile4(req):
+    """Send an open file object, some ranges of it and its descriptor.
+    """
+
+    import tempfile
+    f = tempfile.TemporaryFile()
+    f.write(b"0123456789"*100)
+    f.flush()
+
+    req.sendfile(f, [(2, 3), (998, 2)])
+    req.sendfile(f.fileno(), 990, 5)
+    f.close()
+    return apache.OK
+
+def req_sendfile_range(req):
+
+    import tempfile
+    from mod_python import util
+    f = tempfile.TemporaryFile()
+    f.write(b"0123456789"*100)
+    f.flush()
+
+    req.headers_out["ETag"] = '"range"'
+    try:
+        return util.send_file(req, f, "text/plain")
+    finally:
+        f.close()
+
 def req_handler(req):
     if req.phase == "PythonFixupHandler":
         req.handler = "mod_python"
@@ -1098,6 +1422,126 @@ def outputfilter(fltr):
 
     return apache.OK
 
+def bucketsfilter(fltr):
+
+    # the views are passed on without copying, only the "_" is new
+    for b in fltr.buckets():
+        if b == "EOS":
+            fltr.close()
+        elif b == "FLUSH":
+            fltr.flush()
+        else:
+            i = bytes(b).find(b" ")
+            if i < 0:
+                fltr.write(b)
+            else:
+                fltr.write(b[:i])
+                fltr.write(b"_")
+                fltr.write(b[i+1:])
+
+    return apache.OK
+
+def keptviewfilter(fltr):
+
+    # a view kept in filter.ctx is released when the filter returns,
+    # using it in a later call raises instead of reading freed memory
+    if fltr.ctx is None:
+        fltr.ctx = [None, []]
+    view, results = fltr.ctx
+    if view is not None:
+        try:
+            bytes(view)
+            results.append("kept")
+        except ValueError:
+            results.append("released")
+
+    for b in fltr.buckets():
+        if b == "EOS":
+            fltr.write(" " + ",".join(results))
+            fltr.close()
+        elif b == "FLUSH":
+            fltr.flush()
+        else:
+            fltr.write(b)
+            fltr.ctx[0] = b
+
+    return apache.OK
+
+def bufferfilter(fltr):
+
+    # large views are passed on as transient buckets, small ones copied
+    s = fltr.read()
+    while s:
+        fltr.write(memoryview(bytearray(s.upper())))
+        s = fltr.read()
+
+    if fltr.req.args == "raise":
+        # the buffer is held, but the brigade is never passed
+        fltr.write(memoryview(bytearray(b"!" * 20000)))
+        raise ValueError("bufferfilter")
+
+    if s is None:
+        fltr.write(memoryview(b"!" * 20000)[:3])
+        fltr.close()
+
+    return apache.OK
+
+def buffer_write_handler(req):
+
+    req.content_type = "text/plain"
+    req.write(bytearray(b"a" * 10), 0)
+    req.write(memoryview(b"b" * 20000), 0)
+    req.write(memoryview(bytearray(b"0123456789"))[2:7])
+    return apache.OK
+
+def ctxfilter(fltr):
+
+    # filter.ctx is kept from one call to the next
+    fltr.ctx = (fltr.ctx or 0) + 1
+
+    s = fltr.read()
+    while s:
+        fltr.write(s)
+        s = fltr.read()
+
+    if s is None:
+        fltr.write(" %d" % fltr.ctx)
+        fltr.close()
+
+    return apache.OK
+
+def ctxhandler(req):
+
+    for s in ("a", "b", "c"):
+        req.write(s, 1)
+
+    return apache.OK
+
+_microcache_count = [0]
+
+def microcache_handler(req):
+
+    # a different body every time the handler runs
+    _microcache_count[0] += 1
+    req.content_type = "text/plain"
+    if req.args == "nostore":
+        req.headers_out["Cache-Control"] = "no-store"
+    elif req.args == "cookie":
+        req.headers_out["Set-Cookie"] = "c=%d" % _microcache_count[0]
+    elif req.args == "vary":
+        req.headers_out["Vary"] = "Accept-Encoding"
+    req.write("%d %d" % (os.getpid(), _microcache_count[0]))
+
+    return apache.OK
+
+def decompress_handler(req):
+
+    body = req.read()
+    req.write("%s %d " % (req.headers_in.get("Content-Encoding"), len(body)))
+    req.write(body)
+
+    return apache.OK
+
 def simplehandler(req):
 
     if req.phase != "PythonHandler":
@@ -1107,6 +1551,14 @@ def simplehandler(req):
     req.write("test ok")
     return apache.OK
 
+def compress_filter(req):
+
+    req.content_type = "text/plain"
+    for i in range(100):
+        req.write("line %d of the compressed response\n" % i, i == 50)
+
+    return apache.OK
+
 def req_add_output_filter(req):
 
     req.add_output_filter("MP_TEST_FILTER")
@@ -1282,6 +1734,23 @@ def PythonOption_items(req):
     req.write(str(options))
     return apache.OK
 
+def wsgi_preload_test(req):
+
+    # only preload() imports it in this interpreter
+    if "wsgitest" in sys.modules:
+        req.write("test ok")
+    else:
+        req.log_error("wsgitest not found in sys.modules")
+        req.write("test failed")
+    return apache.OK
+
+def wsgi_env_duplicates(req):
+    # keys that appear more than once in subprocess_env
+    req.subprocess_env.add("MP_DUP", "1")
+    req.subprocess_env.add("MP_DUP", "2")
+    req.subprocess_env.add("mp_dup", "3")
+    return apache.OK
+
 def interpreter(req):
     req.write(req.interpreter)
     return apache.DONE
@@ -1538,6 +2007,35 @@ def _test_table():
 
     log("    _test_table test finished")
 
+def table_index_bench(req):
+
+    # compare lookups in tables with and without the index
+    import _apache
+    old = _apache._table_index_min()
+    try:
+        for n in (20, 100, 500):
+            t = apache.table()
+            for i in range(n):
+                t['X-Header-%d' % i] = str(i)
+            keys = ['x-header-%d' % i for i in range(0, n, max(n // 10, 1))]
+            times, results = [], []
+            for index_min in (0, 16):
+                _apache._table_index_min(index_min)
+                found = [t[k] for k in keys]
+                start = time.time()
+                for x in range(1000):
+                    for k in keys:
+                        t[k]
+                times.append((time.time() - start) / (1000. * len(keys)))
+                results.append(found)
+            if results[0] != results[1]:
+                req.write("%d mismatch\n" % n)
+            req.write("%d %.3f %.3f\n" % (n, times[0] * 1e6, times[1] * 1e6))
+    finally:
+        _apache._table_index_min(old)
+
+    return apache.OK
+
 def okay(req):
     req.write("test ok")
     return apache.OK
@@ -1563,3 +2061,126 @@ def memory(req):
     req.write("|%s|%s" % (before[0], after[0]))
 
     return apache.OK
+
+def handler_cache(req):
+
+    stats = apache.handler_cache_stats()
+    req.write("%(hits)d|%(misses)d|%(entries)d" % stats)
+
+    return apache.OK
+
+def dispatch_stats_fixup(req):
+
+    return apache.OK
+
+def dispatch_stats(req):
+
+    # what was recorded before this handler was called, per phase
+    # and handler the number of requests in each stage
+    if req.args == "reset":
+        apache.stats(reset=True)
+    result = []
+    for (phase, handler), stages in sorted(apache.stats().items()):
+        if not handler.startswith("tests::dispatch_stats"):
+            continue
+        counts = []
+        for stage in ("interpreter", "resolve", "handler"):
+            h = stages.get(stage)
+            if h is None:
+                counts.append("0")
+            elif sum(h["counts"]) != h["count"] or h["max"] > h["sum"]:
+                counts.append("bad")
+            else:
+                counts.append(str(h["count"]))
+        result.append("%s %s %s" % (phase, handler, "/".join(counts)))
+    req.write(";".join(result))
+
+    return apache.OK
+
+def profile_sampled(req):
+
+    # whether an earlier request has been profiled in this interpreter
+    req.write(str(apache.profile_stats("tests::profile_sampled") is not None))
+
+    return apache.OK
+
+def watchdog_nested(req):
+
+    if req.args == "count":
+        req.write(str(apache.slow_requests().get("tests::watchdog_nested", 0)))
+    elif req.args == "inner":
+        req.write("inner")
+    else:
+        req.internal_redirect(req.uri + "?inner")
+        # the inner dispatch is over, this one goes on for longer
+        # than mod_python.watchdog.threshold
+        time.sleep(3.5)
+
+    return apache.OK
+
+def req_readinto(req):
+
+    # the first line goes through the readline buffer
+    req.write(req.readline())
+
+    buf = bytearray(1000)
+    view = memoryview(buf)
+    n = req.readinto(view)
+    while n:
+        req.write(bytes(view[:n]), 0)
+        n = req.readinto(view)
+
+    return apache.OK
+
+def req_iter_body(req):
+
+    sizes = set()
+    for chunk in req.iter_body(4096):
+        sizes.add(len(chunk))
+        req.write(chunk, 0)
+
+    if max(sizes) > 4096:
+        req.write("chunk too big")
+
+    return apache.OK
+
+def req_set_buffering(req):
+
+    req.content_type = "text/plain"
+    for c in "test ok":
+        req.write(c)
+
+    return apache.OK
+
+def req_set_buffering_phase_fixup(req):
+
+    try:
+        req.set_buffering(1)
+    except ValueError:
+        req.notes["set_buffering"] = "ValueError"
+    else:
+        req.notes["set_buffering"] = "no error"
+
+    return apache.OK
+
+def req_set_buffering_phase(req):
+
+    req.content_type = "text/plain"
+    req.write(req.notes["set_buffering"])
+
+    return apache.OK
+
+def req_set_buffering_error(req):
+
+    req.content_type = "text/plain"
+    req.write("partial output")
+    raise ValueError("buffered error")
+
+def req_write_flush(req):
+
+    for i in range(10):
+        req.write("x" * 1000)
+    flushes = req.flushes
+    req.write(" %d" % flushes, 0)
+
+    return apache.OK
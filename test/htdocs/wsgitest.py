@@ -1,4 +1,5 @@
 
+import os
 import sys
 
 def application(env, start_response):
@@ -51,3 +52,33 @@ def base_uri(env, start_response):
    return [output]
 
 
+
+def chunks(env, start_response):
+   start_response('200 OK', [('Content-type', 'text/plain')])
+   for c in "test ok\n":
+      yield c.encode('latin1')
+
+def buffer_types(env, start_response):
+   start_response('200 OK', [('Content-type', 'text/plain')])
+   if env.get('QUERY_STRING') == 'str':
+      return ['test fail\n']
+   return [b'test', bytearray(b' '), memoryview(b'ok\n')]
+
+def file_wrapper(env, start_response):
+   start_response('200 OK', [('Content-type', 'text/plain')])
+   f = open(os.path.join(os.path.dirname(__file__), 'index.py'), 'rb')
+   f.seek(10)
+   return env['wsgi.file_wrapper'](f, 8192, 100)
+
+def file_wrapper_tempfile(env, start_response):
+   import tempfile
+   start_response('200 OK', [('Content-type', 'text/plain')])
+   # unlinked, only the descriptor can be sent
+   f = tempfile.TemporaryFile()
+   f.write(b'0123456789' * 10)
+   f.seek(5)
+   return env['wsgi.file_wrapper'](f, 8192, 20)
+
+def env_duplicates(env, start_response):
+   start_response('200 OK', [('Content-type', 'text/plain')])
+   return [('%s|%s' % (env['MP_DUP'], env['mp_dup'])).encode('latin1')]
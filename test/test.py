@@ -359,6 +359,7 @@ class HttpdCtrl:
             Timeout(60),
             PythonOption('mod_python.mutex_directory %s' % TMP_DIR),
             PythonOption('PythonOptionTest sample_value'),
+            PythonOption('mod_python.watchdog.threshold 2'),
             DocumentRoot(DOCUMENT_ROOT),
             LoadModule("python_module %s" % quote_if_space(MOD_PYTHON_SO)))
 
@@ -1277,6 +1278,115 @@ class PerRequestTestCase(unittest.TestCase):
         else:
             print("\n  * Skipping req.sendfile() for a file which is a symbolic link")
 
+    def test_req_sendfile4_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_req_sendfile4"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("tests::req_sendfile4"),
+                                  PythonDebug("On")))
+
+        return c
+
+    def test_req_sendfile4(self):
+
+        print("\n  * Testing req.sendfile() with a file object, a descriptor and ranges")
+
+        rsp = self.vhost_get("test_req_sendfile4")
+
+        if (rsp != "2348901234"):
+            self.fail(repr(rsp))
+
+    def test_util_send_file_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_util_send_file"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("tests::req_sendfile_range"),
+                                  PythonDebug("On")))
+
+        return c
+
+    def test_util_send_file(self):
+
+        print("\n  * Testing util.send_file() with Range requests")
+
+        def get(headers):
+            conn = http_connection("127.0.0.1:%s" % PORT)
+            conn.putrequest("GET", "/tests.py", skip_host=1)
+            conn.putheader("Host", "%s:%s" % ("test_util_send_file", PORT))
+            for name, value in headers:
+                conn.putheader(name, value)
+            conn.endheaders()
+            response = conn.getresponse()
+            body = response.read()
+            conn.close()
+            return response, body
+
+        response, body = get([])
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader("Accept-Ranges"), "bytes")
+        self.assertEqual(body, b"0123456789"*100)
+
+        response, body = get([("Range", "bytes=10-14")])
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.getheader("Content-Range"), "bytes 10-14/1000")
+        self.assertEqual(body, b"01234")
+
+        response, body = get([("Range", "bytes=0-1,-3")])
+        self.assertEqual(response.status, 206)
+        ctype = response.getheader("Content-Type")
+        self.assertTrue(ctype.startswith("multipart/byteranges; boundary="), ctype)
+        self.assertEqual(int(response.getheader("Content-Length")), len(body))
+        self.assertTrue(b"Content-Range: bytes 0-1/1000\r\n\r\n01\r\n" in body, repr(body))
+        self.assertTrue(b"Content-Range: bytes 997-999/1000\r\n\r\n789\r\n" in body, repr(body))
+
+        response, body = get([("Range", "bytes=5-9,0-4,3-6")])
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.getheader("Content-Range"), "bytes 0-9/1000")
+        self.assertEqual(body, b"0123456789")
+
+        response, body = get([("Range", "bytes=" + ",".join(["%d-%d" % (i, i) for i in range(0, 1000, 2)]))])
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len(body), 1000)
+
+        response, body = get([("Range", "bytes=2000-")])
+        self.assertEqual(response.status, 416)
+        self.assertEqual(response.getheader("Content-Range"), "bytes */1000")
+
+        response, body = get([("Range", "bytes=10-14"), ("If-Range", '"stale"')])
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len(body), 1000)
+
+    def test_table_index_bench_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_table_index_bench"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("tests::table_index_bench"),
+                                  PythonDebug("On")))
+
+        return c
+
+    def test_table_index_bench(self):
+
+        print("\n  * Benchmarking mp_table lookups, scanned vs indexed (usec per lookup)")
+
+        rsp = self.vhost_get("test_table_index_bench")
+
+        if "mismatch" in rsp or len(rsp.splitlines()) != 3:
+            self.fail(repr(rsp))
+
+        for line in rsp.splitlines():
+            n, scan, index = line.split()
+            print("      %4s entries: %8s %8s" % (n, scan, index))
+
     def test_req_handler_conf(self):
 
         c = VirtualHost("*",
@@ -1799,6 +1909,41 @@ class PerRequestTestCase(unittest.TestCase):
             rsp != b"[Field(b'spam', b'1'), Field(b'spam', b'2'), Field(b'eggs', b'3'), Field(b'bacon', b'4')]"):
             self.fail(repr(rsp))
 
+    def test_decompress_filter_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_decompress_filter"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        SetHandler("mod_python"),
+                        PythonPath("[r'%s']+sys.path" % DOCUMENT_ROOT),
+                        PythonFixupHandler("mod_python.filters.decompress"),
+                        PythonHandler("tests::decompress_handler"),
+                        PythonDebug("On"))
+        return c
+
+    def test_decompress_filter(self):
+
+        print("\n  * Testing mod_python.filters.decompress")
+
+        import zlib
+        body = b"".join([b"line %d of the request body\n" % i for i in range(10000)])
+
+        for encoding, wbits in (("gzip", 31), ("deflate", 15)):
+            zobj = zlib.compressobj(6, zlib.DEFLATED, wbits)
+            data = zobj.compress(body) + zobj.flush()
+            headers = {"Host": "test_decompress_filter",
+                       "Content-Type": "text/plain",
+                       "Content-Encoding": encoding}
+            conn = http_connection("127.0.0.1:%s" % PORT)
+            conn.request("POST", "/tests.py", data, headers)
+            response = conn.getresponse()
+            rsp = response.read()
+            conn.close()
+
+            # the handler reads the whole body, decompressed
+            if rsp != b"None %d " % len(body) + body:
+                self.fail(repr(rsp[:100]))
+
     def test_postreadrequest_conf(self):
 
         c = VirtualHost("*",
@@ -1881,6 +2026,288 @@ class PerRequestTestCase(unittest.TestCase):
         if (rsp != "TEST OK"):
             self.fail(repr(rsp))
 
+    def test_buffer_write_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_buffer_write"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        SetHandler("mod_python"),
+                        PythonPath("[r'%s']+sys.path" % DOCUMENT_ROOT),
+                        PythonHandler("tests::buffer_write_handler"),
+                        PythonOutputFilter("tests::bufferfilter MP_TEST_FILTER"),
+                        PythonDebug("Off"),
+                        AddOutputFilter("MP_TEST_FILTER .py"))
+        return c
+
+    def test_buffer_write(self):
+
+        print("\n  * Testing req.write() and filter.write() with buffer objects")
+
+        # the filter raises with a view held, that must not crash the child
+        try:
+            self.vhost_get("test_buffer_write", path="/tests.py?raise")
+        except Exception:
+            pass
+
+        rsp = self.vhost_get("test_buffer_write")
+
+        if rsp != "A" * 10 + "B" * 20000 + "23456" + "!!!":
+            self.fail(repr(rsp[:40]) + "..." + repr(rsp[-40:]))
+
+    def test_filter_buckets_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_filter_buckets"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        SetHandler("mod_python"),
+                        PythonPath("[r'%s']+sys.path" % DOCUMENT_ROOT),
+                        PythonHandler("tests::simplehandler"),
+                        PythonOutputFilter("tests::bucketsfilter MP_TEST_FILTER"),
+                        PythonDebug("On"),
+                        AddOutputFilter("MP_TEST_FILTER .py"))
+        return c
+
+    def test_filter_buckets(self):
+
+        print("\n  * Testing filter.buckets()")
+        rsp = self.vhost_get("test_filter_buckets")
+
+        if (rsp != "test_ok"):
+            self.fail(repr(rsp))
+
+    def test_filter_buckets_kept_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_filter_buckets_kept"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        SetHandler("mod_python"),
+                        PythonPath("[r'%s']+sys.path" % DOCUMENT_ROOT),
+                        PythonHandler("tests::ctxhandler"),
+                        PythonOutputFilter("tests::keptviewfilter MP_TEST_FILTER"),
+                        PythonDebug("On"),
+                        AddOutputFilter("MP_TEST_FILTER .py"))
+        return c
+
+    def test_filter_buckets_kept(self):
+
+        print("\n  * Testing filter.buckets() views kept in filter.ctx")
+        rsp = self.vhost_get("test_filter_buckets_kept")
+
+        # each call after the first finds the view of the last one
+        # released
+        body, results = rsp.split(" ")
+        results = results.split(",")
+        if body != "abc" or len(results) < 2 or set(results) != set(["released"]):
+            self.fail(repr(rsp))
+
+    def test_filter_ctx_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_filter_ctx"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        SetHandler("mod_python"),
+                        PythonPath("[r'%s']+sys.path" % DOCUMENT_ROOT),
+                        PythonHandler("tests::ctxhandler"),
+                        PythonOutputFilter("tests::ctxfilter MP_TEST_FILTER"),
+                        PythonDebug("On"),
+                        AddOutputFilter("MP_TEST_FILTER .py"))
+        return c
+
+    def test_filter_ctx(self):
+
+        print("\n  * Testing filter.ctx")
+        rsp = self.vhost_get("test_filter_ctx")
+
+        # one call per flushed write at least
+        body, calls = rsp.split(" ")
+        if body != "abc" or int(calls) < 3:
+            self.fail(repr(rsp))
+
+    def test_compress_filter_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_compress_filter"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        SetHandler("mod_python"),
+                        PythonPath("[r'%s']+sys.path" % DOCUMENT_ROOT),
+                        PythonHandler("tests::compress_filter"),
+                        PythonOutputFilter("mod_python.filters.compress COMPRESS"),
+                        PythonDebug("On"),
+                        AddOutputFilter("COMPRESS .py"))
+        return c
+
+    def test_compress_filter(self):
+
+        print("\n  * Testing mod_python.filters.compress")
+
+        import zlib
+        expected = "".join(["line %d of the compressed response\n" % i
+                            for i in range(100)]).encode()
+
+        for encoding, wbits in (("gzip", 31), ("deflate", 15), (None, None)):
+            conn = http_connection("127.0.0.1:%s" % PORT)
+            conn.putrequest("GET", "/tests.py", skip_host=1)
+            conn.putheader("Host", "%s:%s" % ("test_compress_filter", PORT))
+            if encoding:
+                conn.putheader("Accept-Encoding", "%s, identity;q=0.5" % encoding)
+            conn.endheaders()
+            response = conn.getresponse()
+            body = response.read()
+            conn.close()
+
+            self.assertEqual(response.getheader("Content-Encoding"), encoding)
+            self.assertEqual(response.getheader("Vary"), "Accept-Encoding")
+            if encoding:
+                # one stream for the whole response
+                body = zlib.decompress(body, wbits)
+            self.assertEqual(body, expected)
+
+    def test_microcache_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_microcache"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        SetHandler("mod_python"),
+                        PythonPath("[r'%s']+sys.path" % DOCUMENT_ROOT),
+                        PythonFixupHandler("mod_python.filters.microcache"),
+                        PythonHandler("tests::microcache_handler"),
+                        PythonOutputFilter("mod_python.filters.microcache MICROCACHE"),
+                        PythonOption("mod_python.microcache.ttl 60"),
+                        PythonDebug("On"),
+                        AddOutputFilter("MICROCACHE .py"))
+        return c
+
+    def test_microcache(self):
+
+        print("\n  * Testing mod_python.filters.microcache")
+
+        # one connection, so that both requests go to the same process
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        rsps = []
+        for query in ("", "", "?other"):
+            conn.putrequest("GET", "/tests.py" + query, skip_host=1)
+            conn.putheader("Host", "%s:%s" % ("test_microcache", PORT))
+            conn.endheaders()
+            response = conn.getresponse()
+            rsps.append((response.read(), response.getheader("Age")))
+        conn.close()
+
+        # the second response is the cached first one
+        self.assertEqual(rsps[0][1], None)
+        self.assertEqual(rsps[1][0], rsps[0][0])
+        self.assertNotEqual(rsps[1][1], None)
+        self.assertNotEqual(rsps[2][0], rsps[0][0])
+
+    def test_microcache_refuse_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_microcache_refuse"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        SetHandler("mod_python"),
+                        PythonPath("[r'%s']+sys.path" % DOCUMENT_ROOT),
+                        PythonFixupHandler("mod_python.filters.microcache"),
+                        PythonHandler("tests::microcache_handler"),
+                        PythonOutputFilter("mod_python.filters.microcache MICROCACHE"),
+                        PythonOption("mod_python.microcache.ttl 60"),
+                        PythonDebug("On"),
+                        AddOutputFilter("MICROCACHE .py"))
+        return c
+
+    def test_microcache_refuse(self):
+
+        print("\n  * Testing mod_python.filters.microcache refusing responses")
+
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        for query in ("?nostore", "?cookie", "?vary"):
+            rsps = []
+            for i in range(2):
+                conn.putrequest("GET", "/tests.py" + query, skip_host=1)
+                conn.putheader("Host", "%s:%s" % ("test_microcache_refuse", PORT))
+                conn.endheaders()
+                response = conn.getresponse()
+                rsps.append((response.read(), response.getheader("Age")))
+
+            # the handler ran both times
+            self.assertEqual(rsps[1][1], None, query)
+            self.assertNotEqual(rsps[1][0], rsps[0][0], query)
+        conn.close()
+
+    def test_microcache_cookie_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_microcache_cookie"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        SetHandler("mod_python"),
+                        PythonPath("[r'%s']+sys.path" % DOCUMENT_ROOT),
+                        PythonFixupHandler("mod_python.filters.microcache"),
+                        PythonHandler("tests::microcache_handler"),
+                        PythonOutputFilter("mod_python.filters.microcache MICROCACHE"),
+                        PythonOption("mod_python.microcache.ttl 60"),
+                        PythonDebug("On"),
+                        AddOutputFilter("MICROCACHE .py"))
+        return c
+
+    def test_microcache_cookie(self):
+
+        print("\n  * Testing mod_python.filters.microcache with cookies")
+
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        rsps = []
+        for cookie in ("sid=a", "sid=b", "sid=a"):
+            conn.putrequest("GET", "/tests.py", skip_host=1)
+            conn.putheader("Host", "%s:%s" % ("test_microcache_cookie", PORT))
+            conn.putheader("Cookie", cookie)
+            conn.endheaders()
+            response = conn.getresponse()
+            rsps.append((response.read(), response.getheader("Age")))
+        conn.close()
+
+        # Cookie is not in mod_python.microcache.vary, nothing is shared
+        for body, age in rsps:
+            self.assertEqual(age, None)
+        self.assertNotEqual(rsps[1][0], rsps[0][0])
+        self.assertNotEqual(rsps[2][0], rsps[0][0])
+
+    def test_microcache_expire_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_microcache_expire"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        SetHandler("mod_python"),
+                        PythonPath("[r'%s']+sys.path" % DOCUMENT_ROOT),
+                        PythonFixupHandler("mod_python.filters.microcache"),
+                        PythonHandler("tests::microcache_handler"),
+                        PythonOutputFilter("mod_python.filters.microcache MICROCACHE"),
+                        PythonOption("mod_python.microcache.ttl 1"),
+                        PythonOption("mod_python.microcache.stale 60"),
+                        PythonDebug("On"),
+                        AddOutputFilter("MICROCACHE .py"))
+        return c
+
+    def test_microcache_expire(self):
+
+        print("\n  * Testing mod_python.filters.microcache expiry")
+
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        def get():
+            conn.putrequest("GET", "/tests.py", skip_host=1)
+            conn.putheader("Host", "%s:%s" % ("test_microcache_expire", PORT))
+            conn.endheaders()
+            response = conn.getresponse()
+            return response.read(), response.getheader("Age")
+
+        first = get()
+        time.sleep(1.5)
+        # expired: this one goes through and refreshes the response
+        refreshed = get()
+        again = get()
+        conn.close()
+
+        self.assertEqual(refreshed[1], None)
+        self.assertNotEqual(refreshed[0], first[0])
+        self.assertEqual(again[0], refreshed[0])
+        self.assertNotEqual(again[1], None)
+
     def test_req_add_output_filter_conf(self):
 
         c = VirtualHost("*",
@@ -2814,6 +3241,28 @@ class PerRequestTestCase(unittest.TestCase):
         if (rsp != "test ok"):
             self.fail(repr(rsp))
 
+    def test_ssi_code_cache_conf(self):
+        c = VirtualHost("*",
+                        ServerName("test_ssi_code_cache"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  Options("+Includes"),
+                                  AddType("text/html .shtml"),
+                                  AddOutputFilter("INCLUDES .shtml"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_ssi_code_cache(self):
+
+        print("\n  * Testing the code cache of server side includes")
+
+        # each tag of the page is compiled once, however many times
+        # the page is served
+        for i in range(3):
+            rsp = self.vhost_get("test_ssi_code_cache", path="/ssi_cache.shtml")
+            if rsp.strip() != "2":
+                self.fail(repr(rsp))
+
     def test_memory_conf(self):
 
         c = VirtualHost("*",
@@ -2841,6 +3290,571 @@ class PerRequestTestCase(unittest.TestCase):
         if before != after:
             self.fail("Memory before: %s, memory after: %s" % (before, after))
 
+    def test_handler_cache_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_handler_cache"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("tests::handler_cache"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_handler_cache(self):
+
+        print("\n  * Testing HandlerDispatch handler cache")
+
+        # there may be more than one child process, so make
+        # enough requests for at least one of them to hit
+        for i in range(10):
+            rsp = self.vhost_get("test_handler_cache")
+            hits, misses, entries = list(map(int, rsp.split("|")))
+            if hits > 0:
+                break
+
+        if hits == 0 or entries != 1:
+            self.fail(repr(rsp))
+
+    def test_dispatch_stats_conf(self):
+
+        c = Container(PythonOption("mod_python.dispatch_stats On"),
+                      VirtualHost("*",
+                                  ServerName("test_dispatch_stats"),
+                                  DocumentRoot(DOCUMENT_ROOT),
+                                  Directory(DOCUMENT_ROOT,
+                                            SetHandler("mod_python"),
+                                            PythonFixupHandler("tests::dispatch_stats_fixup"),
+                                            PythonHandler("tests::dispatch_stats"),
+                                            PythonDebug("On"))))
+        return c
+
+    def test_dispatch_stats(self):
+
+        print("\n  * Testing apache.stats()")
+
+        # one connection, so that all requests go to the same process
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        rsps = []
+        for query in ("?reset", "", ""):
+            conn.putrequest("GET", "/tests.py" + query, skip_host=1)
+            conn.putheader("Host", "%s:%s" % ("test_dispatch_stats", PORT))
+            conn.endheaders()
+            response = conn.getresponse()
+            rsps.append(response.read().decode("latin1"))
+        conn.close()
+
+        # the handler stage of a request is recorded after the handler
+        # has seen the stats, the other ones before
+        fixup = "PythonFixupHandler tests::dispatch_stats_fixup %s"
+        handler = "PythonHandler tests::dispatch_stats %s"
+        self.assertEqual(rsps[0], "")
+        self.assertEqual(rsps[1], ";".join([fixup % "1/1/1", handler % "1/1/1"]))
+        self.assertEqual(rsps[2], ";".join([fixup % "2/2/2", handler % "2/2/2"]))
+
+    def test_profile_sample_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_profile_sample"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("tests::profile_sampled"),
+                                  PythonOption("mod_python.profile.sample 2"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_profile_sample(self):
+
+        print("\n  * Testing mod_python.profile.sample")
+
+        # one connection, so that all requests go to the same process
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        rsps = []
+        for i in range(4):
+            conn.putrequest("GET", "/tests.py", skip_host=1)
+            conn.putheader("Host", "%s:%s" % ("test_profile_sample", PORT))
+            conn.endheaders()
+            response = conn.getresponse()
+            rsps.append(response.read())
+        conn.close()
+
+        # one of the first two requests was profiled
+        if rsps[0] != b"False" or rsps[3] != b"True":
+            self.fail(repr(rsps))
+
+    def test_profile_sample_off_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_profile_sample_off"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("tests::profile_sampled"),
+                                  PythonOption("mod_python.profile.sample 0"),
+                                  PythonOption("mod_python.profile.uri_prefix /"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_profile_sample_off(self):
+
+        print("\n  * Testing mod_python.profile.sample 0")
+
+        for i in range(2):
+            rsp = self.vhost_get("test_profile_sample_off")
+            if rsp != "False":
+                self.fail(repr(rsp))
+
+    def test_watchdog_nested_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_watchdog_nested"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("tests::watchdog_nested"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_watchdog_nested(self):
+
+        print("\n  * Testing the watchdog with a nested dispatch")
+
+        # one connection, so that both requests go to the same process
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        rsps = []
+        for query in ("", "?count"):
+            conn.putrequest("GET", "/tests.py" + query, skip_host=1)
+            conn.putheader("Host", "%s:%s" % ("test_watchdog_nested", PORT))
+            conn.endheaders()
+            response = conn.getresponse()
+            rsps.append(response.read())
+        conn.close()
+
+        # the outer handler outlived the threshold after the inner one
+        # (an internal redirect) had finished
+        if rsps[0] != b"inner" or rsps[1] != b"1":
+            self.fail(repr(rsps))
+
+    def test_async_handler_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_async_handler"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("async_tests"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_async_handler(self):
+
+        print("\n  * Testing async def handler")
+
+        if PY2:
+            print("    (skipped, Python 2)")
+            return
+
+        t = time.time()
+        rsp = self.vhost_get("test_async_handler")
+        elapsed = time.time() - t
+
+        if rsp != "test ok 10":
+            self.fail(repr(rsp))
+        if elapsed >= 2.5:
+            self.fail("coroutines did not run concurrently (%.1f seconds)" % elapsed)
+
+    def test_wsgihandler_buffered_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_wsgihandler_buffered"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("mod_python.wsgi"),
+                                  PythonOption("mod_python.wsgi.application wsgitest::chunks"),
+                                  PythonOption("mod_python.wsgi.buffer_size 65536"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_wsgihandler_buffered(self):
+
+        print("\n  * Testing mod_python.wsgi output buffering")
+
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        conn.putrequest("GET", "/tests.py", skip_host=1)
+        conn.putheader("Host", "%s:%s" % ("test_wsgihandler_buffered", PORT))
+        conn.endheaders()
+        response = conn.getresponse()
+        rsp = response.read()
+        conn.close()
+
+        if rsp != b"test ok\n":
+            self.fail(repr(rsp))
+
+        if response.getheader("content-length", None) != "8":
+            self.fail(repr(response.getheader("content-length", None)))
+
+    def test_wsgihandler_buffer_types_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_wsgihandler_buffer_types"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("mod_python.wsgi"),
+                                  PythonOption("mod_python.wsgi.application wsgitest::buffer_types"),
+                                  PythonOption("mod_python.wsgi.buffer_size 65536"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_wsgihandler_buffer_types(self):
+
+        print("\n  * Testing mod_python.wsgi output buffering of bytes-like chunks")
+
+        rsp = self.vhost_get("test_wsgihandler_buffer_types")
+        if rsp != "test ok\n":
+            self.fail(repr(rsp))
+
+        # str is not allowed by PEP 3333
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        conn.putrequest("GET", "/tests.py?str", skip_host=1)
+        conn.putheader("Host", "%s:%s" % ("test_wsgihandler_buffer_types", PORT))
+        conn.endheaders()
+        response = conn.getresponse()
+        rsp = response.read()
+        conn.close()
+
+        if response.status != 500 or b"TypeError" not in rsp:
+            self.fail("%s %r" % (response.status, rsp))
+
+    def test_wsgihandler_file_wrapper_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_wsgihandler_file_wrapper"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("mod_python.wsgi"),
+                                  PythonOption("mod_python.wsgi.application wsgitest::file_wrapper"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_wsgihandler_file_wrapper(self):
+
+        print("\n  * Testing mod_python.wsgi wsgi.file_wrapper")
+
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        conn.putrequest("GET", "/tests.py", skip_host=1)
+        conn.putheader("Host", "%s:%s" % ("test_wsgihandler_file_wrapper", PORT))
+        conn.endheaders()
+        response = conn.getresponse()
+        rsp = response.read()
+        conn.close()
+
+        expected = open(os.path.join(DOCUMENT_ROOT, "index.py"), "rb").read()[10:110]
+        if rsp != expected:
+            self.fail(repr(rsp))
+
+        if response.getheader("content-length", None) != "100":
+            self.fail(repr(response.getheader("content-length", None)))
+
+    def test_wsgihandler_file_wrapper_tempfile_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_wsgihandler_file_wrapper_tempfile"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("mod_python.wsgi"),
+                                  PythonOption("mod_python.wsgi.application wsgitest::file_wrapper_tempfile"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_wsgihandler_file_wrapper_tempfile(self):
+
+        print("\n  * Testing mod_python.wsgi wsgi.file_wrapper with a temporary file")
+
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        conn.putrequest("GET", "/tests.py", skip_host=1)
+        conn.putheader("Host", "%s:%s" % ("test_wsgihandler_file_wrapper_tempfile", PORT))
+        conn.endheaders()
+        response = conn.getresponse()
+        rsp = response.read()
+        conn.close()
+
+        if rsp != b"56789012345678901234":
+            self.fail(repr(rsp))
+
+        if response.getheader("content-length", None) != "20":
+            self.fail(repr(response.getheader("content-length", None)))
+
+    def test_wsgihandler_preload_conf(self):
+
+        c = Container(PythonPath("[r'%s']+sys.path" % DOCUMENT_ROOT),
+                      PythonOption("mod_python.wsgi.preload wsgitest::chunks"),
+                      PythonImport("mod_python.wsgi::preload test_wsgihandler_preload"),
+                      VirtualHost("*",
+                                  ServerName("test_wsgihandler_preload"),
+                                  DocumentRoot(DOCUMENT_ROOT),
+                                  Directory(DOCUMENT_ROOT,
+                                            SetHandler("mod_python"),
+                                            PythonHandler("tests::wsgi_preload_test"),
+                                            PythonDebug("On"))))
+        return c
+
+    def test_wsgihandler_preload(self):
+
+        print("\n  * Testing mod_python.wsgi preload")
+
+        rsp = self.vhost_get("test_wsgihandler_preload")
+        if rsp != "test ok":
+            self.fail(repr(rsp))
+
+        time.sleep(0.1)
+        log = open(os.path.join(SERVER_ROOT, "logs/error_log")).read()
+        if "WSGI preload: wsgitest::chunks loaded" not in log:
+            self.fail("preload did not log loading wsgitest::chunks")
+
+    def test_wsgihandler_env_duplicates_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_wsgihandler_env_duplicates"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonFixupHandler("tests::wsgi_env_duplicates"),
+                                  PythonHandler("mod_python.wsgi"),
+                                  PythonOption("mod_python.wsgi.application wsgitest::env_duplicates"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_wsgihandler_env_duplicates(self):
+
+        print("\n  * Testing mod_python.wsgi environ with duplicate keys")
+
+        # as with req.subprocess_env, all the values of a key that
+        # is there more than once, whatever the case of the key
+        rsp = self.vhost_get("test_wsgihandler_env_duplicates")
+        if rsp != "['1', '2', '3']|['1', '2', '3']":
+            self.fail(repr(rsp))
+
+    def test_asgihandler_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_asgihandler"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("mod_python.asgi"),
+                                  PythonOption("mod_python.asgi.application async_tests::asgi_app"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_asgihandler(self):
+
+        print("\n  * Testing mod_python.asgi")
+
+        if sys.version_info < (3, 5):
+            print("    (skipped, needs Python 3.5)")
+            return
+
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        conn.putrequest("POST", "/tests.py", skip_host=1)
+        conn.putheader("Host", "%s:%s" % ("test_asgihandler", PORT))
+        conn.putheader("Content-Length", "2")
+        conn.endheaders()
+        conn.send(b"ok")
+        response = conn.getresponse()
+        rsp = response.read()
+        conn.close()
+
+        if rsp != b"test ok":
+            self.fail(repr(rsp))
+
+    def test_req_readinto_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_req_readinto"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("tests::req_readinto"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_req_readinto(self):
+
+        print("\n  * Testing req.readinto()")
+
+        params = b'first line\n' + b'1234567890'*10000
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        conn.putrequest("POST", "/tests.py", skip_host=1)
+        conn.putheader("Host", "test_req_readinto:%s" % PORT)
+        conn.putheader("Content-Length", str(len(params)))
+        conn.endheaders()
+        conn.send(params)
+        response = conn.getresponse()
+        rsp = response.read()
+        conn.close()
+
+        if (rsp != params):
+            self.fail(repr(rsp[:100]))
+
+    def test_req_iter_body_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_req_iter_body"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("tests::req_iter_body"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_req_iter_body(self):
+
+        print("\n  * Testing req.iter_body()")
+
+        params = b'1234567890'*10000
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        conn.putrequest("POST", "/tests.py", skip_host=1)
+        conn.putheader("Host", "test_req_iter_body:%s" % PORT)
+        conn.putheader("Content-Length", str(len(params)))
+        conn.endheaders()
+        conn.send(params)
+        response = conn.getresponse()
+        rsp = response.read()
+        conn.close()
+
+        if (rsp != params):
+            self.fail(repr(rsp[:100]))
+
+    def test_req_set_buffering_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_req_set_buffering"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("tests::req_set_buffering"),
+                                  PythonOption("mod_python.buffering ETag"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_req_set_buffering(self):
+
+        print("\n  * Testing mod_python.buffering")
+
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        conn.putrequest("GET", "/tests.py", skip_host=1)
+        conn.putheader("Host", "%s:%s" % ("test_req_set_buffering", PORT))
+        conn.endheaders()
+        response = conn.getresponse()
+        rsp = response.read()
+        conn.close()
+
+        if rsp != b"test ok":
+            self.fail(repr(rsp))
+        if response.getheader("content-length", None) != "7":
+            self.fail(repr(response.getheader("content-length", None)))
+        etag = response.getheader("etag", None)
+        if not etag:
+            self.fail("no ETag")
+
+        # a conditional request gets a 304
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        conn.putrequest("GET", "/tests.py", skip_host=1)
+        conn.putheader("Host", "%s:%s" % ("test_req_set_buffering", PORT))
+        conn.putheader("If-None-Match", etag)
+        conn.endheaders()
+        response = conn.getresponse()
+        rsp = response.read()
+        conn.close()
+
+        if response.status != 304 or rsp:
+            self.fail("%d %s" % (response.status, repr(rsp)))
+
+    def test_req_set_buffering_error_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_req_set_buffering_error"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("tests::req_set_buffering_error"),
+                                  PythonOption("mod_python.buffering On"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_req_set_buffering_error(self):
+
+        print("\n  * Testing mod_python.buffering with an error under PythonDebug")
+
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        conn.putrequest("GET", "/tests.py", skip_host=1)
+        conn.putheader("Host", "%s:%s" % ("test_req_set_buffering_error", PORT))
+        conn.endheaders()
+        response = conn.getresponse()
+        rsp = response.read()
+        conn.close()
+
+        if response.status != 500:
+            self.fail("%d %s" % (response.status, repr(rsp)))
+        if b"Mod_python error" not in rsp or b"buffered error" not in rsp:
+            self.fail(repr(rsp))
+        if response.getheader("content-length", None) != str(len(rsp)):
+            self.fail(repr(response.getheader("content-length", None)))
+
+    def test_req_set_buffering_phase_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_req_set_buffering_phase"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonFixupHandler("tests::req_set_buffering_phase_fixup"),
+                                  PythonHandler("tests::req_set_buffering_phase"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_req_set_buffering_phase(self):
+
+        print("\n  * Testing req.set_buffering() outside of PythonHandler")
+
+        conn = http_connection("127.0.0.1:%s" % PORT)
+        conn.putrequest("GET", "/tests.py", skip_host=1)
+        conn.putheader("Host", "%s:%s" % ("test_req_set_buffering_phase", PORT))
+        conn.endheaders()
+        response = conn.getresponse()
+        rsp = response.read()
+        conn.close()
+
+        if rsp != b"ValueError":
+            self.fail(repr(rsp))
+
+    def test_req_write_flush_conf(self):
+
+        c = VirtualHost("*",
+                        ServerName("test_req_write_flush"),
+                        DocumentRoot(DOCUMENT_ROOT),
+                        Directory(DOCUMENT_ROOT,
+                                  SetHandler("mod_python"),
+                                  PythonHandler("tests::req_write_flush"),
+                                  PythonOption("mod_python.write.flush 4k"),
+                                  PythonDebug("On")))
+        return c
+
+    def test_req_write_flush(self):
+
+        print("\n  * Testing mod_python.write.flush")
+
+        rsp = self.vhost_get("test_req_write_flush")
+
+        # 10 writes of 1000 bytes, flushed every 4096
+        if rsp != "x" * 10000 + " 2":
+            self.fail(repr(rsp[-10:]))
+
 class PerInstanceTestCase(unittest.TestCase, HttpdCtrl):
     # this is a test case which requires a complete
     # restart of httpd (e.g. we're using a fancy config)
@@ -2986,6 +4000,9 @@ class PerInstanceTestCase(unittest.TestCase, HttpdCtrl):
         perRequestSuite.addTest(PerRequestTestCase("test_req_sendfile"))
         perRequestSuite.addTest(PerRequestTestCase("test_req_sendfile2"))
         perRequestSuite.addTest(PerRequestTestCase("test_req_sendfile3"))
+        perRequestSuite.addTest(PerRequestTestCase("test_req_sendfile4"))
+        perRequestSuite.addTest(PerRequestTestCase("test_util_send_file"))
+        perRequestSuite.addTest(PerRequestTestCase("test_table_index_bench"))
         perRequestSuite.addTest(PerRequestTestCase("test_req_handler"))
         perRequestSuite.addTest(PerRequestTestCase("test_req_no_cache"))
         perRequestSuite.addTest(PerRequestTestCase("test_req_update_mtime"))
@@ -3000,9 +4017,19 @@ class PerInstanceTestCase(unittest.TestCase, HttpdCtrl):
         perRequestSuite.addTest(PerRequestTestCase("test_PythonOption_remove"))
         perRequestSuite.addTest(PerRequestTestCase("test_PythonOption_remove2"))
         perRequestSuite.addTest(PerRequestTestCase("test_util_fieldstorage"))
+        perRequestSuite.addTest(PerRequestTestCase("test_decompress_filter"))
         perRequestSuite.addTest(PerRequestTestCase("test_postreadrequest"))
         perRequestSuite.addTest(PerRequestTestCase("test_trans"))
         perRequestSuite.addTest(PerRequestTestCase("test_outputfilter"))
+        perRequestSuite.addTest(PerRequestTestCase("test_buffer_write"))
+        perRequestSuite.addTest(PerRequestTestCase("test_filter_buckets"))
+        perRequestSuite.addTest(PerRequestTestCase("test_filter_buckets_kept"))
+        perRequestSuite.addTest(PerRequestTestCase("test_filter_ctx"))
+        perRequestSuite.addTest(PerRequestTestCase("test_compress_filter"))
+        perRequestSuite.addTest(PerRequestTestCase("test_microcache"))
+        perRequestSuite.addTest(PerRequestTestCase("test_microcache_refuse"))
+        perRequestSuite.addTest(PerRequestTestCase("test_microcache_cookie"))
+        perRequestSuite.addTest(PerRequestTestCase("test_microcache_expire"))
         perRequestSuite.addTest(PerRequestTestCase("test_req_add_output_filter"))
         perRequestSuite.addTest(PerRequestTestCase("test_req_register_output_filter"))
         perRequestSuite.addTest(PerRequestTestCase("test_connectionhandler"))
@@ -3032,10 +4059,30 @@ class PerInstanceTestCase(unittest.TestCase, HttpdCtrl):
         # perRequestSuite.addTest(PerRequestTestCase("test_publisher_iterator"))
         perRequestSuite.addTest(PerRequestTestCase("test_publisher_hierarchy"))
         perRequestSuite.addTest(PerRequestTestCase("test_server_side_include"))
+        perRequestSuite.addTest(PerRequestTestCase("test_ssi_code_cache"))
         if APACHE_VERSION == '2.4' and sys.platform.startswith("linux") and THREADS:
             perRequestSuite.addTest(PerRequestTestCase("test_memory"))
         perRequestSuite.addTest(PerRequestTestCase("test_wsgihandler"))
         perRequestSuite.addTest(PerRequestTestCase("test_wsgihandler_location"))
+        perRequestSuite.addTest(PerRequestTestCase("test_handler_cache"))
+        perRequestSuite.addTest(PerRequestTestCase("test_dispatch_stats"))
+        perRequestSuite.addTest(PerRequestTestCase("test_profile_sample"))
+        perRequestSuite.addTest(PerRequestTestCase("test_profile_sample_off"))
+        perRequestSuite.addTest(PerRequestTestCase("test_watchdog_nested"))
+        perRequestSuite.addTest(PerRequestTestCase("test_async_handler"))
+        perRequestSuite.addTest(PerRequestTestCase("test_wsgihandler_buffered"))
+        perRequestSuite.addTest(PerRequestTestCase("test_wsgihandler_buffer_types"))
+        perRequestSuite.addTest(PerRequestTestCase("test_wsgihandler_file_wrapper"))
+        perRequestSuite.addTest(PerRequestTestCase("test_wsgihandler_file_wrapper_tempfile"))
+        perRequestSuite.addTest(PerRequestTestCase("test_wsgihandler_env_duplicates"))
+        perRequestSuite.addTest(PerRequestTestCase("test_wsgihandler_preload"))
+        perRequestSuite.addTest(PerRequestTestCase("test_asgihandler"))
+        perRequestSuite.addTest(PerRequestTestCase("test_req_readinto"))
+        perRequestSuite.addTest(PerRequestTestCase("test_req_iter_body"))
+        perRequestSuite.addTest(PerRequestTestCase("test_req_set_buffering"))
+        perRequestSuite.addTest(PerRequestTestCase("test_req_set_buffering_error"))
+        perRequestSuite.addTest(PerRequestTestCase("test_req_set_buffering_phase"))
+        perRequestSuite.addTest(PerRequestTestCase("test_req_write_flush"))
 
         # test_publisher_cache does not work correctly for mpm-prefork/worker
         # and it may not be possible to get a reliable test for all